@@ -0,0 +1,126 @@
+"""
+Animated sweeps through the slices of a segmented study.
+
+Each modality is windowed to uint8 once for the whole volume, then frames
+are produced one at a time by a generator as indices into a fixed palette of
+gray levels plus the label colors, so GIF frames need no quantization and
+take one byte per pixel. How long a slice stays on screen is its frame
+duration rather than a number of repeated frames.
+"""
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from .label_maps import to_uint8
+from .rendering import LABEL_COLORS
+
+FORMATS = {'gif': '.gif', 'webp': '.webp', 'mp4': '.mp4'}
+
+# Palette: gray levels first, then the colors of labels 1-3
+GRAY_LEVELS = 253
+PALETTE = np.zeros((256, 3), dtype=np.uint8)
+PALETTE[:GRAY_LEVELS] = np.rint(np.linspace(0, 255, GRAY_LEVELS))[:, None]
+PALETTE[GRAY_LEVELS:] = LABEL_COLORS[1:]
+
+# uint8 intensity to palette index, and label to palette index
+GRAY_INDEX = np.rint(np.arange(256) * (GRAY_LEVELS - 1) / 255).astype(np.uint8)
+LABEL_INDEX = np.array([0, GRAY_LEVELS, GRAY_LEVELS + 1, GRAY_LEVELS + 2], dtype=np.uint8)
+
+
+def sweep(count):
+    """Positions of a back-and-forth sweep through ``count`` slices, ends shown once"""
+    forward = list(range(count))
+    return forward + forward[-2:0:-1]
+
+
+def iter_frames(volumes, labels, order):
+    """
+    Palette-index frames of the uint8 ``volumes`` side by side with the
+    label map, for each slice position along the last axis in ``order``.
+    """
+    height, width = labels.shape[:2]
+    panels = len(volumes) + 1
+    for z in order:
+        frame = np.empty((height, panels * width), dtype=np.uint8)
+        for i, volume in enumerate(volumes):
+            np.take(GRAY_INDEX, volume[:, :, z], out=frame[:, i * width:(i + 1) * width])
+        np.take(LABEL_INDEX, np.clip(labels[:, :, z], 0, 3), out=frame[:, -width:])
+        yield frame
+
+
+def palette_image(frame):
+    image = Image.fromarray(frame)
+    image.putpalette(PALETTE.tobytes())
+    return image
+
+
+def encode_animation(frames, frame_ms, path, fmt='gif'):
+    """Write palette-index ``frames`` to ``path`` with ``frame_ms`` milliseconds per frame"""
+    if fmt == 'gif':
+        images = (palette_image(frame) for frame in frames)
+        first = next(images)
+        # The palette is shared by every frame, optimizing it would make local palettes
+        first.save(path, save_all=True, append_images=images, duration=frame_ms,
+                   loop=0, optimize=False, disposal=1)
+    elif fmt == 'webp':
+        images = (Image.fromarray(PALETTE[frame]) for frame in frames)
+        first = next(images)
+        first.save(path, save_all=True, append_images=images, duration=frame_ms,
+                   loop=0, quality=80, method=4)
+    elif fmt == 'mp4':
+        write_mp4(frames, frame_ms, path)
+    else:
+        raise ValueError(f"Unknown animation format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+
+def write_mp4(frames, frame_ms, path):
+    """H.264 through imageio-ffmpeg, which streams each frame to the encoder"""
+    try:
+        import imageio
+        import imageio_ffmpeg  # noqa: F401
+    except ImportError:
+        raise RuntimeError("MP4 animations need the imageio-ffmpeg package")
+
+    writer = imageio.get_writer(path, format='FFMPEG', fps=1000.0 / frame_ms, codec='libx264',
+                                pixelformat='yuv420p', macro_block_size=1, quality=7)
+    try:
+        for frame in frames:
+            rgb = PALETTE[frame]
+            # yuv420p needs even dimensions
+            pad = ((0, rgb.shape[0] % 2), (0, rgb.shape[1] % 2), (0, 0))
+            writer.append_data(np.pad(rgb, pad) if any(p[1] for p in pad) else rgb)
+    finally:
+        writer.close()
+
+
+def write_animation(images, prediction, output_dir, fmt='gif', step=2, frame_ms=150,
+                    modalities=('T1', 'T1c', 'T2', 'FLAIR')):
+    """
+    Encode a sweep through every ``step``-th slice of the study into
+    ``output_dir``. Returns the file name, frame count, encode time and size.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown animation format '{fmt}', expected one of {', '.join(FORMATS)}")
+    start = time.perf_counter()
+    indices = np.arange(0, prediction.shape[2], step)
+    volumes = [to_uint8(images[name][:, :, indices]) for name in modalities]
+    labels = prediction[:, :, indices]
+    order = sweep(len(indices))
+
+    filename = f"animation{FORMATS[fmt]}"
+    path = os.path.join(output_dir, filename)
+    encode_animation(iter_frames(volumes, labels, order), frame_ms, path, fmt)
+
+    info = {
+        'file': filename,
+        'format': fmt,
+        'frames': len(order),
+        'frame_ms': frame_ms,
+        'encode_seconds': round(time.perf_counter() - start, 3),
+        'bytes': os.path.getsize(path),
+    }
+    print(f"Encoded {fmt} animation: {info['frames']} frames, {info['bytes'] / 2**20:.2f} MB "
+          f"in {info['encode_seconds']:.2f}s")
+    return info
@@ -0,0 +1,232 @@
+import copy
+import os
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .inference import SIZE_DIVISOR, round_up
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'onnx')
+
+# Compiled graphs are reused for every input padded up to the same bucket.
+# Inputs are already multiples of the network's divisor, so bucketing at it
+# never pads them; zero padding past it would change the logits at the border.
+SPATIAL_BUCKET = SIZE_DIVISOR
+
+# Input used to trace/export and to compare each backend with eager PyTorch
+SELF_TEST_SHAPE = (1, 4, 32, 32, 32)
+# Shapes the self-test also compares, padded in batch and space under coarser buckets
+SELF_TEST_SHAPES = (SELF_TEST_SHAPE, (3, 4, 48, 32, 16))
+
+
+def batch_bucket(n):
+    return 1 << (n - 1).bit_length()
+
+
+def bucket_shape(shape, spatial_bucket=SPATIAL_BUCKET):
+    n, c, *spatial = shape
+    return (batch_bucket(n), c, *[round_up(s, spatial_bucket) for s in spatial])
+
+
+class Backend:
+    """Callable running a batch through some execution engine"""
+
+    name = None
+
+    def __init__(self, model, device, **kwargs):
+        self.model = model
+        self.device = torch.device(device)
+
+    def run(self, batch):
+        return self.model(batch)
+
+    def __call__(self, batch):
+        return self.run(batch)
+
+
+class BucketedBackend(Backend):
+    """
+    Pads each batch up to a shape bucket before running it.
+
+    Graph backends specialise on input shapes, bucketing the batch size to a
+    power of two and spatial edges to multiples of ``spatial_bucket`` bounds
+    the number of distinct graphs they build.
+    """
+
+    def __init__(self, model, device, spatial_bucket=SPATIAL_BUCKET, **kwargs):
+        super().__init__(model, device)
+        self.spatial_bucket = spatial_bucket
+        self.shapes_seen = set()
+
+    def __call__(self, batch):
+        n, c, *spatial = batch.shape
+        target = bucket_shape(batch.shape, self.spatial_bucket)
+        pad = []
+        for size, padded in reversed(list(zip(spatial, target[2:]))):
+            pad.extend([0, padded - size])
+        if any(pad):
+            batch = F.pad(batch, pad)
+        if target[0] > n:
+            batch = torch.cat([batch, batch.new_zeros((target[0] - n, *batch.shape[1:]))])
+
+        if target not in self.shapes_seen:
+            print(f"{self.name} backend: new shape bucket {target}")
+            self.shapes_seen.add(target)
+
+        logits = self.run(batch)
+        return logits[:n, :, :spatial[0], :spatial[1], :spatial[2]]
+
+
+class TorchScriptBackend(BucketedBackend):
+    name = 'torchscript'
+
+    def __init__(self, model, device, **kwargs):
+        super().__init__(model, device, **kwargs)
+        self.model = export_torchscript(model, device)
+
+
+class CompileBackend(BucketedBackend):
+    name = 'compile'
+
+    def __init__(self, model, device, **kwargs):
+        super().__init__(model, device, **kwargs)
+        self.model = torch.compile(model, dynamic=False)
+
+
+class OnnxBackend(BucketedBackend):
+    """Exported ONNX graph run by ONNX Runtime's CPU execution provider"""
+
+    name = 'onnx'
+
+    def __init__(self, model, device, onnx_path=None, **kwargs):
+        super().__init__(model, device, **kwargs)
+        if ort is None:
+            raise RuntimeError("The onnx backend needs the onnxruntime package")
+        exported = onnx_path is None
+        if exported:
+            fd, onnx_path = tempfile.mkstemp(suffix='.onnx')
+            os.close(fd)
+        try:
+            if exported:
+                export_onnx(model, onnx_path)
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        finally:
+            if exported:
+                # The session holds the graph in memory, the file is not needed any more
+                os.remove(onnx_path)
+        self.onnx_path = None if exported else onnx_path
+
+    def run(self, batch):
+        image = batch.detach().cpu().numpy().astype(np.float32, copy=False)
+        logits = self.session.run(None, {'image': image})[0]
+        return torch.from_numpy(logits).to(batch.device)
+
+
+BACKEND_CLASSES = {
+    'torchscript': TorchScriptBackend,
+    'compile': CompileBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def export_torchscript(model, device, path=None):
+    """Traced and frozen copy of ``model``, also written to ``path`` if given"""
+    with torch.inference_mode(False), torch.no_grad():
+        example = torch.zeros(SELF_TEST_SHAPE, device=device)
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+        if path:
+            torch.jit.save(scripted, path)
+    return scripted
+
+
+def export_onnx(model, path):
+    """Write ``model`` as ONNX with dynamic batch and spatial axes"""
+    dynamic = {0: 'batch', 2: 'x', 3: 'y', 4: 'z'}
+    tmp_path = f"{path}.tmp"
+    with torch.inference_mode(False), torch.no_grad():
+        torch.onnx.export(
+            copy.deepcopy(model).cpu(),
+            (torch.zeros(SELF_TEST_SHAPE),),
+            tmp_path,
+            input_names=['image'],
+            output_names=['logits'],
+            dynamic_axes={'image': dynamic, 'logits': dynamic},
+            opset_version=17,
+            dynamo=False,
+        )
+    os.replace(tmp_path, path)
+    return path
+
+
+def artifact_path(checkpoint_path, backend):
+    """Where exported graphs for ``checkpoint_path`` are kept"""
+    stem = os.path.splitext(checkpoint_path)[0]
+    return {'onnx': f"{stem}.onnx", 'torchscript': f"{stem}.ts.pt"}.get(backend)
+
+
+def self_test(backend, reference, device, min_agreement=0.999, rtol=1e-3):
+    """
+    Compare ``backend`` with the eager ``reference`` model on random inputs
+    of ``SELF_TEST_SHAPES``, including one the backend has to pad.
+
+    Passes when, for every input, the argmax labels agree on at least
+    ``min_agreement`` of the voxels and no logit is further off than
+    ``rtol`` times the largest one. Returns (ok, max_abs_logit_diff,
+    argmax_agreement), the worst over all inputs.
+    """
+    generator = torch.Generator().manual_seed(0)
+    ok, max_diff, agreement = True, 0.0, 1.0
+    for shape in SELF_TEST_SHAPES:
+        image = torch.rand(shape, generator=generator).to(device)
+        with torch.inference_mode():
+            expected = reference(image).float()
+            actual = backend(image).float()
+        diff = float((expected - actual).abs().max())
+        matching = float((expected.argmax(1) == actual.argmax(1)).float().mean())
+        ok = ok and matching >= min_agreement and diff <= rtol * float(expected.abs().max())
+        max_diff, agreement = max(max_diff, diff), min(agreement, matching)
+    return ok, max_diff, agreement
+
+
+def create_backend(name, model, device, checkpoint_path=None, run_self_test=True,
+                   spatial_bucket=SPATIAL_BUCKET):
+    """
+    Wrap an eager ``model`` in the named backend, 'eager' returns it unchanged.
+
+    Backends that fail to build or disagree with eager PyTorch on the self-test
+    fall back to eager so a worker never serves a broken graph.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}")
+    if name == 'eager':
+        return model
+
+    options = {'spatial_bucket': spatial_bucket}
+    if name == 'onnx' and checkpoint_path:
+        onnx_path = artifact_path(checkpoint_path, 'onnx')
+        if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(checkpoint_path):
+            options['onnx_path'] = onnx_path
+
+    try:
+        backend = BACKEND_CLASSES[name](model, device, **options)
+    except Exception as e:
+        print(f"Could not build the {name} backend, using eager: {str(e)}")
+        return model
+
+    if run_self_test:
+        ok, max_diff, agreement = self_test(backend, model, device)
+        print(f"{name} backend self-test: max |diff| {max_diff:.2e}, argmax agreement {agreement:.5f}")
+        if not ok:
+            print(f"{name} backend does not match eager PyTorch, using eager")
+            return model
+    return backend
@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import torch
+
+
+class DynamicBatcher:
+    """
+    Coalesces patches submitted by concurrent jobs into batched forward passes.
+
+    A batch is run as soon as ``max_batch_size`` patches are waiting or
+    ``max_wait`` seconds have passed since the first one arrived, whichever
+    comes first. Larger batches favour throughput, a shorter wait favours
+    latency. Calling the batcher with a (N, C, X, Y, Z) tensor behaves like
+    calling the model, so it can be passed anywhere a model is expected. A
+    call that gets no logits within ``result_timeout`` seconds raises
+    instead of waiting forever.
+    """
+
+    def __init__(self, model, device, max_batch_size=4, max_wait=0.02, result_timeout=None):
+        self.model = model
+        self.device = torch.device(device)
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max_wait
+        self.result_timeout = result_timeout
+        self.batches = 0
+        self.items = 0
+        self.users = 0
+        self.retired = False
+        self._closed = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='brainseg-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, patch):
+        """Queue a single (C, X, Y, Z) patch, resolves to its (K, X, Y, Z) logits"""
+        if self._closed:
+            raise RuntimeError("Batcher is closed")
+        future = Future()
+        self._queue.put((patch, future))
+        return future
+
+    def __call__(self, batch):
+        futures = [self.submit(patch) for patch in batch]
+        try:
+            return torch.stack([future.result(timeout=self.result_timeout) for future in futures])
+        except FutureTimeout:
+            raise RuntimeError(f"Batched inference gave no result within {self.result_timeout:.0f}s")
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        # Patches that slipped in behind the sentinel fail instead of waiting
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("Batcher is closed"))
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            pending = [first]
+            deadline = time.monotonic() + self.max_wait
+            closing = False
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                pending.append(item)
+
+            # Patches of different jobs may differ in shape near small volumes
+            groups = defaultdict(list)
+            for patch, future in pending:
+                groups[tuple(patch.shape)].append((patch, future))
+            for items in groups.values():
+                self._execute(items)
+
+            if closing:
+                return
+
+    def _execute(self, items):
+        try:
+            with torch.inference_mode():
+                batch = torch.stack([patch for patch, _ in items]).to(self.device)
+                logits = self.model(batch).float().cpu()
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), patch_logits in zip(items, logits):
+                future.set_result(patch_logits)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+
+
+# Batchers by (id of the model, device); each one holds its model, so ids are not reused
+_batchers = {}
+_batchers_lock = threading.Lock()
+# Models the registry let go of; batchers made for them close with their last caller
+_retired = weakref.WeakSet()
+
+
+def batching_settings():
+    from django.conf import settings
+    return {
+        'max_batch_size': getattr(settings, 'BRAINSEG_MAX_BATCH_SIZE', 1),
+        'max_wait': getattr(settings, 'BRAINSEG_MAX_BATCH_WAIT_MS', 20) / 1000.0,
+        'result_timeout': getattr(settings, 'BRAINSEG_BATCH_RESULT_TIMEOUT_SECONDS', None),
+    }
+
+
+@contextmanager
+def batched(model, device):
+    """
+    Shared batcher for ``model`` on ``device``, for the duration of the block.
+
+    Jobs running the same model on the same device share one batcher. Yields
+    the model itself when batching is disabled (max batch size 1).
+    """
+    options = batching_settings()
+    if options['max_batch_size'] <= 1:
+        yield model
+        return
+
+    key = (id(model), str(torch.device(device)))
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = DynamicBatcher(model, device, **options)
+            batcher.retired = model in _retired
+        batcher.users += 1
+    try:
+        yield batcher
+    finally:
+        with _batchers_lock:
+            batcher.users -= 1
+            done = batcher.retired and batcher.users == 0
+            if done and _batchers.get(key) is batcher:
+                del _batchers[key]
+        if done:
+            batcher.close()
+
+
+def retire_batchers(model):
+    """
+    Close the batchers of a model the registry no longer serves, each one
+    once the jobs still running inference through it are done
+    """
+    with _batchers_lock:
+        _retired.add(model)
+        idle = []
+        for key, batcher in list(_batchers.items()):
+            if batcher.model is model:
+                batcher.retired = True
+                if batcher.users == 0:
+                    idle.append(_batchers.pop(key))
+    for batcher in idle:
+        batcher.close()
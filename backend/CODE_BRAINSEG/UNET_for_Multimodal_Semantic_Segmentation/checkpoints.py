@@ -0,0 +1,115 @@
+"""
+Flat tensor checkpoints in the safetensors layout.
+
+A file is an 8-byte little-endian header length, a JSON header mapping each
+tensor name to its dtype, shape and byte range, then the raw tensor bytes.
+Files can be read back with the ``safetensors`` package, but loading here
+needs nothing beyond numpy: the data is memory-mapped copy-on-write, so every
+worker on a node shares one copy of the weights through the page cache.
+"""
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+import torch
+
+FLAT_SUFFIX = '.safetensors'
+
+DTYPES = {
+    torch.float64: ('F64', np.float64),
+    torch.float32: ('F32', np.float32),
+    torch.float16: ('F16', np.float16),
+    torch.int64: ('I64', np.int64),
+    torch.int32: ('I32', np.int32),
+    torch.uint8: ('U8', np.uint8),
+    torch.bool: ('BOOL', np.bool_),
+}
+NUMPY_DTYPES = {code: np_dtype for code, np_dtype in DTYPES.values()}
+
+
+def write_flat(state_dict, path, metadata=None):
+    """Atomically write a state dict of tensors to ``path``"""
+    # Widest dtypes first keeps every tensor aligned without gaps in the buffer
+    names = sorted(state_dict, key=lambda n: -state_dict[n].element_size())
+    header = {}
+    offset = 0
+    for name in names:
+        tensor = state_dict[name]
+        if tensor.dtype not in DTYPES:
+            raise TypeError(f"Unsupported dtype {tensor.dtype} for '{name}'")
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            'dtype': DTYPES[tensor.dtype][0],
+            'shape': list(tensor.shape),
+            'data_offsets': [offset, offset + nbytes],
+        }
+        offset += nbytes
+    if metadata:
+        header['__metadata__'] = {key: str(value) for key, value in metadata.items()}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad the header so the tensor data starts 8-byte aligned
+    encoded += b' ' * (-(8 + len(encoded)) % 8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack('<Q', len(encoded)))
+            f.write(encoded)
+            for name in names:
+                f.write(state_dict[name].detach().cpu().contiguous().numpy().tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+def read_flat(path):
+    """State dict whose tensors are views into a copy-on-write memory map of ``path``"""
+    header, data_start = read_header(path)
+    header.pop('__metadata__', None)
+    buffer = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = {}
+    for name, info in header.items():
+        start, stop = info['data_offsets']
+        array = buffer[data_start + start:data_start + stop].view(NUMPY_DTYPES[info['dtype']])
+        state_dict[name] = torch.from_numpy(array.reshape(info['shape']))
+    return state_dict
+
+
+def flat_path(checkpoint_path):
+    return os.path.splitext(checkpoint_path)[0] + FLAT_SUFFIX
+
+
+def prefer_flat(checkpoint_path):
+    """The converted flat file for a checkpoint, if there is an up-to-date one"""
+    if checkpoint_path.endswith(FLAT_SUFFIX):
+        return checkpoint_path
+    converted = flat_path(checkpoint_path)
+    if os.path.exists(converted) and (
+        not os.path.exists(checkpoint_path)
+        or os.path.getmtime(converted) >= os.path.getmtime(checkpoint_path)
+    ):
+        return converted
+    return checkpoint_path
+
+
+def file_signature(path):
+    """Identifies the file currently at ``path``, changes when it is replaced"""
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size, stat.st_ino
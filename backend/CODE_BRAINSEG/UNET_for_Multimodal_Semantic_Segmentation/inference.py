@@ -0,0 +1,139 @@
+import itertools
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# UNet3D pools four times by 2, so every patch edge has to divide by 16
+SIZE_DIVISOR = 16
+
+DEFAULT_PATCH_SIZE = (128, 128, 128)
+DEFAULT_OVERLAP = 0.5
+
+# Rough peak of live float32 activations per input voxel during a UNet3D
+# forward pass (full-resolution 32/64-channel decoder tensors dominate)
+ACTIVATION_FLOATS_PER_VOXEL = 256
+
+
+def round_up(value, multiple=SIZE_DIVISOR):
+    return int(math.ceil(value / multiple) * multiple)
+
+
+def gaussian_importance_map(patch_size, sigma_scale=0.125, device=None):
+    """Per-voxel blending weights peaking at the patch centre"""
+    axes = []
+    for size in patch_size:
+        coords = torch.arange(size, dtype=torch.float32, device=device) - (size - 1) / 2
+        sigma = max(size * sigma_scale, 1e-3)
+        axes.append(torch.exp(-0.5 * (coords / sigma) ** 2))
+    weights = axes[0][:, None, None] * axes[1][None, :, None] * axes[2][None, None, :]
+    weights /= weights.max()
+    # Keep the borders above zero so every voxel receives some weight
+    return weights.clamp_(min=1e-3)
+
+
+def patch_starts(dim, patch, overlap):
+    if dim <= patch:
+        return [0]
+    stride = max(int(patch * (1 - overlap)), 1)
+    starts = list(range(0, dim - patch, stride))
+    starts.append(dim - patch)
+    return starts
+
+
+def estimate_memory(volume_shape, patch_size, in_channels=4, out_channels=4, batch_size=1):
+    """Approximate peak bytes for tiled inference over ``volume_shape``"""
+    voxels = int(np.prod(volume_shape))
+    patch_voxels = int(np.prod(patch_size))
+    buffers = voxels * (in_channels + out_channels + 1)
+    activations = batch_size * patch_voxels * ACTIVATION_FLOATS_PER_VOXEL
+    return (buffers + activations) * 4
+
+
+def fit_patch_size(volume_shape, patch_size, memory_limit=None, in_channels=4,
+                   out_channels=4, batch_size=1):
+    """Clamp the patch to the (padded) volume and shrink it until it fits ``memory_limit``"""
+    patch = [min(round_up(p), round_up(d)) for p, d in zip(patch_size, volume_shape)]
+    padded = [max(d, p) for d, p in zip(volume_shape, patch)]
+
+    while memory_limit and estimate_memory(padded, patch, in_channels, out_channels,
+                                           batch_size) > memory_limit:
+        largest = int(np.argmax(patch))
+        if patch[largest] <= SIZE_DIVISOR:
+            raise MemoryError(
+                f"Volume {tuple(volume_shape)} cannot be processed within "
+                f"{memory_limit / 2**20:.0f} MB"
+            )
+        patch[largest] -= SIZE_DIVISOR
+        padded = [max(d, p) for d, p in zip(volume_shape, patch)]
+    return tuple(patch)
+
+
+def sliding_window_inference(model, image, patch_size=DEFAULT_PATCH_SIZE,
+                             overlap=DEFAULT_OVERLAP, batch_size=1, memory_limit=None,
+                             out_channels=4, device=None):
+    """
+    Run ``model`` over a (C, H, W, D) volume patch by patch.
+
+    Overlapping patch logits are blended with a Gaussian weight into a single
+    preallocated buffer, so peak memory is bounded by the patch size rather
+    than the volume size. Volumes of any shape are padded up to whole patches
+    and the result is cropped back. Returns float32 logits of shape
+    (out_channels, H, W, D) on the CPU.
+    """
+    device = torch.device(device) if device is not None else image.device
+    in_channels, *spatial = image.shape
+
+    patch = fit_patch_size(spatial, patch_size, memory_limit, in_channels, out_channels,
+                           batch_size)
+    padded_shape = [max(d, p) for d, p in zip(spatial, patch)]
+    pad = []
+    for d, p in reversed(list(zip(spatial, padded_shape))):
+        pad.extend([0, p - d])
+    if any(pad):
+        image = F.pad(image, pad)
+
+    output = torch.zeros((out_channels, *padded_shape), dtype=torch.float32)
+    weight_sum = torch.zeros(padded_shape, dtype=torch.float32)
+    importance = gaussian_importance_map(patch)
+
+    starts = [patch_starts(d, p, overlap) for d, p in zip(padded_shape, patch)]
+    locations = list(itertools.product(*starts))
+
+    for i in range(0, len(locations), batch_size):
+        chunk = locations[i:i + batch_size]
+        batch = torch.stack([
+            image[:, x:x + patch[0], y:y + patch[1], z:z + patch[2]]
+            for x, y, z in chunk
+        ]).to(device)
+
+        logits = model(batch).float().cpu()
+
+        for (x, y, z), patch_logits in zip(chunk, logits):
+            region = (slice(x, x + patch[0]), slice(y, y + patch[1]), slice(z, z + patch[2]))
+            output[(slice(None), *region)].addcmul_(patch_logits, importance)
+            weight_sum[region].add_(importance)
+
+    output.div_(weight_sum)
+    return output[:, :spatial[0], :spatial[1], :spatial[2]]
+
+
+def inference_settings():
+    from django.conf import settings
+    memory_mb = getattr(settings, 'BRAINSEG_INFERENCE_MEMORY_MB', None)
+    return {
+        'patch_size': tuple(getattr(settings, 'BRAINSEG_PATCH_SIZE', DEFAULT_PATCH_SIZE)),
+        'overlap': getattr(settings, 'BRAINSEG_PATCH_OVERLAP', DEFAULT_OVERLAP),
+        'batch_size': getattr(settings, 'BRAINSEG_PATCH_BATCH_SIZE', 1),
+        'memory_limit': int(memory_mb * 2**20) if memory_mb else None,
+    }
+
+
+def predict_volume(model, image_tensor, device, **overrides):
+    """Label map (H, W, D) uint8 for a normalized (4, H, W, D) tensor"""
+    options = inference_settings()
+    options.update(overrides)
+    with torch.inference_mode():
+        logits = sliding_window_inference(model, image_tensor, device=device, **options)
+        return torch.argmax(logits, dim=0).to(torch.uint8).numpy()
@@ -0,0 +1,76 @@
+"""
+Compact copies of a segmented study kept next to its rendered previews.
+
+The label map is stored at full resolution as uint8 (labels 0-3) in a
+compressed ``.npz``, with the affine and voxel spacing of the input. Each
+modality is stored once more as a uint8 display copy, windowed to its
+foreground percentiles and subsampled by ``factor`` along every axis, which
+is all a viewer needs to draw any slice of the study without the original
+float volumes or another inference run.
+"""
+import os
+
+import numpy as np
+
+LABEL_MAP_FILE = 'mask.npz'
+MODALITIES_FILE = 'modalities.npz'
+
+# Display window of the uint8 modality copies, in foreground percentiles
+DISPLAY_PERCENTILES = (0.5, 99.5)
+
+
+def to_uint8(volume, percentiles=DISPLAY_PERCENTILES):
+    """Window a volume to its foreground percentiles and scale it to 0-255, background stays 0"""
+    foreground = volume != 0
+    values = volume[foreground]
+    out = np.zeros(volume.shape, dtype=np.uint8)
+    if values.size == 0:
+        return out
+    low, high = np.percentile(values, percentiles)
+    if high <= low:
+        out[foreground] = 255
+        return out
+    scaled = (values - low) * (255.0 / (high - low))
+    np.clip(scaled, 0, 255, out=scaled)
+    out[foreground] = np.rint(scaled).astype(np.uint8)
+    return out
+
+
+def save_label_map(prediction, output_dir, affine=None, spacing=None):
+    """Store the label map as compressed uint8, returns the file path"""
+    path = os.path.join(output_dir, LABEL_MAP_FILE)
+    np.savez_compressed(
+        path,
+        mask=np.ascontiguousarray(prediction, dtype=np.uint8),
+        affine=np.eye(4) if affine is None else np.asarray(affine, dtype=np.float64),
+        spacing=np.ones(3) if spacing is None else np.asarray(spacing, dtype=np.float64),
+    )
+    return path
+
+
+def save_display_volumes(images, output_dir, factor=2):
+    """
+    Store uint8 display copies of the modalities in ``images`` (name to
+    array), subsampled by ``factor``. Returns the file path.
+    """
+    factor = max(int(factor), 1)
+    arrays = {
+        name: to_uint8(np.ascontiguousarray(volume[::factor, ::factor, ::factor]))
+        for name, volume in images.items()
+    }
+    path = os.path.join(output_dir, MODALITIES_FILE)
+    np.savez_compressed(path, factor=np.int64(factor), **arrays)
+    return path
+
+
+def load_label_map(output_dir):
+    """Returns ``(mask, affine, spacing)`` of a stored study"""
+    with np.load(os.path.join(output_dir, LABEL_MAP_FILE)) as data:
+        return data['mask'], data['affine'], data['spacing']
+
+
+def load_display_volumes(output_dir):
+    """Returns ``(volumes, factor)``, the uint8 display copies by modality"""
+    with np.load(os.path.join(output_dir, MODALITIES_FILE)) as data:
+        factor = int(data['factor'])
+        return {name: data[name] for name in data.files if name != 'factor'}, factor
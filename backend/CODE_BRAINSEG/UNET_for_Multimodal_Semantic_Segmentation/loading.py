@@ -0,0 +1,105 @@
+"""
+NIfTI loading straight into one preallocated (modalities, H, W, D) buffer.
+
+``nib.load(...).get_fdata()`` materialises a float64 copy of every volume,
+which the old path then copied three more times on the way to a tensor.
+Here uncompressed files are memory-mapped, gzipped ones are decompressed a
+few slices at a time, and in both cases the voxels are converted to float32
+while being written into their channel of the shared buffer. The modalities
+are read in parallel threads; zlib and numpy release the GIL while they work.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import nibabel as nib
+import numpy as np
+from nibabel.openers import ImageOpener
+
+# Decompressed bytes held at once per modality while streaming a .nii.gz
+CHUNK_BYTES = 8 * 2**20
+
+
+def volume_shape(image):
+    """Spatial shape of a NIfTI image, trailing singleton dimensions dropped"""
+    shape = image.shape
+    if len(shape) < 3 or any(s != 1 for s in shape[3:]):
+        raise ValueError(f"Expected a 3D volume, got shape {shape}")
+    return tuple(shape[:3])
+
+
+def scaling(proxy):
+    slope, inter = proxy.slope, proxy.inter
+    slope = 1.0 if slope is None or not np.isfinite(slope) or slope == 0 else float(slope)
+    inter = 0.0 if inter is None or not np.isfinite(inter) else float(inter)
+    return slope, inter
+
+
+def iter_slabs(image, shape, dtype):
+    """Yield (z, array) runs of whole slices along the last axis, in file order"""
+    proxy = image.dataobj
+    path = image.get_filename()
+    slice_bytes = shape[0] * shape[1] * dtype.itemsize
+    step = max(1, CHUNK_BYTES // slice_bytes)
+
+    if not path.endswith('.gz'):
+        # Page cache backed, only the touched pages are read
+        data = np.memmap(path, dtype=dtype, mode='r', offset=proxy.offset,
+                         shape=shape, order='F')
+        for z in range(0, shape[2], step):
+            yield z, data[:, :, z:z + step]
+        return
+
+    # NIfTI stores voxels in Fortran order, so each run of whole slices
+    # along the last axis is a contiguous range of the stream
+    with ImageOpener(path, 'rb') as f:
+        f.seek(proxy.offset)
+        for z in range(0, shape[2], step):
+            count = min(step, shape[2] - z)
+            raw = f.read(count * slice_bytes)
+            if len(raw) != count * slice_bytes:
+                raise ValueError(f"{path} is truncated")
+            yield z, np.frombuffer(raw, dtype=dtype).reshape((shape[0], shape[1], count), order='F')
+
+
+def read_into(image, out):
+    """Read the voxels of ``image`` as float32 into the C-ordered array ``out``"""
+    dtype = np.dtype(image.dataobj.dtype)
+    slope, inter = scaling(image.dataobj)
+    for z, slab in iter_slabs(image, out.shape, dtype):
+        target = out[:, :, z:z + slab.shape[2]]
+        np.copyto(target, slab, casting='unsafe')
+        if slope != 1.0:
+            target *= slope
+        if inter != 0.0:
+            target += inter
+        if dtype.kind == 'f':
+            np.nan_to_num(target, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    return out
+
+
+def load_volumes(file_paths, max_workers=None):
+    """
+    Load co-registered volumes into one contiguous float32 array.
+
+    Returns ``(volume, images)``: the (len(file_paths), H, W, D) array, which
+    ``torch.from_numpy`` wraps without copying, and the header-only nibabel
+    images for affines and voxel spacing.
+    """
+    images = [nib.load(path) for path in file_paths]
+    shape = volume_shape(images[0])
+    for path, image in zip(file_paths, images):
+        if volume_shape(image) != shape:
+            raise ValueError(
+                f"{os.path.basename(path)} has shape {volume_shape(image)}, expected {shape}"
+            )
+
+    volume = np.empty((len(images), *shape), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max_workers or len(images)) as pool:
+        futures = [pool.submit(read_into, image, volume[i]) for i, image in enumerate(images)]
+        for path, future in zip(file_paths, futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error loading file {path}: {str(e)}")
+                raise
+    return volume, images
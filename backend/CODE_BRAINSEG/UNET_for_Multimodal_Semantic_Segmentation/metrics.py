@@ -0,0 +1,178 @@
+"""
+Tumor volumetrics and overlap scores of a uint8 label map.
+
+Labels are the model's: 1 necrotic/non-enhancing core, 2 edema, 3
+enhancing tumor. The BraTS regions are unions of them: whole tumor (1, 2,
+3), tumor core (1, 3) and enhancing tumor (3). Label counts come from one
+bincount pass, and scores against a ground truth from one confusion-matrix
+pass. Both run over fixed-size chunks of the flattened volume, so they never
+allocate a full-volume index array. Every region metric is then a sum over
+cells of the 4x4 matrix.
+"""
+import os
+
+import numpy as np
+
+NUM_CLASSES = 4
+
+REGIONS = {
+    'whole_tumor': (1, 2, 3),
+    'tumor_core': (1, 3),
+    'enhancing_tumor': (3,),
+}
+LABELS = {1: 'necrotic_core', 2: 'edema', 3: 'enhancing_tumor'}
+
+# Ground-truth label files use the BraTS labels 0, 1, 2 and 4 (3 since 2023)
+GROUND_TRUTH_LABELS = {0: 0, 1: 1, 2: 2, 3: 3, 4: 3}
+
+# Voxels per bincount call
+CHUNK_VOXELS = 2**22
+
+
+def iter_chunks(array, chunk=CHUNK_VOXELS):
+    flat = array.reshape(-1)
+    for start in range(0, flat.size, chunk):
+        yield flat[start:start + chunk]
+
+
+def label_counts(mask, num_classes=NUM_CLASSES):
+    """Voxels per label in one pass over ``mask``"""
+    counts = np.zeros(num_classes, dtype=np.int64)
+    for chunk in iter_chunks(mask):
+        counts += np.bincount(chunk, minlength=num_classes)[:num_classes]
+    return counts
+
+
+def confusion_matrix(reference, candidate, num_classes=NUM_CLASSES):
+    """(reference, candidate) label pair counts in a single bincount pass"""
+    confusion = np.zeros(num_classes ** 2, dtype=np.int64)
+    pair_type = np.uint8 if num_classes ** 2 <= 256 else np.int64
+    for ref, cand in zip(iter_chunks(reference), iter_chunks(candidate)):
+        pairs = ref.astype(pair_type) * num_classes
+        pairs += cand
+        confusion += np.bincount(pairs, minlength=num_classes ** 2)[:num_classes ** 2]
+    return confusion.reshape(num_classes, num_classes)
+
+
+def voxel_volume(spacing):
+    return float(np.prod([float(s) for s in spacing[:3]]))
+
+
+def tumor_volumes(mask, spacing):
+    """Voxel counts and volumes in mm³ of the tumor regions and labels"""
+    counts = label_counts(mask)
+    voxel_mm3 = voxel_volume(spacing)
+    regions = {name: int(counts[list(labels)].sum()) for name, labels in REGIONS.items()}
+    return {
+        'voxel_volume_mm3': voxel_mm3,
+        'voxels': regions,
+        'volumes_mm3': {name: count * voxel_mm3 for name, count in regions.items()},
+        'label_volumes_mm3': {name: int(counts[label]) * voxel_mm3 for label, name in LABELS.items()},
+    }
+
+
+def region_scores(confusion, labels):
+    """Dice, sensitivity and specificity of one region from the label confusion matrix"""
+    inside = np.zeros(len(confusion), dtype=bool)
+    inside[list(labels)] = True
+    true_positive = float(confusion[np.ix_(inside, inside)].sum())
+    false_negative = float(confusion[np.ix_(inside, ~inside)].sum())
+    false_positive = float(confusion[np.ix_(~inside, inside)].sum())
+    true_negative = float(confusion[np.ix_(~inside, ~inside)].sum())
+    denominator = 2 * true_positive + false_positive + false_negative
+    return {
+        # Both empty is a perfect match, as in the BraTS evaluation
+        'dice': 2 * true_positive / denominator if denominator else 1.0,
+        'sensitivity': true_positive / (true_positive + false_negative)
+        if true_positive + false_negative else None,
+        'specificity': true_negative / (true_negative + false_positive)
+        if true_negative + false_positive else None,
+    }
+
+
+def tumor_box(*label_maps, margin=1):
+    """Slices of the bounding box of every labelled voxel, grown by ``margin``; None if there is none"""
+    box = []
+    for axis in range(3):
+        others = tuple(a for a in range(3) if a != axis)
+        present = np.zeros(label_maps[0].shape[axis], dtype=bool)
+        for labels in label_maps:
+            present |= labels.any(axis=others)
+        idx = np.flatnonzero(present)
+        if not idx.size:
+            return None
+        box.append(slice(max(int(idx[0]) - margin, 0), int(idx[-1]) + margin + 1))
+    return tuple(box)
+
+
+def hausdorff95(reference, candidate, spacing):
+    """
+    95th percentile of the symmetric surface distance in mm between two
+    boolean masks. None when exactly one of them is empty, 0 when both are.
+    """
+    from scipy import ndimage
+
+    has_reference, has_candidate = reference.any(), candidate.any()
+    if not has_reference and not has_candidate:
+        return 0.0
+    if not has_reference or not has_candidate:
+        return None
+
+    structure = ndimage.generate_binary_structure(3, 1)
+    ref_surface = reference & ~ndimage.binary_erosion(reference, structure, border_value=0)
+    cand_surface = candidate & ~ndimage.binary_erosion(candidate, structure, border_value=0)
+
+    sampling = [float(s) for s in spacing[:3]]
+    to_candidate = ndimage.distance_transform_edt(~cand_surface, sampling=sampling)[ref_surface]
+    to_reference = ndimage.distance_transform_edt(~ref_surface, sampling=sampling)[cand_surface]
+    return float(np.percentile(np.concatenate([to_candidate, to_reference]), 95))
+
+
+def load_ground_truth(path):
+    """BraTS label file as a uint8 map in the model's labels"""
+    import nibabel as nib
+
+    labels = np.asarray(nib.load(path).dataobj)
+    lookup = np.zeros(256, dtype=np.uint8)
+    for label, model_label in GROUND_TRUTH_LABELS.items():
+        lookup[label] = model_label
+    if labels.dtype != np.uint8:
+        labels = np.clip(labels, 0, 255).astype(np.uint8)
+    return np.take(lookup, labels)
+
+
+def evaluate(prediction, ground_truth, spacing):
+    """Dice, HD95, sensitivity and specificity per region against ``ground_truth``"""
+    if ground_truth.shape != prediction.shape:
+        raise ValueError(f"Ground truth has shape {ground_truth.shape}, the prediction {prediction.shape}")
+    confusion = confusion_matrix(ground_truth, prediction)
+    scores = {name: region_scores(confusion, labels) for name, labels in REGIONS.items()}
+    # Surface distances only need the tumor's bounding box, not the whole head
+    box = tumor_box(ground_truth, prediction)
+    for name, labels in REGIONS.items():
+        if box is None:
+            scores[name]['hd95_mm'] = 0.0
+            continue
+        scores[name]['hd95_mm'] = hausdorff95(
+            np.isin(ground_truth[box], labels), np.isin(prediction[box], labels), spacing
+        )
+    return {
+        'confusion': confusion.tolist(),
+        'dice': {name: s['dice'] for name, s in scores.items()},
+        'hd95_mm': {name: s['hd95_mm'] for name, s in scores.items()},
+        'sensitivity': {name: s['sensitivity'] for name, s in scores.items()},
+        'specificity': {name: s['specificity'] for name, s in scores.items()},
+    }
+
+
+def calculate_metrics(prediction, spacing, ground_truth=None):
+    """
+    Tumor volumes of ``prediction`` and, when a ``ground_truth`` label map
+    or label file path is given, its scores against it.
+    """
+    metrics = tumor_volumes(prediction, spacing)
+    if ground_truth is not None:
+        if isinstance(ground_truth, (str, os.PathLike)):
+            ground_truth = load_ground_truth(ground_truth)
+        metrics['ground_truth'] = evaluate(prediction, ground_truth, spacing)
+    return metrics
@@ -0,0 +1,77 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .metrics import confusion_matrix
+
+PRECISION_MODES = ('fp32', 'bf16', 'channels_last', 'bf16_channels_last')
+
+
+def bf16_supported(device):
+    """Whether bfloat16 autocast is worthwhile on ``device``"""
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        # True on CPUs with AVX512-BF16 / AMX, where oneDNN has native kernels
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(mode, device):
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision mode '{mode}', expected one of {PRECISION_MODES}")
+    if 'bf16' in mode and not bf16_supported(device):
+        fallback = 'channels_last' if 'channels_last' in mode else 'fp32'
+        print(f"bfloat16 is not supported on {device}, using {fallback} instead")
+        return fallback
+    return mode
+
+
+class PrecisionModel(nn.Module):
+    """
+    Runs a model in one of the reduced-precision / memory-format modes.
+
+    ``channels_last`` stores Conv3d/ConvTranspose3d weights and inputs in
+    channels_last_3d format, ``bf16`` runs the forward pass under bfloat16
+    autocast. Logits are always returned as float32.
+    """
+
+    def __init__(self, model, mode='fp32'):
+        super().__init__()
+        self.model = model
+        self.mode = mode
+        self.channels_last = 'channels_last' in mode
+        self.autocast = 'bf16' in mode
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last_3d)
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last_3d)
+        if self.autocast:
+            with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def scores_from_confusion(confusion):
+    """Voxel agreement overall and per reference class, plus per-class Dice"""
+    confusion = np.asarray(confusion, dtype=np.float64)
+    true_positive = np.diag(confusion)
+    reference_counts = confusion.sum(axis=1)
+    candidate_counts = confusion.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        class_agreement = true_positive / reference_counts
+        dice = 2 * true_positive / (reference_counts + candidate_counts)
+    return {
+        'agreement': float(true_positive.sum() / confusion.sum()),
+        'class_agreement': {label: float(v) for label, v in enumerate(class_agreement)},
+        'dice': {label: float(v) for label, v in enumerate(dice)},
+    }
+
+
+def compare_masks(reference, candidate, num_classes=4):
+    """Agreement and Dice of ``candidate`` against ``reference``, NaN for absent classes"""
+    return scores_from_confusion(confusion_matrix(reference, candidate, num_classes))
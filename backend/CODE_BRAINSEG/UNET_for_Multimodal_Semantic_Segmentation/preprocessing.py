@@ -0,0 +1,166 @@
+import numpy as np
+import torch
+
+from .inference import SIZE_DIVISOR, round_up
+
+NORMALIZATION_SCHEMES = ('minmax', 'zscore', 'percentile')
+
+# Foreground voxels sampled per channel to estimate percentiles
+QUANTILE_SAMPLES = 2**18
+
+
+def foreground_mask(image):
+    """Voxels of a (C, H, W, D) tensor that are nonzero in any modality"""
+    mask = image[0] != 0
+    for channel in image[1:]:
+        mask |= channel != 0
+    return mask
+
+
+def foreground_bbox(image, mask=None):
+    """
+    Bounding box of voxels that are nonzero in any modality of a (C, H, W, D)
+    tensor, as a list of (start, stop) pairs, or None for an empty volume.
+    """
+    if mask is None:
+        mask = foreground_mask(image)
+    bbox = []
+    for axis in range(mask.ndim):
+        others = tuple(a for a in range(mask.ndim) if a != axis)
+        hits = torch.nonzero(mask.any(dim=others)).flatten()
+        if hits.numel() == 0:
+            return None
+        bbox.append((int(hits[0]), int(hits[-1]) + 1))
+    return bbox
+
+
+def expand_bbox(bbox, shape, margin=8, multiple=SIZE_DIVISOR):
+    """Grow each side by ``margin`` and round the size up to ``multiple`` where the volume allows"""
+    expanded = []
+    for (start, stop), size in zip(bbox, shape):
+        start = max(start - margin, 0)
+        stop = min(stop + margin, size)
+        target = min(round_up(stop - start, multiple), size)
+        # Grow both sides evenly, shifting back inside when one hits the border
+        start = max(min(start - (target - (stop - start)) // 2, size - target), 0)
+        expanded.append((start, start + target))
+    return expanded
+
+
+def bbox_slices(bbox):
+    return tuple(slice(start, stop) for start, stop in bbox)
+
+
+def crop_to_foreground(image, margin=8, mask=None):
+    """
+    Crop a (C, H, W, D) tensor to its foreground plus ``margin``.
+
+    Returns the cropped view, the bounding box used (None when the volume is
+    empty and nothing was cropped) and statistics for the results payload.
+    """
+    spatial = tuple(image.shape[1:])
+    bbox = foreground_bbox(image, mask)
+    if bbox is None:
+        return image, None, {
+            'bbox': None,
+            'full_voxels': int(np.prod(spatial)),
+            'cropped_voxels': int(np.prod(spatial)),
+            'voxels_saved_pct': 0.0,
+        }
+
+    bbox = expand_bbox(bbox, spatial, margin)
+    cropped = image[(slice(None),) + bbox_slices(bbox)]
+
+    full_voxels = int(np.prod(spatial))
+    cropped_voxels = int(np.prod(cropped.shape[1:]))
+    return cropped, bbox, {
+        'bbox': [list(pair) for pair in bbox],
+        'full_voxels': full_voxels,
+        'cropped_voxels': cropped_voxels,
+        'voxels_saved_pct': round(100.0 * (1 - cropped_voxels / full_voxels), 2),
+    }
+
+
+def restore_full_size(labels, bbox, shape):
+    """Place a cropped label map back into a zero-filled mask of ``shape``"""
+    if bbox is None:
+        return labels
+    full = np.zeros(shape, dtype=labels.dtype)
+    full[bbox_slices(bbox)] = labels
+    return full
+
+
+def sum_of_squares(image, dims, slices=8):
+    """Per-channel sum of squares, squaring a few slices at a time"""
+    total = 0
+    for start in range(0, image.shape[1], slices):
+        part = image[:, start:start + slices]
+        total = total + (part * part).sum(dim=dims).double()
+    return total
+
+
+def approximate_quantiles(image, mask, q, max_samples=QUANTILE_SAMPLES):
+    """
+    Per-channel quantiles ``q`` of the foreground, estimated from the voxels
+    on a regular subgrid of at most ``max_samples`` points so only that
+    sample is sorted. Returns a (len(q), C) tensor.
+    """
+    spatial = image.shape[1:]
+    step = max(1, int(np.ceil((np.prod(spatial) / max_samples) ** (1 / len(spatial)))))
+    grid = (slice(None, None, step),) * len(spatial)
+    sample = image[(slice(None),) + grid][:, mask[grid]]
+    if sample.shape[1] == 0:
+        # A foreground small enough to fall between grid points is sampled whole
+        sample = image[:, mask]
+    q = torch.tensor(q, dtype=image.dtype, device=image.device)
+    return torch.quantile(sample, q, dim=1)
+
+
+def normalize(image, scheme='minmax', percentiles=(0.5, 99.5), mask=None):
+    """
+    Normalize a (C, H, W, D) tensor in place, per channel.
+
+    Statistics come from the foreground voxels only and each reduction covers
+    all channels at once. ``minmax`` scales to [0, 1], ``zscore`` to zero mean
+    and unit variance, ``percentile`` clips to the given percentiles then
+    scales to [0, 1]. Background voxels are left at 0, as are constant channels.
+    """
+    if scheme not in NORMALIZATION_SCHEMES:
+        raise ValueError(f"Unknown normalization '{scheme}', expected one of {NORMALIZATION_SCHEMES}")
+    if mask is None:
+        mask = foreground_mask(image)
+    count = int(torch.count_nonzero(mask))
+    if count == 0:
+        return image
+
+    dims = tuple(range(1, image.ndim))
+    broadcast = (-1,) + (1,) * (image.ndim - 1)
+    background = ~mask
+    if scheme == 'zscore':
+        # Background voxels are 0 and add nothing to either sum
+        mean = image.sum(dim=dims).double() / count
+        variance = sum_of_squares(image, dims) / count - mean ** 2
+        shift, scale = mean.float(), variance.clamp_(min=0).sqrt_().float()
+    elif scheme == 'percentile':
+        low, high = approximate_quantiles(image, mask, [p / 100 for p in percentiles])
+        image.clamp_(low.view(broadcast), high.view(broadcast))
+        shift, scale = low, high - low
+    else:
+        low, high = torch.amin(image, dim=dims), torch.amax(image, dim=dims)
+        # Background zeros only distort a bound sitting at 0 or beyond it, refill
+        # the background in place to take them out (it is zeroed again below)
+        if count < mask.numel() and bool((low >= 0).any()):
+            image.masked_fill_(background, float('inf'))
+            low = torch.where(low >= 0, torch.amin(image, dim=dims), low)
+        if count < mask.numel() and bool((high <= 0).any()):
+            image.masked_fill_(background, float('-inf'))
+            high = torch.where(high <= 0, torch.amax(image, dim=dims), high)
+        shift, scale = low, high - low
+
+    constant = scale <= 0
+    scale = torch.where(constant, torch.ones_like(scale), scale)
+    image.sub_(shift.view(broadcast)).div_(scale.view(broadcast))
+    image.masked_fill_(background, 0)
+    for channel in torch.nonzero(constant).flatten().tolist():
+        image[channel].zero_()
+    return image
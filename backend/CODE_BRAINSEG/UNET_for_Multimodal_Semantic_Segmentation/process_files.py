@@ -1,12 +1,6 @@
 import os
 import torch
-import nibabel as nib
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')  
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-import imageio
 import time
 import io
 
@@ -17,240 +11,174 @@ except ImportError:
     def tqdm(iterable, *args, **kwargs):
         return iterable
 
-from .model import UNet3D
+from .registry import get_model, default_device
+from .inference import predict_volume
+from .batching import batched
+from .preprocessing import (
+    bbox_slices, crop_to_foreground, foreground_mask, normalize, restore_full_size,
+)
+from .loading import load_volumes
+from .label_maps import save_display_volumes, save_label_map
+from .metrics import calculate_metrics
+from .render import MODALITIES, create_quick_visualization, render_study, study_results
 from django.conf import settings
 from django.contrib.auth.models import User
 from api.models import UserUpload
 
-def create_seg_colormap():
-    return ListedColormap([
-        [0, 0, 0],      
-        [1, 0, 0],      
-        [1, 1, 0],      
-        [0, 1, 0]       
-    ])
-
 def load_and_preprocess(file_path):
-    try:
-        nii_img = nib.load(file_path)
-        data = nii_img.get_fdata()
-        data = np.nan_to_num(data, nan=0.0, posinf=0.0, neginf=0.0).astype(np.float32)
-        return data
-    except Exception as e:
-        print(f"Error loading file {file_path}: {str(e)}")
-        raise
+    volume, _ = load_volumes([file_path])
+    return volume[0]
+
+def find_case_files(case_dir):
+    """T1, T1c, T2 and FLAIR paths of a BraTS-style case directory"""
+    suffixes = {
+        'T1': ('_t1.nii', '_t1.nii.gz'),
+        'T1c': ('_t1ce.nii', '_t1ce.nii.gz', '_t1c.nii', '_t1c.nii.gz'),
+        'T2': ('_t2.nii', '_t2.nii.gz'),
+        'FLAIR': ('_flair.nii', '_flair.nii.gz'),
+    }
+    names = sorted(os.listdir(case_dir))
+    file_paths = []
+    for modality in ['T1', 'T1c', 'T2', 'FLAIR']:
+        matches = [n for n in names if n.lower().endswith(suffixes[modality])]
+        if not matches:
+            raise FileNotFoundError(f"No {modality} volume found in {case_dir}")
+        file_paths.append(os.path.join(case_dir, matches[0]))
+    return file_paths
+
+def find_ground_truth(case_dir):
+    """Path of the label file of a BraTS-style case directory, or None"""
+    for name in sorted(os.listdir(case_dir)):
+        if name.lower().endswith(('_seg.nii', '_seg.nii.gz')):
+            return os.path.join(case_dir, name)
+    return None
+
+def prepare_input(volume):
+    """Crop the (4, H, W, D) volume to the foreground and normalize it, sharing its memory"""
+    image_tensor = torch.from_numpy(volume) if isinstance(volume, np.ndarray) else volume
+    mask = foreground_mask(image_tensor)
+    image_tensor, bbox, crop_stats = crop_to_foreground(
+        image_tensor, margin=getattr(settings, 'BRAINSEG_CROP_MARGIN', 8), mask=mask
+    )
+    if bbox is not None:
+        mask = mask[bbox_slices(bbox)]
+    image_tensor = normalize(
+        image_tensor,
+        mask=mask,
+        scheme=getattr(settings, 'BRAINSEG_NORMALIZATION', 'minmax'),
+        percentiles=getattr(settings, 'BRAINSEG_CLIP_PERCENTILES', (0.5, 99.5)),
+    )
+    return image_tensor, bbox, crop_stats
+
+def read_study(file_paths):
+    """Load the modalities of a study, returns (volume, nifti_images, seconds)"""
+    started = time.perf_counter()
+    volume, nifti_images = load_volumes(file_paths[:len(MODALITIES)])
+    return volume, nifti_images, time.perf_counter() - started
+
+def segment_study(file_paths, output_dir, progress=None, study=None, display_volumes=True, keep_images=False):
+    """
+    Load, preprocess and segment one study. The label map and, with
+    ``display_volumes``, display copies of the modalities are stored in
+    ``output_dir``; returns the summary for the results, the label map and,
+    with ``keep_images``, a copy of the modalities by name as loaded, for
+    rendering (else None). A ground-truth label file after the modalities
+    in ``file_paths`` is scored against the prediction. ``study`` is the
+    result of read_study when the volumes were loaded ahead of time.
+    """
+    progress = progress or (lambda percent, message: None)
+    file_paths, ground_truth = file_paths[:len(MODALITIES)], file_paths[len(MODALITIES):]
+    timings = {}
+
+    progress(20, "Loading model")
+    device = default_device()
+    model = load_optimized_model(device)
+
+    progress(40, "Loading data")
+    volume, nifti_images, timings['load'] = study or read_study(file_paths)
+    full_shape = volume.shape[1:]
+    # prepare_input normalizes the volume in place, so anything drawn from
+    # the raw intensities is taken before it
+    if display_volumes:
+        started = time.perf_counter()
+        save_display_volumes(dict(zip(MODALITIES, volume)), output_dir,
+                             factor=getattr(settings, 'BRAINSEG_SLICE_DOWNSAMPLE', 2))
+        timings['display'] = time.perf_counter() - started
+    images = dict(zip(MODALITIES, volume.copy())) if keep_images else None
 
-def normalize_channels(image_tensor):
-    for i in range(image_tensor.shape[0]):
-        min_val = torch.min(image_tensor[i])
-        max_val = torch.max(image_tensor[i])
-        if max_val - min_val != 0:
-            image_tensor[i] = (image_tensor[i] - min_val) / (max_val - min_val)
-        else:
-            image_tensor[i] = torch.zeros_like(image_tensor[i])
-    return image_tensor
+    progress(60, "Processing")
+    started = time.perf_counter()
+    image_tensor, bbox, crop_stats = prepare_input(volume)
+    timings['preprocess'] = time.perf_counter() - started
 
-def calculate_metrics(prediction, ground_truth=None):
-    metrics = {
-        'whole_tumor': np.random.uniform(0.85, 0.95),
-        'tumor_core': np.random.uniform(0.75, 0.85),
-        'enhancing_tumor': np.random.uniform(0.65, 0.75)
+    progress(80, "Running inference")
+    started = time.perf_counter()
+    with batched(model, device) as forward:
+        options = {}
+        if forward is not model:
+            # Hand the batcher enough patches per call to fill a batch on its own
+            options['batch_size'] = forward.max_batch_size
+        prediction = predict_volume(forward, image_tensor, device, **options)
+    prediction = restore_full_size(prediction, bbox, full_shape)
+    spacing = [float(z) for z in nifti_images[0].header.get_zooms()[:3]]
+    save_label_map(prediction, output_dir, affine=nifti_images[0].affine, spacing=spacing)
+    timings['infer'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    metrics = calculate_metrics(prediction, spacing, ground_truth=ground_truth[0] if ground_truth else None)
+    timings['metrics'] = time.perf_counter() - started
+
+    summary = {
+        'volume_shape': list(full_shape),
+        'spacing': spacing,
+        'metrics': metrics,
+        'crop': crop_stats,
+        'timings': timings,
     }
-    return metrics
+    return summary, prediction, images
+
+def process_brain_scans(file_paths, output_dir, batch_id=None, result_url=None):
+    """
+    Segment one study and render it into ``output_dir``. ``result_url`` is
+    where ``output_dir`` will be served from, by default
+    /media/results/<output_dir name>.
+    """
+    from api.progress import report_progress
 
-def process_brain_scans(file_paths, output_dir):
+    upload_obj = None
     try:
         def update_progress(upload_obj, progress, status_message):
-            upload_obj.status = 'processing'  # Keep the status simple
-            upload_obj.results = {
-                'progress': progress,
-                'status': status_message,
-                'processing_status': status_message
-            }
-            upload_obj.save()
+            # Progress goes to the cache, the row is written on status changes only
+            report_progress(upload_obj.id, upload_obj.user_id, progress, status_message)
 
-        batch_id = os.path.basename(output_dir)
+        if batch_id is None:
+            batch_id = os.path.basename(output_dir)
+        if result_url is None:
+            result_url = f'/media/results/{os.path.basename(output_dir)}'
         upload_obj = UserUpload.objects.filter(batch_id=str(batch_id)).first()
 
         if not upload_obj:
             raise Exception("Upload object not found")
 
-        update_progress(upload_obj, 20, "Loading model")
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        
-        update_progress(upload_obj, 40, "Loading data")
-        images = {}
-        for name, path in zip(['T1', 'T1c', 'T2', 'FLAIR'], file_paths):
-            images[name] = load_and_preprocess(path)
-        
-        update_progress(upload_obj, 60, "Processing")
-        image_tensor = torch.stack([
-            torch.tensor(images[mod], dtype=torch.float32)
-            for mod in ['T1', 'T1c', 'T2', 'FLAIR']
-        ])
-        image_tensor = normalize_channels(image_tensor)
-        
-        update_progress(upload_obj, 80, "Running inference")
-        with torch.inference_mode():
-            prediction = load_optimized_model(device)(image_tensor.unsqueeze(0).to(device))
-            prediction = torch.argmax(prediction, dim=1).cpu().numpy()[0]
-        
+        summary, prediction, images = segment_study(
+            file_paths, output_dir, progress=lambda percent, message: update_progress(upload_obj, percent, message),
+            keep_images=True,
+        )
+
         update_progress(upload_obj, 90, "Creating visualizations")
-        create_quick_visualization(prediction, output_dir, images)
-        
-        results = {
-            'static_image': f'/media/results/{os.path.basename(output_dir)}/preview.png',
-            'gif': f'/media/results/{os.path.basename(output_dir)}/animation.gif',
-            'metrics': calculate_metrics(prediction),
-            'timestamp': time.time(),
-            'progress': 100,
-            'status': 'Complete'
-        }
-        
-        upload_obj.results = results
-        upload_obj.status = 'complete'
-        upload_obj.save()
-        
-        return results
+        rendered, summary['timings']['render'] = render_study(
+            file_paths, output_dir, prediction=prediction, images=images, spacing=summary['spacing']
+        )
+        return study_results(summary, result_url, rendered)
         
     except Exception as e:
         print(f"Processing error: {str(e)}")
         if upload_obj:
             upload_obj.status = 'failed'
             upload_obj.error_message = str(e)
-            upload_obj.save()
+            upload_obj.save(update_fields=['status', 'error_message'])
         raise
 
-def load_optimized_model(device):
-    """Ultra-fast model loading with validation"""
-    model_path = os.path.join(os.path.dirname(__file__), "best_model.pth")
-    print(f"Looking for model at: {model_path}")
-    
-    if not os.path.exists(model_path):
-        parent_dir = os.path.dirname(os.path.dirname(__file__))
-        model_path = os.path.join(parent_dir, "best_model.pth")
-        print(f"Model not found in default location, trying: {model_path}")
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model not found in any location!")
-    
-    try:
-        print("Loading model...")
-        model = UNet3D(in_channels=4, out_channels=4)
-        
-        import torch.serialization
-        safe_globals = [
-            'numpy._core.multiarray._reconstruct',
-            'numpy.core.multiarray._reconstruct',
-            'numpy.ndarray',
-            'numpy._core.numeric',
-            'numpy.core.numeric'
-        ]
-        
-        with torch.serialization.safe_globals(safe_globals):
-            checkpoint = torch.load(
-                model_path,
-                map_location=device,
-                weights_only=False  
-            )
-            print(f"Checkpoint keys: {checkpoint.keys() if isinstance(checkpoint, dict) else 'direct state_dict'}")
-            
-            if isinstance(checkpoint, dict):
-                if 'model_state_dict' in checkpoint:
-                    model.load_state_dict(checkpoint['model_state_dict'])
-                elif 'state_dict' in checkpoint:
-                    model.load_state_dict(checkpoint['state_dict'])
-                else:
-                    model.load_state_dict(checkpoint)
-            else:
-                model.load_state_dict(checkpoint)
-        
-        model = model.to(device)
-        model.eval()
-        print("Model loaded successfully!")
-        return model
-        
-    except Exception as e:
-        print(f"Model loading error details: {str(e)}")
-        print(f"Model path tried: {model_path}")
-        print(f"Current directory: {os.getcwd()}")
-        
-        try:
-            print("\n🔄 Attempting alternative loading method...")
-            checkpoint = torch.load(
-                model_path,
-                map_location=device,
-                pickle_module=torch._utils._rebuild_tensor_v2
-            )
-            model.load_state_dict(checkpoint)
-            model = model.to(device)
-            model.eval()
-            print("Model loaded successfully with alternative method!")
-            return model
-        except Exception as e2:
-            print(f"Alternative loading also failed: {str(e2)}")
-            raise RuntimeError(f"⚡ Model Loading Failed: {str(e)}")
-
-def create_quick_visualization(prediction, output_dir, images):
-    """Create visualization with all modalities and segmentation"""
-    try:
-        print("\nCreating visualization...")
-        
-        slice_idx = prediction.shape[0] // 2
-        
-        fig, axes = plt.subplots(1, 5, figsize=(20, 4))
-        
-        seg_cmap = create_seg_colormap()
-        
-        titles = ['T1', 'T1c', 'T2', 'FLAIR', 'Segmentation']
-        for i, (title, img) in enumerate(zip(titles[:-1], [images['T1'], images['T1c'], images['T2'], images['FLAIR']])):
-            axes[i].imshow(img[:, :, slice_idx], cmap='gray')
-            axes[i].set_title(f"{title}\nSlice: {slice_idx}")
-            axes[i].axis('off')
-        
-        im = axes[4].imshow(prediction[:, :, slice_idx], cmap=seg_cmap, vmin=0, vmax=3)
-        axes[4].set_title(f"Segmentation\nSlice: {slice_idx}")
-        axes[4].axis('off')
-        
-        cbar = plt.colorbar(im, ax=axes[4], ticks=[0.4, 1.2, 2.0, 2.8])
-        cbar.ax.set_yticklabels(['Background', 'Necrotic core', 'Edema', 'Enhancing tumor'])
-        
-        plt.tight_layout()
-        
-        static_path = os.path.join(output_dir, 'preview.png')
-        plt.savefig(static_path, bbox_inches='tight', dpi=150)
-        plt.close()
-        
-        frames = []
-        print("Creating animated visualization...")
-        
-        for z in range(0, prediction.shape[0], 2):
-            processed_slices = []
-            
-            for img in [images['T1'], images['T1c'], images['T2'], images['FLAIR']]:
-                slice_data = img[:, :, z]
-                normalized = ((slice_data - np.min(slice_data)) / 
-                            (np.max(slice_data) - np.min(slice_data)) * 255).astype(np.uint8)
-                rgb_slice = np.stack([normalized] * 3, axis=-1)
-                processed_slices.append(rgb_slice)
-            
-            seg_slice = prediction[:, :, z]
-            colored_seg = (seg_cmap(seg_slice.astype(int))[:, :, :3] * 255).astype(np.uint8)
-            processed_slices.append(colored_seg)
-            
-            combined = np.hstack(processed_slices)
-            
-            for _ in range(5):
-                frames.append(combined)
-        
-        frames.extend(frames[::-1])
-        
-        gif_path = os.path.join(output_dir, 'animation.gif')
-        imageio.mimsave(gif_path, frames, duration=2.0, loop=0)
-        
-        print("Visualization completed successfully!")
-        
-    except Exception as e:
-        print(f"Error in visualization: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise 
\ No newline at end of file
+def load_optimized_model(device, name=None):
+    """Warm, shared model from the process-wide registry"""
+    return get_model(name, device)
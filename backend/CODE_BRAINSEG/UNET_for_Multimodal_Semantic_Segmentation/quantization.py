@@ -0,0 +1,89 @@
+import copy
+import os
+import tempfile
+import warnings
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+# Artifacts ending in this suffix are TorchScript files rather than checkpoints;
+# plain .pt files are torch.save checkpoints like .pth ones
+SCRIPTED_SUFFIX = '.ts.pt'
+QUANTIZED_SUFFIX = '.int8.ts.pt'
+
+# Example input used to trace the quantized graph, any 16-aligned size works
+TRACE_SHAPE = (1, 4, 32, 32, 32)
+
+
+def set_quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm'):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"No int8 CPU backend available (supported: {engines})")
+
+
+def fold_batchnorm(model):
+    """Fold every BatchNorm3d into the Conv3d right before it, in place"""
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            conv, bn = module[i], module[i + 1]
+            if isinstance(conv, nn.Conv3d) and isinstance(bn, nn.BatchNorm3d):
+                module[i] = fuse_conv_bn_eval(conv, bn)
+                module[i + 1] = nn.Identity()
+    return model
+
+
+def prepare_int8(model):
+    """
+    Copy of ``model`` with BatchNorm folded and observers inserted.
+
+    Run calibration volumes through the returned module, then pass it to
+    ``convert_int8``.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+
+    engine = set_quantized_engine()
+    model = fold_batchnorm(copy.deepcopy(model).cpu().eval())
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return prepare_fx(model, get_default_qconfig_mapping(engine),
+                          example_inputs=(torch.zeros(TRACE_SHAPE),))
+
+
+def convert_int8(prepared):
+    from torch.ao.quantization.quantize_fx import convert_fx
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return convert_fx(prepared)
+
+
+def save_scripted(model, path):
+    """Trace, freeze and atomically write ``model`` as a TorchScript file"""
+    with warnings.catch_warnings(), torch.inference_mode(False), torch.no_grad():
+        warnings.simplefilter('ignore')
+        scripted = torch.jit.freeze(torch.jit.trace(model, torch.zeros(TRACE_SHAPE)))
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            torch.jit.save(scripted, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    return path
+
+
+def load_scripted(path, device):
+    if os.path.basename(path).endswith(QUANTIZED_SUFFIX):
+        set_quantized_engine()
+    model = torch.jit.load(path, map_location=device)
+    model.eval()
+    return model
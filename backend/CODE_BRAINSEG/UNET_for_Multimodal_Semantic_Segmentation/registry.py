@@ -0,0 +1,343 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+from .model import UNet3D
+from .precision import PrecisionModel, resolve_precision
+from .quantization import SCRIPTED_SUFFIX, load_scripted
+from .backends import SPATIAL_BUCKET, create_backend
+from .batching import retire_batchers
+from .checkpoints import FLAT_SUFFIX, file_signature, flat_path, prefer_flat, read_flat
+
+MODEL_DIR = os.path.dirname(__file__)
+
+DEFAULT_CHECKPOINTS = {
+    'best_model': 'best_model.pth',
+    'model_weights': 'model_weights.pth',
+}
+
+DEFAULT_MODEL = 'best_model'
+
+# Smallest volume that survives the four 2x poolings in UNet3D
+WARMUP_SHAPE = (1, 4, 16, 16, 16)
+
+
+def default_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def resolve_checkpoint(filename):
+    """Look for a checkpoint next to this file, then one directory up"""
+    model_path = os.path.join(MODEL_DIR, filename)
+    if os.path.exists(model_path):
+        return model_path
+
+    parent_path = os.path.join(os.path.dirname(MODEL_DIR), filename)
+    print(f"Model not found in default location, trying: {parent_path}")
+    if os.path.exists(parent_path):
+        return parent_path
+
+    raise FileNotFoundError(f"Model {filename} not found in any location!")
+
+
+def load_state_dict(model, checkpoint):
+    if isinstance(checkpoint, dict):
+        if 'model_state_dict' in checkpoint:
+            checkpoint = checkpoint['model_state_dict']
+        elif 'state_dict' in checkpoint:
+            checkpoint = checkpoint['state_dict']
+    model.load_state_dict(checkpoint)
+    return model
+
+
+def build_model(model_path, device):
+    """
+    Build UNet3D from a checkpoint on disk and put it in eval mode.
+
+    Flat ``.safetensors`` files written by ``manage.py convert_checkpoint`` are
+    memory-mapped, on CPU the parameters keep pointing into the mapping so
+    every worker shares the same pages. TorchScript artifacts, such as the
+    int8 models written by ``manage.py quantize_model``, are loaded as they are.
+    """
+    print(f"Loading model from: {model_path}")
+    if model_path.endswith(SCRIPTED_SUFFIX):
+        return load_scripted(model_path, device)
+
+    model = UNet3D(in_channels=4, out_channels=4)
+
+    if model_path.endswith(FLAT_SUFFIX):
+        state_dict = read_flat(model_path)
+        model.load_state_dict(state_dict, assign=torch.device(device).type == 'cpu')
+    else:
+        try:
+            checkpoint = torch.load(model_path, map_location=device, weights_only=True)
+        except Exception as e:
+            print(f"Model loading error details: {str(e)}")
+            raise RuntimeError(
+                f"⚡ Model Loading Failed: {str(e)}. Checkpoints holding more than tensors "
+                f"can be converted once with 'manage.py convert_checkpoint'"
+            )
+        print(f"Checkpoint keys: {checkpoint.keys() if isinstance(checkpoint, dict) else 'direct state_dict'}")
+        load_state_dict(model, checkpoint)
+
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+def model_nbytes(model):
+    """Bytes held by parameters and buffers of a module"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def warm_up(model, device, shape=WARMUP_SHAPE):
+    """Run one dummy forward pass so kernels and allocator pools are primed"""
+    with torch.inference_mode():
+        model(torch.zeros(shape, dtype=torch.float32, device=device))
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Each checkpoint is loaded, moved to its device and warmed up once, then
+    shared by every job in the process. When the combined size of the loaded
+    models exceeds ``memory_budget`` bytes the least recently used ones are
+    evicted.
+
+    At most every ``reload_interval`` seconds ``get`` checks whether the file
+    behind a cached model was replaced. The new model is built while the old
+    one keeps serving, then swapped in, so jobs that already hold the old model
+    finish with it, batched inference included, and the next job picks up the
+    new one.
+    """
+
+    def __init__(self, memory_budget=None, warmup=True, self_test=True,
+                 shape_bucket=SPATIAL_BUCKET, reload_interval=None):
+        self.memory_budget = memory_budget
+        self.warmup = warmup
+        self.self_test = self_test
+        self.shape_bucket = shape_bucket
+        self.reload_interval = reload_interval
+        self._checkpoints = dict(DEFAULT_CHECKPOINTS)
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._signatures = {}
+        self._checked = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        """Register (or replace) a checkpoint under ``name``"""
+        with self._lock:
+            self._checkpoints[name] = path
+            for key in [k for k in self._models if k[0] == name]:
+                self._drop(key)
+
+    def registered(self):
+        with self._lock:
+            return dict(self._checkpoints)
+
+    def source_path(self, name):
+        """The checkpoint file registered under ``name``, as trained"""
+        with self._lock:
+            if name not in self._checkpoints:
+                raise KeyError(f"No checkpoint registered as '{name}'")
+            path = self._checkpoints[name]
+        if os.path.isabs(path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Model not found at {path}")
+            return path
+        return resolve_checkpoint(path)
+
+    def checkpoint_path(self, name):
+        """The file to load for ``name``, preferring an up-to-date flat conversion"""
+        try:
+            return prefer_flat(self.source_path(name))
+        except FileNotFoundError:
+            # Deployments may ship only the converted file
+            with self._lock:
+                path = self._checkpoints.get(name)
+            if path is None or path.endswith(FLAT_SUFFIX):
+                raise
+            path = flat_path(path)
+            return path if os.path.isabs(path) else resolve_checkpoint(path)
+
+    def get(self, name=DEFAULT_MODEL, device=None, precision='fp32', backend='eager'):
+        """
+        Return the warm model for ``name`` on ``device``, loading it on first
+        use. ``precision`` and ``backend`` select how it is executed.
+        """
+        device = torch.device(device) if device is not None else default_device()
+        precision = resolve_precision(precision, device)
+        key = (name, str(device), precision, backend)
+
+        while True:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    model = self._models[key]
+                    if not self._reload_due(key):
+                        return model
+                    # Keep serving the current model while this thread checks the file
+                    self._loading[key] = threading.Event()
+                    break
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = threading.Event()
+                    model = None
+                    break
+            # Another thread is loading the same model, wait and re-check
+            pending.wait()
+
+        try:
+            if model is not None:
+                return self._reload(key, model)
+            model, size, signature = self._load(key)
+            with self._lock:
+                self._store(key, model, size, signature)
+            return model
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def _load(self, key):
+        name, device, precision, backend = key
+        start = time.time()
+        model_path = self.checkpoint_path(name)
+        signature = file_signature(model_path)
+        model = build_model(model_path, device)
+        scripted = model_path.endswith(SCRIPTED_SUFFIX)
+        if precision != 'fp32' and not scripted:
+            model = PrecisionModel(model, precision)
+        # Packed int8 weights are not exposed as parameters
+        size = os.path.getsize(model_path) if scripted else model_nbytes(model)
+        if not scripted:
+            model = create_backend(backend, model, device, model_path, self.self_test,
+                                   self.shape_bucket)
+        if self.warmup:
+            warm_up(model, device)
+        print(f"Model '{name}' ({precision}, {backend}) ready on {device} in {time.time() - start:.2f}s "
+              f"({size / 2**20:.1f} MB)")
+        return model, size, signature
+
+    def _store(self, key, model, size, signature):
+        replaced = self._models.get(key)
+        if replaced is not None and replaced is not model:
+            # Jobs inferring with the replaced model keep its batcher until they finish
+            retire_batchers(replaced)
+        self._models[key] = model
+        self._sizes[key] = size
+        self._signatures[key] = signature
+        self._checked[key] = time.monotonic()
+        self._enforce_budget(keep=key)
+
+    def _reload_due(self, key):
+        if not self.reload_interval or key in self._loading:
+            return False
+        return time.monotonic() - self._checked.get(key, 0) >= self.reload_interval
+
+    def _reload(self, key, current):
+        """Swap in a rebuilt model if the checkpoint file changed, else keep ``current``"""
+        with self._lock:
+            self._checked[key] = time.monotonic()
+            previous = self._signatures.get(key)
+        try:
+            if file_signature(self.checkpoint_path(key[0])) == previous:
+                return current
+            print(f"Checkpoint for model '{key[0]}' changed on disk, reloading")
+            model, size, signature = self._load(key)
+        except Exception as e:
+            print(f"Reloading model '{key[0]}' failed, keeping the loaded one: {str(e)}")
+            return current
+        with self._lock:
+            if self._models.get(key) is not current:
+                # Evicted or re-registered while we were loading
+                return self._models.get(key, current)
+            self._store(key, model, size, signature)
+        return model
+
+    def evict(self, name=None, device=None):
+        """Drop cached models, optionally only those matching ``name``/``device``"""
+        with self._lock:
+            for key in list(self._models):
+                if name is not None and key[0] != name:
+                    continue
+                if device is not None and key[1] != str(torch.device(device)):
+                    continue
+                self._drop(key)
+
+    def memory_in_use(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': [f"{name}@{device}:{precision}:{backend}"
+                           for name, device, precision, backend in self._models],
+                'bytes': sum(self._sizes.values()),
+                'budget': self.memory_budget,
+            }
+
+    def _drop(self, key):
+        model = self._models.pop(key, None)
+        if model is not None:
+            retire_batchers(model)
+        self._sizes.pop(key, None)
+        self._signatures.pop(key, None)
+        self._checked.pop(key, None)
+        if key[1].startswith('cuda'):
+            torch.cuda.empty_cache()
+
+    def _enforce_budget(self, keep):
+        if not self.memory_budget:
+            return
+        while sum(self._sizes.values()) > self.memory_budget and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            print(f"Evicting model '{oldest[0]}' from {oldest[1]} (memory budget)")
+            self._drop(oldest)
+        if self._sizes.get(keep, 0) > self.memory_budget:
+            print(f"Warning: model '{keep[0]}' alone exceeds the memory budget")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Shared registry for this process, configured from Django settings"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from django.conf import settings
+                budget_mb = getattr(settings, 'BRAINSEG_MODEL_MEMORY_MB', None)
+                _registry = ModelRegistry(
+                    memory_budget=int(budget_mb * 2**20) if budget_mb else None,
+                    warmup=getattr(settings, 'BRAINSEG_MODEL_WARMUP', True),
+                    self_test=getattr(settings, 'BRAINSEG_BACKEND_SELF_TEST', True),
+                    shape_bucket=getattr(settings, 'BRAINSEG_SHAPE_BUCKET', SPATIAL_BUCKET),
+                    reload_interval=getattr(settings, 'BRAINSEG_MODEL_RELOAD_SECONDS', None),
+                )
+                for name, path in getattr(settings, 'BRAINSEG_CHECKPOINTS', {}).items():
+                    _registry.register(name, path)
+    return _registry
+
+
+def get_model(name=None, device=None, precision=None, backend=None):
+    """Warm model from the shared registry, defaults come from Django settings"""
+    from django.conf import settings
+    if name is None:
+        name = getattr(settings, 'BRAINSEG_MODEL', DEFAULT_MODEL)
+    if precision is None:
+        precision = getattr(settings, 'BRAINSEG_PRECISION', 'fp32')
+    if backend is None:
+        backend = getattr(settings, 'BRAINSEG_BACKEND', 'eager')
+    return get_registry().get(name, device, precision, backend)
@@ -0,0 +1,107 @@
+"""
+Render and finalize stages of the segmentation pipeline.
+
+Nothing here imports torch, so render workers stay small and start fast.
+They pick a study up from its stored label map, load the modalities again
+with the parallel loader and write the preview and animation next to it.
+"""
+import os
+import time
+
+from django.conf import settings
+
+from .animation import write_animation
+from .label_maps import LABEL_MAP_FILE, MODALITIES_FILE, load_label_map
+from .loading import load_volumes
+from .rendering import compose_preview
+from .sprites import write_dashboard_images
+
+MODALITIES = ['T1', 'T1c', 'T2', 'FLAIR']
+
+
+def create_quick_visualization(prediction, output_dir, images):
+    """Create visualization with all modalities and segmentation"""
+    try:
+        print("\nCreating visualization...")
+
+        slice_idx = prediction.shape[2] // 2
+
+        static_path = os.path.join(output_dir, 'preview.png')
+        compose_preview(images, prediction, slice_idx, MODALITIES).save(static_path)
+
+        print("Creating animated visualization...")
+        animation = write_animation(
+            images, prediction, output_dir,
+            fmt=getattr(settings, 'BRAINSEG_ANIMATION_FORMAT', 'gif'),
+            frame_ms=getattr(settings, 'BRAINSEG_ANIMATION_FRAME_MS', 150),
+            modalities=MODALITIES,
+        )
+
+        print("Visualization completed successfully!")
+        return animation
+
+    except Exception as e:
+        print(f"Error in visualization: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+def render_study(file_paths, output_dir, prediction=None, images=None, spacing=None):
+    """
+    Write the preview, animation, sprite sheets and thumbnails of a
+    segmented study into ``output_dir``. Without ``prediction`` and
+    ``images`` in memory they are read back from the stored label map and
+    the input files, ignoring a ground-truth file after them. Returns what
+    was rendered and the seconds spent.
+    """
+    started = time.perf_counter()
+    if prediction is None:
+        prediction, _, spacing = load_label_map(output_dir)
+    if images is None:
+        volume, _ = load_volumes(file_paths[:len(MODALITIES)])
+        images = dict(zip(MODALITIES, volume))
+    animation = create_quick_visualization(prediction, output_dir, images)
+    dashboard = write_dashboard_images(images, prediction, spacing if spacing is not None else (1, 1, 1),
+                                       output_dir)
+    return dict(dashboard, animation=animation), time.perf_counter() - started
+
+
+def study_results(summary, result_url, rendered=None):
+    """
+    Results of a study served from ``result_url``: the segmentation
+    ``summary`` and, once rendered, the preview, animation, sprite sheets
+    and thumbnails.
+    """
+    results = dict(summary)
+    results.update({
+        'label_map': f'{result_url}/{LABEL_MAP_FILE}',
+        'display_volumes': f'{result_url}/{MODALITIES_FILE}',
+        'timestamp': time.time(),
+    })
+    if rendered is None:
+        results.update({'progress': 90, 'status': 'Mask ready', 'processing_status': 'Creating visualizations'})
+        return results
+
+    animation = dict(rendered['animation'])
+    animation['url'] = f"{result_url}/{animation.pop('file')}"
+    sprites = {
+        plane: [dict({k: v for k, v in sheet.items() if k != 'file'}, url=f"{result_url}/{sheet['file']}")
+                for sheet in sheets]
+        for plane, sheets in rendered['sprites'].items()
+    }
+    results.update({
+        'static_image': f'{result_url}/preview.png',
+        'animation': animation,
+        'sprites': sprites,
+        'thumbnails': {size: f"{result_url}/{name}" for size, name in rendered['thumbnails'].items()},
+        'thumbnail_slice': rendered['thumbnail_slice'],
+        'progress': 100,
+        'status': 'Complete',
+    })
+    results.pop('processing_status', None)
+    if animation['format'] != 'mp4':
+        # Kept for older clients, which show it in an <img> (WebP plays there as well);
+        # 'animation' has the URL in every format
+        results['gif'] = animation['url']
+    return results
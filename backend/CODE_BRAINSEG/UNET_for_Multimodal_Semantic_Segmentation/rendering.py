@@ -0,0 +1,104 @@
+"""
+Preview rendering with NumPy and Pillow.
+
+Intensities are windowed to uint8 with vectorized arithmetic and labels are
+colored by indexing a uint8 lookup table, so a panel is a couple of array
+operations instead of a matplotlib figure. Panels, titles and the legend are
+composited with Pillow.
+"""
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Lookup table from label to RGB: background, necrotic core, edema, enhancing tumor
+LABEL_COLORS = np.array([[0, 0, 0], [255, 0, 0], [255, 255, 0], [0, 255, 0]], dtype=np.uint8)
+LABEL_NAMES = ['Background', 'Necrotic core', 'Edema', 'Enhancing tumor']
+
+# Longest side of a preview panel in pixels
+PANEL_SIZE = 320
+TITLE_HEIGHT = 44
+MARGIN = 12
+SWATCH = 18
+LEGEND_WIDTH = 170
+BACKGROUND = (255, 255, 255)
+TEXT_COLOR = (0, 0, 0)
+
+
+def load_font(size=15):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow before 10.1 has a single bitmap size
+        return ImageFont.load_default()
+
+
+def window(array, low=None, high=None):
+    """Scale ``array`` linearly from [low, high] (its min and max by default) to uint8"""
+    array = np.asarray(array, dtype=np.float32)
+    low = float(array.min()) if low is None else low
+    high = float(array.max()) if high is None else high
+    if high <= low:
+        return np.zeros(array.shape, dtype=np.uint8)
+    scaled = (array - low) * (255.0 / (high - low))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def colorize(labels):
+    """RGB image of a label map through the uint8 lookup table"""
+    return LABEL_COLORS[np.clip(labels, 0, len(LABEL_COLORS) - 1)]
+
+
+def gray_to_rgb(gray):
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+def overlay_labels(rgb, labels, alpha=0.4):
+    """Blend the label colors over ``rgb`` in place where there is tumor"""
+    tumor = labels > 0
+    blended = rgb[tumor] * (1 - alpha) + LABEL_COLORS[labels[tumor]] * alpha
+    rgb[tumor] = np.rint(blended).astype(np.uint8)
+    return rgb
+
+
+def panel_size(shape, size=PANEL_SIZE):
+    """Pixel (width, height) of a panel for an array of ``shape``, longest side ``size``"""
+    rows, cols = shape[:2]
+    scale = size / max(rows, cols)
+    return max(int(round(cols * scale)), 1), max(int(round(rows * scale)), 1)
+
+
+def draw_legend(draw, left, top, font):
+    for i, (color, name) in enumerate(zip(LABEL_COLORS, LABEL_NAMES)):
+        y = top + i * (SWATCH + 8)
+        draw.rectangle([left, y, left + SWATCH, y + SWATCH], fill=tuple(int(c) for c in color),
+                       outline=TEXT_COLOR)
+        draw.text((left + SWATCH + 8, y + 1), name, fill=TEXT_COLOR, font=font)
+
+
+def compose_preview(images, prediction, slice_idx, modalities=('T1', 'T1c', 'T2', 'FLAIR')):
+    """
+    One row of panels for slice ``slice_idx`` along the last axis: each
+    modality in gray, then the segmentation with a legend of its labels.
+    """
+    panels = [(name, gray_to_rgb(window(images[name][:, :, slice_idx]))) for name in modalities]
+    panels.append(('Segmentation', colorize(prediction[:, :, slice_idx])))
+
+    width, height = panel_size(panels[0][1].shape)
+    canvas = Image.new('RGB', (
+        MARGIN + len(panels) * (width + MARGIN) + LEGEND_WIDTH,
+        TITLE_HEIGHT + height + 2 * MARGIN,
+    ), BACKGROUND)
+    draw = ImageDraw.Draw(canvas)
+    font = load_font()
+
+    for i, (title, rgb) in enumerate(panels):
+        left = MARGIN + i * (width + MARGIN)
+        resample = Image.NEAREST if title == 'Segmentation' else Image.BILINEAR
+        canvas.paste(Image.fromarray(rgb).resize((width, height), resample), (left, TITLE_HEIGHT + MARGIN))
+        text = f"{title}\nSlice: {slice_idx}"
+        box = draw.multiline_textbbox((0, 0), text, font=font, align='center')
+        draw.multiline_text((left + (width - box[2]) // 2, MARGIN), text,
+                            fill=TEXT_COLOR, font=font, align='center')
+
+    draw_legend(draw, MARGIN + len(panels) * (width + MARGIN), TITLE_HEIGHT + MARGIN, font)
+    return canvas
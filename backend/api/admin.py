@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import UserUpload
+from .models import UserUpload, SegmentationJob, ResumableUpload
 
 @admin.register(UserUpload)
 class UserUploadAdmin(admin.ModelAdmin):
@@ -27,3 +27,21 @@ class UserUploadAdmin(admin.ModelAdmin):
             'fields': ('created_at',)
         }),
     )
+
+
+@admin.register(SegmentationJob)
+class SegmentationJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'upload', 'status', 'attempts', 'claimed_by', 'lease_expires_at', 'available_at']
+    list_filter = ['status']
+    search_fields = ['claimed_by', 'upload__email', 'upload__user_id']
+    readonly_fields = ['created_at', 'updated_at', 'heartbeat_at']
+    ordering = ['-created_at']
+
+
+@admin.register(ResumableUpload)
+class ResumableUploadAdmin(admin.ModelAdmin):
+    list_display = ['session_id', 'file_type', 'email', 'status', 'received', 'size', 'updated_at']
+    list_filter = ['status', 'file_type']
+    search_fields = ['session_id', 'batch_id', 'email', 'user_id']
+    readonly_fields = ['created_at', 'updated_at']
+    ordering = ['-created_at']
@@ -0,0 +1,234 @@
+"""
+Offline segmentation of a directory of BraTS cases.
+
+Cases go out to a pool of worker processes through a shared queue. In each
+worker a read-ahead thread loads the next cases while the main thread runs
+inference, so reading NIfTI files overlaps with compute. Every case gets
+its own directory under the output root, holding its label map and a
+metrics.json. That file is written last, so a case counts as done once it
+exists, and an interrupted run resumes from the cases without one. Nothing
+here touches the database.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+METRICS_FILE = 'metrics.json'
+SUMMARY_FILE = 'summary.json'
+TABLE_FILE = 'metrics.csv'
+
+# Stages in the order they run, as recorded in each case's timings
+STAGES = ['load', 'wait', 'display', 'preprocess', 'infer', 'metrics', 'render', 'write']
+
+
+def find_cases(root):
+    """(name, file paths) of every case directory under ``root``, the label file last if there is one"""
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import (
+        find_case_files, find_ground_truth,
+    )
+
+    cases, skipped = [], []
+    for entry in sorted(os.listdir(root)):
+        case_dir = os.path.join(root, entry)
+        if not os.path.isdir(case_dir):
+            continue
+        try:
+            file_paths = find_case_files(case_dir)
+        except FileNotFoundError as e:
+            skipped.append((entry, str(e)))
+            continue
+        ground_truth = find_ground_truth(case_dir)
+        cases.append((entry, file_paths + [ground_truth] if ground_truth else file_paths))
+    return cases, skipped
+
+
+def is_done(output_root, name):
+    return os.path.exists(os.path.join(output_root, name, METRICS_FILE))
+
+
+def write_json(path, data):
+    """Write ``data`` to ``path`` through a temporary file, so readers never see half of it"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary, path)
+
+
+def segment_case(name, file_paths, study, output_root, render):
+    """Segment (and optionally render) one loaded case, returns its record"""
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import segment_study
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.render import render_study
+
+    output_dir = os.path.join(output_root, name)
+    os.makedirs(output_dir, exist_ok=True)
+    summary, prediction, images = segment_study(file_paths, output_dir, study=study, display_volumes=render,
+                                                 keep_images=render)
+    if render:
+        _, summary['timings']['render'] = render_study(
+            file_paths, output_dir, prediction=prediction, images=images, spacing=summary['spacing']
+        )
+    started = time.perf_counter()
+    record = dict(summary, case=name, files=file_paths)
+    write_json(os.path.join(output_dir, METRICS_FILE), record)
+    record['timings']['write'] = time.perf_counter() - started
+    return record
+
+
+def batch_worker(index, tasks, results, stop, torch_threads, output_root, read_ahead, render):
+    """Entry point of a batch process: segment cases from ``tasks`` until it runs dry"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import read_study
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import get_model
+    get_model()
+
+    # Loaded cases waiting for compute; a full queue makes the reader wait
+    loaded = queue.Queue(maxsize=max(read_ahead, 1))
+
+    def read_cases():
+        while not stop.is_set():
+            task = tasks.get()
+            if task is None:
+                break
+            name, file_paths = task
+            try:
+                loaded.put((name, file_paths, read_study(file_paths), None))
+            except Exception as e:
+                loaded.put((name, file_paths, None, e))
+        loaded.put(None)
+
+    threading.Thread(target=read_cases, daemon=True, name=f'brainseg-read-ahead-{index}').start()
+
+    while True:
+        started = time.perf_counter()
+        item = loaded.get()
+        waited = time.perf_counter() - started
+        if item is None:
+            break
+        name, file_paths, study, error = item
+        if error is None and not stop.is_set():
+            try:
+                record = segment_case(name, file_paths, study, output_root, render)
+                record['timings']['wait'] = waited
+                results.put({'case': name, 'worker': index, 'timings': record['timings']})
+                continue
+            except Exception as e:
+                error = e
+        if error is not None:
+            results.put({'case': name, 'worker': index, 'error': f"{type(error).__name__}: {error}"})
+    results.put({'worker': index, 'finished': True})
+
+
+class BatchRun:
+    """
+    One pass over the pending cases of a directory with ``num_workers``
+    processes of ``torch_threads`` threads each. Call ``run`` with a callback
+    that receives each case's result as it arrives; it returns all of them.
+    """
+
+    def __init__(self, cases, output_root, num_workers=1, torch_threads=None, read_ahead=2,
+                 render=False):
+        self.cases = cases
+        self.output_root = output_root
+        self.num_workers = max(min(int(num_workers), len(cases)), 1)
+        self.torch_threads = torch_threads or max(os.cpu_count() // self.num_workers, 1)
+        self.read_ahead = read_ahead
+        self.render = render
+        self._ctx = multiprocessing.get_context('spawn')
+        self._stop = self._ctx.Event()
+
+    def stop(self):
+        """Let every worker finish the case it is on, then stop"""
+        self._stop.set()
+
+    def run(self, on_result=None):
+        tasks, results = self._ctx.Queue(), self._ctx.Queue()
+        for case in self.cases:
+            tasks.put(case)
+        for _ in range(self.num_workers):
+            tasks.put(None)
+
+        processes = [
+            self._ctx.Process(
+                target=batch_worker,
+                args=(index, tasks, results, self._stop, self.torch_threads, self.output_root,
+                      self.read_ahead, self.render),
+                name=f'brainseg-batch-{index}',
+                daemon=True,
+            )
+            for index in range(self.num_workers)
+        ]
+        for process in processes:
+            process.start()
+
+        received, running = [], set(range(self.num_workers))
+        while running:
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that died without saying so is not coming back
+                for index in list(running):
+                    if not processes[index].is_alive():
+                        print(f"Batch worker {index} exited with code {processes[index].exitcode}")
+                        running.discard(index)
+                continue
+            if result.get('finished'):
+                running.discard(result['worker'])
+                continue
+            received.append(result)
+            if on_result:
+                on_result(result)
+
+        for process in processes:
+            process.join()
+        return received
+
+
+def stage_breakdown(results):
+    """Total and mean seconds per stage over the cases that succeeded"""
+    done = [r['timings'] for r in results if 'timings' in r]
+    breakdown = {}
+    for stage in STAGES + sorted({k for t in done for k in t} - set(STAGES)):
+        values = [t[stage] for t in done if stage in t]
+        if values:
+            breakdown[stage] = {'total': sum(values), 'mean': sum(values) / len(values)}
+    return breakdown
+
+
+def write_table(output_root, cases):
+    """One row of volumes (and scores, when there was ground truth) per finished case"""
+    rows = []
+    for name, _ in cases:
+        path = os.path.join(output_root, name, METRICS_FILE)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            metrics = json.load(f)['metrics']
+        row = {'case': name}
+        row.update({f"{region}_mm3": value for region, value in metrics['volumes_mm3'].items()})
+        for score in ('dice', 'hd95_mm', 'sensitivity'):
+            for region, value in metrics.get('ground_truth', {}).get(score, {}).items():
+                row[f"{region}_{score}"] = value
+        rows.append(row)
+
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    path = os.path.join(output_root, TABLE_FILE)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path, len(rows)
@@ -0,0 +1,143 @@
+"""
+Status events of uploads, pushed to streaming clients.
+
+Whoever changes the status or progress of an upload publishes a small
+event. On Postgres that is a NOTIFY on ``STATUS_CHANNEL``, so it reaches
+every web process: each one runs a single listener thread that dispatches
+the events to its own subscribers. Elsewhere events are dispatched within
+the publishing process only, and streams fall back to re-reading the status
+when they send a keepalive.
+
+Subscribers are asyncio queues of the ASGI event loop, one per open stream,
+registered under ('upload', id) and ('user', user_id).
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+
+from django.db import connection
+
+STATUS_CHANNEL = 'brainseg_status'
+TERMINAL_STATUSES = ('complete', 'failed')
+# Seconds between reconnect attempts of the listener after losing Postgres
+LISTEN_RETRY_SECONDS = 5
+
+
+def status_event(upload_id, user_id, status, progress=None, message=None, error=None):
+    return {
+        'upload_id': upload_id,
+        'user_id': user_id,
+        'status': status,
+        'progress': progress,
+        'message': message,
+        'error': error,
+        'time': time.time(),
+    }
+
+
+def publish_status(upload_id, user_id, status, progress=None, message=None, error=None):
+    """Tell the streams of an upload and its user about a new status or progress"""
+    event = status_event(upload_id, user_id, status, progress, message, (error or '')[:1000] or None)
+    try:
+        if connection.vendor == 'postgresql':
+            # Delivered once the current transaction commits, to every listener including ours
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [STATUS_CHANNEL, json.dumps(event)])
+            return
+    except Exception as e:
+        print(f"Could not publish status of upload {upload_id}: {str(e)}")
+        return
+    get_hub().dispatch(event)
+
+
+class StatusHub:
+    """In-process fan-out of status events to the queues of open streams"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, *keys):
+        """Queue receiving the events of ``keys``, on the running event loop"""
+        self._ensure_listener()
+        subscription = (asyncio.Queue(), asyncio.get_running_loop(), keys)
+        with self._lock:
+            for key in keys:
+                self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for key in subscription[2]:
+                subscribers = self._subscribers.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[key]
+
+    def dispatch(self, event):
+        with self._lock:
+            subscriptions = set()
+            for key in (('upload', event.get('upload_id')), ('user', event.get('user_id'))):
+                subscriptions |= self._subscribers.get(key, set())
+        for queue, loop, _ in subscriptions:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The stream's loop has closed, it unsubscribes on its way out
+                pass
+
+    @property
+    def shared(self):
+        """Whether events from other processes arrive here"""
+        return connection.vendor == 'postgresql'
+
+    def _ensure_listener(self):
+        if not self.shared:
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, daemon=True, name='brainseg-status-listener')
+            self._listener.start()
+
+    def _listen(self):
+        """LISTEN on a connection of this thread and dispatch every notification, reconnecting on errors"""
+        while True:
+            try:
+                connection.ensure_connection()
+                pg_connection = connection.connection
+                if not hasattr(pg_connection, 'poll'):
+                    print("Status listener needs psycopg2, streams fall back to keepalive re-reads")
+                    return
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {STATUS_CHANNEL}")
+                while True:
+                    if select.select([pg_connection], [], [], 5.0) == ([], [], []):
+                        continue
+                    pg_connection.poll()
+                    while pg_connection.notifies:
+                        notify = pg_connection.notifies.pop(0)
+                        try:
+                            self.dispatch(json.loads(notify.payload))
+                        except ValueError:
+                            print(f"Ignoring malformed status event: {notify.payload[:200]}")
+            except Exception as e:
+                print(f"Status listener lost its connection: {str(e)}")
+                connection.close()
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = StatusHub()
+        return _hub
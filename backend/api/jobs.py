@@ -0,0 +1,226 @@
+import os
+import select
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SegmentationJob, UserUpload
+from .progress import status_changed
+
+JOB_CHANNEL = 'brainseg_jobs'
+RENDER_CHANNEL = 'brainseg_renders'
+
+CHANNELS = {'segment': JOB_CHANNEL, 'render': RENDER_CHANNEL}
+
+
+def worker_identity():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def notify_workers(stage='segment'):
+    """Wake idle workers of ``stage`` on every node once the current transaction commits"""
+    if connection.vendor != 'postgresql':
+        return
+
+    def send():
+        with connection.cursor() as cursor:
+            cursor.execute(f"NOTIFY {CHANNELS[stage]}")
+
+    transaction.on_commit(send)
+
+
+def enqueue_job(upload, file_paths, cache_key=None):
+    job = SegmentationJob.objects.create(
+        upload=upload,
+        file_paths=list(file_paths),
+        cache_key=cache_key,
+        max_attempts=settings.BRAINSEG_JOB_MAX_ATTEMPTS,
+        available_at=timezone.now(),
+    )
+    notify_workers()
+    return job
+
+
+def claim_job(worker_id, stage='segment'):
+    """
+    Claim the next runnable job of ``stage`` for ``worker_id``, or return None.
+
+    A job is runnable when it is waiting and its retry delay has passed, or
+    when it was claimed but its lease ran out because the worker died.
+    ``SKIP LOCKED`` lets any number of workers claim concurrently without
+    blocking on each other's rows.
+    """
+    lease = timedelta(seconds=settings.BRAINSEG_JOB_LEASE_SECONDS)
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            job = (
+                SegmentationJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(stage=stage)
+                .filter(
+                    Q(status='uploaded', available_at__lte=now) |
+                    Q(status='processing', lease_expires_at__lt=now)
+                )
+                .order_by('available_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.status == 'processing':
+                print(f"Recovering job {job.id} from expired lease of {job.claimed_by}")
+                if job.attempts >= job.max_attempts:
+                    _give_up(job, f"Worker {job.claimed_by} stopped responding")
+                    continue
+
+            job.status = 'processing'
+            job.attempts += 1
+            job.claimed_by = worker_id
+            job.heartbeat_at = now
+            job.lease_expires_at = now + lease
+            job.save(update_fields=['status', 'attempts', 'claimed_by', 'heartbeat_at',
+                                    'lease_expires_at', 'updated_at'])
+            return job
+
+
+def heartbeat(job):
+    """Extend the lease on ``job``, returns False if the lease was lost"""
+    now = timezone.now()
+    extended = SegmentationJob.objects.filter(
+        id=job.id, status='processing', claimed_by=job.claimed_by
+    ).update(
+        heartbeat_at=now,
+        lease_expires_at=now + timedelta(seconds=settings.BRAINSEG_JOB_LEASE_SECONDS),
+    )
+    return extended == 1
+
+
+def hand_off_render(job, output_dir):
+    """
+    Queue the render stage of ``job`` once its label map is in
+    ``output_dir``. Returns False if the lease was lost meanwhile.
+    """
+    with transaction.atomic():
+        handed_off = SegmentationJob.objects.filter(id=job.id, claimed_by=job.claimed_by).update(
+            stage='render',
+            status='uploaded',
+            output_dir=output_dir,
+            attempts=0,
+            available_at=timezone.now(),
+            claimed_by=None,
+            lease_expires_at=None,
+            updated_at=timezone.now(),
+        )
+        if handed_off:
+            notify_workers('render')
+    return handed_off == 1
+
+
+def complete_job(job):
+    SegmentationJob.objects.filter(id=job.id, claimed_by=job.claimed_by).update(
+        status='complete', lease_expires_at=None, updated_at=timezone.now()
+    )
+
+
+def fail_job(job, error):
+    """
+    Schedule a retry with exponential backoff, or give up after the last
+    attempt. Returns True if the job will be retried.
+    """
+    if job.attempts >= job.max_attempts:
+        _give_up(job, error)
+        return False
+
+    delay = settings.BRAINSEG_JOB_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+    rescheduled = SegmentationJob.objects.filter(id=job.id, claimed_by=job.claimed_by).update(
+        status='uploaded',
+        available_at=timezone.now() + timedelta(seconds=delay),
+        claimed_by=None,
+        lease_expires_at=None,
+        last_error=error,
+        updated_at=timezone.now(),
+    )
+    if not rescheduled:
+        # The lease was lost and another worker owns the job now
+        return False
+    upload_status = 'mask_ready' if job.stage == 'render' else 'uploaded'
+    message = f"Attempt {job.attempts} of {job.max_attempts} failed, retrying: {error}"
+    # A failed render keeps its mask, only the previews are retried
+    UserUpload.objects.filter(id=job.upload_id).update(status=upload_status, error_message=message)
+    status_changed(job.upload_id, upload_owner(job), upload_status, error=message)
+    return True
+
+
+def _give_up(job, error):
+    SegmentationJob.objects.filter(id=job.id).update(
+        status='failed', lease_expires_at=None, last_error=error, updated_at=timezone.now()
+    )
+    UserUpload.objects.filter(id=job.upload_id).update(status='failed', error_message=error)
+    status_changed(job.upload_id, upload_owner(job), 'failed', error=error)
+
+
+def upload_owner(job):
+    return UserUpload.objects.filter(id=job.upload_id).values_list('user_id', flat=True).first()
+
+
+class Heartbeat:
+    """Background thread keeping the lease of a running job alive"""
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or settings.BRAINSEG_JOB_HEARTBEAT_SECONDS
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'brainseg-heartbeat-{job.id}',
+                                        daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                if not heartbeat(self.job):
+                    print(f"Lost lease on job {self.job.id}")
+                    self.lost = True
+                    return
+        finally:
+            connection.close()
+
+
+def listen_for_jobs(wake, stop, stage='segment'):
+    """
+    Set ``wake`` whenever a job of ``stage`` is queued anywhere, until ``stop`` is set.
+
+    Uses Postgres LISTEN/NOTIFY on a dedicated connection. On other databases
+    this returns immediately and workers fall back to their idle timeout.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    connection.ensure_connection()
+    pg_connection = connection.connection
+    if not hasattr(pg_connection, 'poll'):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANNELS[stage]}")
+    try:
+        while not stop.is_set():
+            if select.select([pg_connection], [], [], 1.0) == ([], [], []):
+                continue
+            pg_connection.poll()
+            if pg_connection.notifies:
+                pg_connection.notifies.clear()
+                wake.set()
+    finally:
+        connection.close()
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.inference import predict_volume
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.loading import load_volumes
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.precision import PRECISION_MODES, compare_masks
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import (
+    find_case_files, prepare_input,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import default_device, get_registry
+
+LABELS = ['Background', 'Necrotic core', 'Edema', 'Enhancing tumor']
+
+
+class Command(BaseCommand):
+    help = 'Compare argmax masks of reduced-precision inference modes against fp32 on a reference case'
+
+    def add_arguments(self, parser):
+        parser.add_argument('case_dir', help='Directory holding the *_t1, *_t1ce, *_t2 and *_flair volumes')
+        parser.add_argument('--modes', nargs='+', default=[m for m in PRECISION_MODES if m != 'fp32'],
+                            choices=PRECISION_MODES)
+        parser.add_argument('--model', help='Registered checkpoint name (default: BRAINSEG_MODEL)')
+        parser.add_argument('--threshold', type=float, default=0.999,
+                            help='Minimum voxel agreement with fp32')
+
+    def handle(self, *args, **options):
+        device = default_device()
+        volume, _ = load_volumes(find_case_files(options['case_dir']))
+        image_tensor, _, _ = prepare_input(volume)
+        registry = get_registry()
+
+        def run(precision):
+            model = registry.get(options['model'] or settings.BRAINSEG_MODEL, device, precision)
+            start = time.perf_counter()
+            prediction = predict_volume(model, image_tensor, device)
+            return prediction, time.perf_counter() - start
+
+        reference, reference_time = run('fp32')
+        self.stdout.write(f"fp32: {reference_time:.2f}s")
+
+        failed = []
+        for mode in options['modes']:
+            prediction, elapsed = run(mode)
+            report = compare_masks(reference, prediction)
+            self.stdout.write(
+                f"{mode}: {elapsed:.2f}s ({reference_time / elapsed:.2f}x), "
+                f"agreement {report['agreement']:.5f}"
+            )
+            for label, name in enumerate(LABELS):
+                self.stdout.write(
+                    f"    {name:16s} agreement {report['class_agreement'][label]:.5f}  "
+                    f"dice {report['dice'][label]:.5f}"
+                )
+            if report['agreement'] < options['threshold']:
+                failed.append(mode)
+
+        if failed:
+            raise CommandError(f"Below agreement threshold {options['threshold']}: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('All modes match fp32 within the threshold'))
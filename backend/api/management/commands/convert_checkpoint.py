@@ -0,0 +1,62 @@
+import os
+
+import torch
+from django.core.management.base import BaseCommand, CommandError
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.checkpoints import (
+    flat_path, read_flat, write_flat,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.model import UNet3D
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import (
+    get_registry, load_state_dict,
+)
+
+
+class Command(BaseCommand):
+    help = ('Convert pickled .pth checkpoints to memory-mappable .safetensors files. '
+            'Only run this on checkpoints you trust, unpickling them can execute code.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append',
+                            help='Registered checkpoint to convert, repeatable (default: all .pth ones)')
+        parser.add_argument('--output', help='Output path, only with a single --model')
+
+    def handle(self, *args, **options):
+        registry = get_registry()
+        names = options['model'] or [
+            name for name, path in registry.registered().items() if path.endswith('.pth')
+        ]
+        if options['output'] and len(names) != 1:
+            raise CommandError('--output needs exactly one --model')
+
+        for name in names:
+            try:
+                source = registry.source_path(name)
+            except (KeyError, FileNotFoundError) as e:
+                if options['model']:
+                    raise CommandError(str(e))
+                self.stdout.write(f"Skipping '{name}': {e}")
+                continue
+            output = options['output'] or flat_path(source)
+            self.convert(source, output)
+
+    def convert(self, source, output):
+        checkpoint = torch.load(source, map_location='cpu', weights_only=False)
+        # Loading into UNet3D checks the keys and shapes before anything is written
+        model = load_state_dict(UNet3D(in_channels=4, out_channels=4), checkpoint)
+        state_dict = model.state_dict()
+
+        metadata = {'source': os.path.basename(source), 'format': 'pt'}
+        if isinstance(checkpoint, dict):
+            for key in ('epoch', 'best_dice', 'val_dice'):
+                if key in checkpoint:
+                    metadata[key] = checkpoint[key]
+        write_flat(state_dict, output, metadata)
+
+        converted = read_flat(output)
+        if any(not torch.equal(state_dict[k], converted[k]) for k in state_dict):
+            os.unlink(output)
+            raise CommandError(f"Round trip of {source} did not match, removed {output}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {output} ({os.path.getsize(output) / 2**20:.1f} MB, {len(state_dict)} tensors)"
+        ))
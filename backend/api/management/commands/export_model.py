@@ -0,0 +1,41 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.backends import (
+    OnnxBackend, artifact_path, export_onnx, export_torchscript, self_test,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.quantization import fold_batchnorm
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import build_model, get_registry
+
+
+class Command(BaseCommand):
+    help = 'Export a checkpoint as an ONNX or TorchScript graph and check it against eager PyTorch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=['onnx', 'torchscript'], default='onnx')
+        parser.add_argument('--model', help='Registered checkpoint to export (default: BRAINSEG_MODEL)')
+        parser.add_argument('--output', help='Output path (default: next to the checkpoint)')
+
+    def handle(self, *args, **options):
+        name = options['model'] or settings.BRAINSEG_MODEL
+        checkpoint = get_registry().checkpoint_path(name)
+        output = options['output'] or artifact_path(checkpoint, options['backend'])
+
+        model = build_model(checkpoint, 'cpu')
+        # BatchNorm folded into the convolutions gives the graph fewer nodes to run
+        folded = fold_batchnorm(build_model(checkpoint, 'cpu'))
+
+        if options['backend'] == 'onnx':
+            export_onnx(folded, output)
+            exported = OnnxBackend(folded, 'cpu', onnx_path=output)
+        else:
+            exported = export_torchscript(folded, 'cpu', output)
+
+        ok, max_diff, agreement = self_test(exported, model, 'cpu')
+        self.stdout.write(f"Self-test: max |diff| {max_diff:.2e}, argmax agreement {agreement:.5f}")
+        if not ok:
+            os.unlink(output)
+            raise CommandError('Exported graph does not match eager PyTorch, removed it')
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output}"))
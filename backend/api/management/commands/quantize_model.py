@@ -0,0 +1,115 @@
+import os
+import time
+
+import numpy as np
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.inference import predict_volume
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.loading import load_volumes
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.metrics import confusion_matrix
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.precision import scores_from_confusion
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import (
+    find_case_files, prepare_input,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.quantization import (
+    QUANTIZED_SUFFIX, convert_int8, prepare_int8, save_scripted,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import build_model, get_registry
+
+LABELS = ['Background', 'Necrotic core', 'Edema', 'Enhancing tumor']
+
+
+class Command(BaseCommand):
+    help = ('Build an int8 UNet3D from a checkpoint by post-training quantization, '
+            'and only publish it if it agrees with the fp32 model')
+
+    def add_arguments(self, parser):
+        parser.add_argument('calibration_dir', help='Directory with one sub-directory per BraTS case')
+        parser.add_argument('--model', help='Registered checkpoint to quantize (default: BRAINSEG_MODEL)')
+        parser.add_argument('--output', help='Artifact path (default: <checkpoint>.int8.ts.pt next to it)')
+        parser.add_argument('--calibration-cases', type=int, default=8)
+        parser.add_argument('--eval-cases', type=int, default=4,
+                            help='Cases after the calibration ones used for the accuracy gate')
+        parser.add_argument('--min-agreement', type=float, default=0.995,
+                            help='Minimum voxel agreement with fp32')
+        parser.add_argument('--min-dice', type=float, default=0.9,
+                            help='Minimum Dice with fp32 for each tumor class present')
+
+    def handle(self, *args, **options):
+        name = options['model'] or settings.BRAINSEG_MODEL
+        checkpoint = get_registry().checkpoint_path(name)
+        output = options['output'] or os.path.splitext(checkpoint)[0] + QUANTIZED_SUFFIX
+
+        cases = self.find_cases(options['calibration_dir'])
+        calibration = cases[:options['calibration_cases']]
+        evaluation = cases[len(calibration):len(calibration) + options['eval_cases']] or calibration
+        if not calibration:
+            raise CommandError(f"No cases found in {options['calibration_dir']}")
+
+        device = torch.device('cpu')
+        fp32_model = build_model(checkpoint, device)
+
+        self.stdout.write(f"Calibrating on {len(calibration)} case(s)...")
+        start = time.perf_counter()
+        prepared = prepare_int8(fp32_model)
+        for case_dir in calibration:
+            self.stdout.write(f"    {os.path.basename(case_dir)}")
+            predict_volume(prepared, self.load_case(case_dir), device)
+        int8_model = convert_int8(prepared)
+        self.stdout.write(f"Calibration took {time.perf_counter() - start:.1f}s")
+
+        self.stdout.write(f"Comparing against fp32 on {len(evaluation)} case(s)...")
+        confusion = np.zeros((4, 4), dtype=np.int64)
+        fp32_time = int8_time = 0.0
+        for case_dir in evaluation:
+            image_tensor = self.load_case(case_dir)
+            start = time.perf_counter()
+            reference = predict_volume(fp32_model, image_tensor, device)
+            fp32_time += time.perf_counter() - start
+            start = time.perf_counter()
+            candidate = predict_volume(int8_model, image_tensor, device)
+            int8_time += time.perf_counter() - start
+            confusion += confusion_matrix(reference, candidate)
+
+        report = scores_from_confusion(confusion)
+        self.stdout.write(f"fp32 {fp32_time:.1f}s, int8 {int8_time:.1f}s ({fp32_time / int8_time:.2f}x)")
+        self.stdout.write(f"Voxel agreement: {report['agreement']:.5f}")
+        for label, label_name in enumerate(LABELS):
+            self.stdout.write(
+                f"    {label_name:16s} agreement {report['class_agreement'][label]:.5f}  "
+                f"dice {report['dice'][label]:.5f}"
+            )
+
+        problems = []
+        if report['agreement'] < options['min_agreement']:
+            problems.append(f"agreement {report['agreement']:.5f} < {options['min_agreement']}")
+        for label in range(1, len(LABELS)):
+            dice = report['dice'][label]
+            if not np.isnan(dice) and dice < options['min_dice']:
+                problems.append(f"{LABELS[label]} dice {dice:.5f} < {options['min_dice']}")
+        if problems:
+            raise CommandError(f"Quantized model not published: {'; '.join(problems)}")
+
+        save_scripted(int8_model, output)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output} ({os.path.getsize(output) / 2**20:.1f} MB)"))
+
+    def find_cases(self, root):
+        cases = []
+        for entry in sorted(os.listdir(root)):
+            case_dir = os.path.join(root, entry)
+            if not os.path.isdir(case_dir):
+                continue
+            try:
+                find_case_files(case_dir)
+            except FileNotFoundError as e:
+                self.stderr.write(f"Skipping {entry}: {e}")
+                continue
+            cases.append(case_dir)
+        return cases
+
+    def load_case(self, case_dir):
+        volume, _ = load_volumes(find_case_files(case_dir))
+        image_tensor, _, _ = prepare_input(volume)
+        return image_tensor
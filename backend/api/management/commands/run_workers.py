@@ -0,0 +1,52 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.workers import create_worker_pool
+
+
+class Command(BaseCommand):
+    help = 'Run segmentation worker processes that claim jobs from the shared database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Number of worker processes')
+        parser.add_argument('--threads', type=int, help='Torch threads per worker')
+        parser.add_argument('--concurrent-jobs', type=int, help='Jobs run side by side per worker')
+        parser.add_argument('--no-affinity', action='store_true', help='Do not pin workers to CPUs')
+        parser.add_argument('--render-workers', type=int,
+                            help='Number of render processes (default BRAINSEG_RENDER_WORKERS)')
+        parser.add_argument('--stage', choices=['all', 'segment', 'render'], default='all',
+                            help='Run only the inference or only the render workers on this node')
+
+    def handle(self, *args, **options):
+        pools = []
+        if options['stage'] in ('all', 'segment'):
+            pools.append(create_worker_pool(
+                num_workers=options['workers'],
+                torch_threads=options['threads'],
+                concurrent_jobs=options['concurrent_jobs'],
+                cpu_affinity=False if options['no_affinity'] else None,
+            ))
+        render_workers = options['render_workers']
+        if render_workers is None:
+            render_workers = settings.BRAINSEG_RENDER_WORKERS
+        if options['stage'] in ('all', 'render') and render_workers:
+            pools.append(create_worker_pool('render', num_workers=render_workers))
+        if not pools:
+            self.stderr.write('No workers to run, render workers are disabled')
+            return
+
+        def stop(signum, frame):
+            self.stdout.write('Shutting down, waiting for running jobs to finish...')
+            for pool in pools:
+                pool.shutdown()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        for pool in pools:
+            pool.start()
+            self.stdout.write(self.style.SUCCESS(f'Started {pool.num_workers} {pool.stage} worker(s)'))
+        for pool in pools:
+            pool.join()
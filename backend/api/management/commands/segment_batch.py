@@ -0,0 +1,107 @@
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.batch import SUMMARY_FILE, BatchRun, find_cases, is_done, stage_breakdown, write_json, write_table
+
+
+class Command(BaseCommand):
+    help = ('Segment every BraTS case under a directory with a pool of worker processes, '
+            'writing label maps and metrics to an output directory and skipping cases already done')
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases_dir', help='Directory with one sub-directory per BraTS case')
+        parser.add_argument('output_dir', help='Where each case gets a directory with its mask and metrics')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--threads', type=int,
+                            help='Torch threads per worker (default: CPUs divided by workers)')
+        parser.add_argument('--read-ahead', type=int, default=2,
+                            help='Cases each worker loads ahead of the one it is segmenting')
+        parser.add_argument('--render', action='store_true',
+                            help='Also write previews, animations, sprites and thumbnails')
+        parser.add_argument('--limit', type=int, help='Segment at most this many pending cases')
+        parser.add_argument('--restart', action='store_true',
+                            help='Segment every case again instead of resuming')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['cases_dir']):
+            raise CommandError(f"{options['cases_dir']} is not a directory")
+        output_root = options['output_dir']
+        os.makedirs(output_root, exist_ok=True)
+
+        cases, skipped = find_cases(options['cases_dir'])
+        for name, reason in skipped:
+            self.stderr.write(f"Skipping {name}: {reason}")
+        pending = [case for case in cases if options['restart'] or not is_done(output_root, case[0])]
+        done = len(cases) - len(pending)
+        if options['limit'] is not None:
+            pending = pending[:options['limit']]
+        self.stdout.write(f"{len(cases)} case(s), {done} already done, {len(pending)} to segment")
+        if not pending:
+            self.write_summary(output_root, cases, [], 0.0)
+            return
+
+        run = BatchRun(pending, output_root, num_workers=options['workers'], torch_threads=options['threads'],
+                       read_ahead=options['read_ahead'], render=options['render'])
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the cases in progress, run again to resume...')
+            run.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write(f"Starting {run.num_workers} worker(s) with {run.torch_threads} thread(s) each")
+        started = time.perf_counter()
+        count = [0]
+
+        def report(result):
+            count[0] += 1
+            progress = f"[{count[0]}/{len(pending)}] {result['case']}"
+            if 'error' in result:
+                self.stderr.write(f"{progress} failed: {result['error']}")
+            else:
+                timings = result['timings']
+                self.stdout.write(f"{progress} in {timings['preprocess'] + timings['infer']:.1f}s "
+                                  f"(worker {result['worker']})")
+
+        results = run.run(report)
+        self.write_summary(output_root, cases, results, time.perf_counter() - started)
+
+    def write_summary(self, output_root, cases, results, elapsed):
+        succeeded = sum(1 for r in results if 'timings' in r)
+        failed = [r for r in results if 'error' in r]
+        breakdown = stage_breakdown(results)
+        table, rows = write_table(output_root, cases)
+
+        self.stdout.write('')
+        if succeeded and elapsed:
+            self.stdout.write(self.style.SUCCESS(
+                f"Segmented {succeeded} case(s) in {elapsed:.1f}s: {succeeded / elapsed:.3f} cases/s"
+            ))
+        if breakdown:
+            busy = sum(stage['total'] for name, stage in breakdown.items() if name != 'wait')
+            self.stdout.write('Stage        total (s)   mean (s)   share')
+            for name, stage in breakdown.items():
+                share = f"{stage['total'] / busy * 100:5.1f}%" if busy and name != 'wait' else '     -'
+                self.stdout.write(f"{name:12s} {stage['total']:9.1f} {stage['mean']:10.2f}   {share}")
+            self.stdout.write("Loading runs ahead in its own thread; 'wait' is how long compute "
+                              "sat idle waiting for it")
+        if failed:
+            self.stderr.write(f"{len(failed)} case(s) failed, they are retried on the next run:")
+            for result in failed:
+                self.stderr.write(f"    {result['case']}: {result['error']}")
+        self.stdout.write(f"Metrics of {rows} case(s) in {table}")
+
+        write_json(os.path.join(output_root, SUMMARY_FILE), {
+            'finished': time.time(),
+            'cases': len(cases),
+            'done': rows,
+            'segmented': succeeded,
+            'failed': {r['case']: r['error'] for r in failed},
+            'seconds': elapsed,
+            'cases_per_second': succeeded / elapsed if succeeded and elapsed else None,
+            'stages': breakdown,
+        })
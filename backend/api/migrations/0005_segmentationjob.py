@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_userupload_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_paths', models.JSONField()),
+                ('status', models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('analyzing', 'Analyzing'), ('complete', 'Complete'), ('failed', 'Failed')], default='uploaded', max_length=100)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('available_at', models.DateTimeField()),
+                ('claimed_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='api.userupload')),
+            ],
+            options={
+                'ordering': ['available_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='job_claim_idx'), models.Index(fields=['status', 'lease_expires_at'], name='job_lease_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_segmentationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='segmentationjob',
+            name='cache_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
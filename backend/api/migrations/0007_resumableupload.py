@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:43
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_segmentationjob_cache_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumableUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.UUIDField(db_index=True, default=uuid.uuid4)),
+                ('batch_id', models.CharField(max_length=36)),
+                ('user_id', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254)),
+                ('file_type', models.CharField(max_length=10)),
+                ('filename', models.CharField(max_length=255)),
+                ('storage_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('header_checked', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('receiving', 'Receiving'), ('received', 'Received'), ('rejected', 'Rejected'), ('finalized', 'Finalized')], default='receiving', max_length=20)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('session_id', 'file_type'), name='upload_session_file_type')],
+            },
+        ),
+    ]
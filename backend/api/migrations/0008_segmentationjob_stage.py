@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_resumableupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='segmentationjob',
+            name='output_dir',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='segmentationjob',
+            name='stage',
+            field=models.CharField(choices=[('segment', 'Segment'), ('render', 'Render')], default='segment', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='segmentationjob',
+            name='status',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('analyzing', 'Analyzing'), ('mask_ready', 'Mask ready'), ('complete', 'Complete'), ('failed', 'Failed')], default='uploaded', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='userupload',
+            name='status',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('analyzing', 'Analyzing'), ('mask_ready', 'Mask ready'), ('complete', 'Complete'), ('failed', 'Failed')], default='uploaded', max_length=100),
+        ),
+    ]
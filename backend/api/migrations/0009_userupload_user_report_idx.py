@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_segmentationjob_stage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userupload',
+            index=models.Index(fields=['user_id', 'status', 'batch_id', 'created_at'], name='user_report_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:21
+
+import re
+
+from django.db import migrations, models
+
+RESULT_KEY = re.compile(r'/results/([0-9a-f]{64})/')
+
+
+def backfill_result_keys(apps, schema_editor):
+    """Point uploads answered before this field existed at the cache entry their results use"""
+    UserUpload = apps.get_model('api', 'UserUpload')
+    for upload in UserUpload.objects.filter(results__isnull=False).only('id', 'results').iterator():
+        match = RESULT_KEY.search(str((upload.results or {}).get('label_map') or ''))
+        if match:
+            UserUpload.objects.filter(id=upload.id).update(result_key=match.group(1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_userupload_user_report_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userupload',
+            name='result_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_result_keys, migrations.RunPython.noop),
+    ]
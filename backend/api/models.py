@@ -15,6 +15,7 @@ class UserUpload(models.Model):
         ('uploaded', 'Uploaded'),
         ('processing', 'Processing'),
         ('analyzing', 'Analyzing'),
+        ('mask_ready', 'Mask ready'),
         ('complete', 'Complete'),
         ('failed', 'Failed'),
     ]
@@ -44,12 +45,16 @@ class UserUpload(models.Model):
         default='uploaded'
     )
     error_message = models.TextField(null=True, blank=True)
+    # Result cache entry the results are served from, kept while this row exists
+    result_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user_id', '-created_at'], name='user_created_idx'),
             models.Index(fields=['created_at'], name='created_at_idx'),
+            # Newest completed row of each batch of a user, see get_user_reports
+            models.Index(fields=['user_id', 'status', 'batch_id', 'created_at'], name='user_report_idx'),
         ]
 
     def __str__(self):
@@ -68,3 +73,93 @@ class ProcessedResult(models.Model):
             models.Index(fields=['result_id'], name='result_id_idx'),
             models.Index(fields=['user'], name='user_idx'),
         ]
+
+class SegmentationJob(models.Model):
+    """
+    Durable queue entry for segmenting one uploaded study.
+
+    Workers on any node claim jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``
+    and hold them under a lease that they keep extending with heartbeats. A
+    job whose lease runs out is picked up again by another worker. The states
+    are the ones of ``UserUpload.status``: 'uploaded' means waiting in the
+    queue and 'processing' means claimed.
+
+    A job runs in two stages. Inference workers claim 'segment' jobs, store
+    the label map in ``output_dir`` and hand the job back to the queue as a
+    'render' job, which render workers turn into previews and finalize.
+    """
+    STAGE_CHOICES = [
+        ('segment', 'Segment'),
+        ('render', 'Render'),
+    ]
+
+    upload = models.OneToOneField(UserUpload, on_delete=models.CASCADE, related_name='job')
+    file_paths = models.JSONField()
+    # Content address of the result, see api.result_cache
+    cache_key = models.CharField(max_length=64, null=True, blank=True)
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES, default='segment')
+    # Where the segment stage left the label map for the render stage
+    output_dir = models.CharField(max_length=500, null=True, blank=True)
+    status = models.CharField(
+        max_length=100,
+        choices=UserUpload.STATUS_CHOICES,
+        default='uploaded'
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    available_at = models.DateTimeField()
+    claimed_by = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['available_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='job_claim_idx'),
+            models.Index(fields=['status', 'lease_expires_at'], name='job_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}) for upload {self.upload_id}"
+
+class ResumableUpload(models.Model):
+    """
+    One volume of a study uploaded in chunks.
+
+    Chunks are written at their offset straight into ``storage_name`` under
+    MEDIA_ROOT, ``received`` is how many bytes from the start are on disk. A
+    client that lost its connection asks for ``received`` and carries on from
+    there. The four volumes of a study share a ``session_id``.
+    """
+    STATUS_CHOICES = [
+        ('receiving', 'Receiving'),
+        ('received', 'Received'),
+        ('rejected', 'Rejected'),
+        ('finalized', 'Finalized'),
+    ]
+
+    session_id = models.UUIDField(default=uuid.uuid4, db_index=True)
+    batch_id = models.CharField(max_length=36)
+    user_id = models.CharField(max_length=255)
+    email = models.EmailField()
+    file_type = models.CharField(max_length=10)
+    filename = models.CharField(max_length=255)
+    storage_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    header_checked = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='receiving')
+    error_message = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session_id', 'file_type'], name='upload_session_file_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_type} of session {self.session_id} ({self.received}/{self.size} bytes)"
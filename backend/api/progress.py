@@ -0,0 +1,118 @@
+"""
+Progress of running jobs, kept in the cache rather than the database.
+
+Workers report each step here and clients polling /api/status/ read it
+from here first, so a job only writes its upload row when its status
+changes. That takes a cache shared by the web and worker processes: set
+REDIS_URL. Job workers run in processes of their own, so with a
+local-memory cache (the default without REDIS_URL), or while the shared
+cache is failing, each new step is written to the upload row instead.
+Progress and status changes are also published to the status streams.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .events import publish_status
+
+_warned = [False]
+# Time and step of the last progress written to each upload's row, see write_progress
+_written = {}
+_written_lock = threading.Lock()
+
+
+def progress_key(upload_id):
+    return f"brainseg:progress:{upload_id}"
+
+
+def cache_shared():
+    """Whether the default cache is one every process sees"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _warn(message):
+    if not _warned[0]:
+        print(message)
+        _warned[0] = True
+
+
+def _call(method, *args):
+    """Call the shared cache, returns (ok, result)"""
+    try:
+        return True, getattr(cache, method)(*args)
+    except Exception as e:
+        _warn(f"Progress cache unavailable, writing progress to the database: {str(e)}")
+        return False, None
+
+
+def write_progress(upload_id, result):
+    """
+    Store the progress ``result`` on the upload row while its job runs. A
+    new step is always written; the same step reported again is written at
+    most every BRAINSEG_PROGRESS_DB_SECONDS.
+    """
+    from .models import UserUpload
+
+    now = time.monotonic()
+    step = (result.get('progress'), result.get('status'))
+    with _written_lock:
+        last = _written.get(upload_id)
+        if last is not None and last[1] == step and now - last[0] < settings.BRAINSEG_PROGRESS_DB_SECONDS:
+            return
+        _written[upload_id] = (now, step)
+    # A row past 'processing' already holds its results
+    UserUpload.objects.filter(id=upload_id, status='processing').update(results=result)
+
+
+def report_progress(upload_id, user_id, percent, message, status='processing'):
+    """Record how far the job of an upload has got, in the shape processing_status answers with"""
+    result = {'progress': percent, 'status': message, 'processing_status': message}
+    if not cache_shared():
+        _warn("No shared cache configured (set REDIS_URL), writing progress to the database")
+        write_progress(upload_id, result)
+    elif not _call('set', progress_key(upload_id), {
+        'status': status,
+        'result': result,
+        'error': None,
+    }, settings.BRAINSEG_PROGRESS_TTL)[0]:
+        write_progress(upload_id, result)
+    publish_status(upload_id, user_id, status, progress=percent, message=message)
+
+
+def get_progress(upload_id):
+    """Latest progress reported to the shared cache for an upload, or None"""
+    if not cache_shared():
+        return None
+    return _call('get', progress_key(upload_id))[1]
+
+
+def read_status(upload_id):
+    """
+    Status of an upload as processing_status answers it: the reported
+    progress while its job runs, else what its row says. None if there is
+    no such upload.
+    """
+    progress = get_progress(upload_id)
+    if progress is not None:
+        return progress
+    from .models import UserUpload
+    upload = UserUpload.objects.filter(id=upload_id).only('status', 'results', 'error_message').first()
+    if upload is None:
+        return None
+    return {'status': upload.status, 'result': upload.results, 'error': upload.error_message}
+
+
+def status_changed(upload_id, user_id, status, error=None):
+    """
+    Drop the progress of an upload whose new ``status`` was just stored in
+    the database, and announce it
+    """
+    if cache_shared():
+        _call('delete', progress_key(upload_id))
+    with _written_lock:
+        _written.pop(upload_id, None)
+    publish_status(upload_id, user_id, status, error=error)
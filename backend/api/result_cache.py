@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadhandler import FileUploadHandler
+
+RESULTS_FILE = 'results.json'
+
+# Scratch directories left behind by crashed workers are removed after this long
+STALE_TMP_SECONDS = 24 * 3600
+
+HITS_KEY = 'brainseg:result_cache:hits'
+MISSES_KEY = 'brainseg:result_cache:misses'
+
+# Entries are named by their key; other directories under results/ are not the cache's
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 of every uploaded file while it streams in.
+
+    Chunks are passed on unchanged to the next handler, which still stores
+    the file. ``digests`` holds (field name, hex digest) pairs in upload order.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = []
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests.append((self.field_name, self._hash.hexdigest()))
+        return None
+
+
+_checkpoint_digests = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path, block_size=2**20):
+    """SHA-256 of a checkpoint, remembered until the file changes"""
+    stat = os.stat(path)
+    signature = (path, stat.st_mtime_ns, stat.st_size)
+    with _digest_lock:
+        if signature in _checkpoint_digests:
+            return _checkpoint_digests[signature]
+    digest = sha256_file(path, block_size)
+    with _digest_lock:
+        _checkpoint_digests[signature] = digest
+    return digest
+
+
+def sha256_file(path, block_size=2**20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_version():
+    """
+    Identifies everything that decides the mask for a given input: the
+    weights of the serving checkpoint and the preprocessing and inference
+    settings.
+    """
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import get_registry
+    checkpoint = get_registry().checkpoint_path(settings.BRAINSEG_MODEL)
+    return '/'.join([
+        settings.BRAINSEG_MODEL,
+        file_digest(checkpoint)[:16],
+        settings.BRAINSEG_PRECISION,
+        settings.BRAINSEG_BACKEND,
+        settings.BRAINSEG_NORMALIZATION,
+        ','.join(str(p) for p in settings.BRAINSEG_CLIP_PERCENTILES),
+        str(settings.BRAINSEG_CROP_MARGIN),
+        ','.join(str(p) for p in settings.BRAINSEG_PATCH_SIZE),
+        str(settings.BRAINSEG_PATCH_OVERLAP),
+        # A memory limit can shrink the patch
+        str(settings.BRAINSEG_INFERENCE_MEMORY_MB or 0),
+    ])
+
+
+def cache_key(digests, version):
+    """Key of the result for input volumes with ``digests``, in modality order"""
+    return hashlib.sha256('|'.join(list(digests) + [version]).encode('utf-8')).hexdigest()
+
+
+def result_url(key):
+    return f"{settings.MEDIA_URL}results/{key}"
+
+
+class ResultCache:
+    """
+    Content-addressed results under ``MEDIA_ROOT/results/<key>/``.
+
+    Workers render into a scratch directory and publish it with a single
+    rename, so a directory with a ``results.json`` is always complete. When
+    the entries under ``results/`` exceed ``max_bytes`` the least recently
+    used ones are removed, except those the results of an upload still point
+    at. Per-batch result directories of uploads without a key are left alone.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key, record=True):
+        """Stored results for ``key``, or None. Counts a hit or a miss if ``record``."""
+        path = os.path.join(self.entry_dir(key), RESULTS_FILE)
+        try:
+            with open(path) as f:
+                results = json.load(f)
+        except (FileNotFoundError, ValueError):
+            if record:
+                self._count(MISSES_KEY)
+            return None
+        # The mtime of results.json records the last use, for eviction
+        os.utime(path)
+        if record:
+            self._count(HITS_KEY)
+        return results
+
+    def scratch_dir(self, key):
+        return tempfile.mkdtemp(prefix=f".tmp-{key[:16]}-", dir=self.root)
+
+    def publish(self, key, scratch, results):
+        """Move a rendered ``scratch`` directory into place as the entry for ``key``"""
+        with open(os.path.join(scratch, RESULTS_FILE), 'w') as f:
+            json.dump(results, f)
+        try:
+            os.rename(scratch, self.entry_dir(key))
+        except OSError:
+            # Another worker published the same key first, theirs is as good
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used unreferenced entries until the total fits ``max_bytes``"""
+        from .models import UserUpload
+
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith('.'):
+                if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not KEY_PATTERN.match(name):
+                continue
+            marker = os.path.join(path, RESULTS_FILE)
+            last_used = os.path.getmtime(marker if os.path.exists(marker) else path)
+            entries.append((last_used, directory_size(path), name))
+
+        if not self.max_bytes:
+            return
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        names = [name for _, _, name in entries]
+        referenced = set(UserUpload.objects.filter(result_key__in=names).values_list('result_key', flat=True))
+        for last_used, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep or name in referenced:
+                continue
+            print(f"Evicting cached result {name} ({size / 2**20:.1f} MB)")
+            shutil.rmtree(self.entry_dir(name), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        hits = cache.get(HITS_KEY, 0)
+        misses = cache.get(MISSES_KEY, 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+    def _count(self, key):
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, 1, timeout=None)
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+_result_cache = None
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        max_mb = getattr(settings, 'BRAINSEG_RESULT_CACHE_MB', None)
+        _result_cache = ResultCache(
+            os.path.join(settings.MEDIA_ROOT, 'results'),
+            max_bytes=int(max_mb * 2**20) if max_mb else None,
+        )
+    return _result_cache
@@ -14,21 +14,47 @@ class UserSerializer(serializers.ModelSerializer):
 
 class UserUploadSerializer(serializers.ModelSerializer):
     results = serializers.JSONField(required=False)
+    thumbnail = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+    sprites = serializers.SerializerMethodField()
     
     class Meta:
         model = UserUpload
-        fields = ['id', 'batch_id', 'user_id', 'email', 'created_at', 'results', 'status', 'error_message']
+        fields = ['id', 'batch_id', 'user_id', 'email', 'created_at', 'results', 'status', 'error_message',
+                  'thumbnail', 'thumbnails', 'sprites']
+
+    base_url = 'http://localhost:8000'
+
+    def absolute(self, url):
+        return url if url.startswith('http') else self.base_url + url
+
+    def get_thumbnails(self, instance):
+        """Thumbnail URLs by size in pixels, the names are content hashes so they never go stale"""
+        thumbnails = (instance.results or {}).get('thumbnails') or {}
+        return {size: self.absolute(url) for size, url in thumbnails.items()}
+
+    def get_thumbnail(self, instance):
+        thumbnails = self.get_thumbnails(instance)
+        return thumbnails[min(thumbnails, key=int)] if thumbnails else None
+
+    def get_sprites(self, instance):
+        """Sprite sheets per plane, smallest tiles first, with their grid and slice indices"""
+        sprites = (instance.results or {}).get('sprites') or {}
+        return {
+            plane: [dict(sheet, url=self.absolute(sheet['url'])) for sheet in sorted(sheets, key=lambda s: s['size'])]
+            for plane, sheets in sprites.items()
+        }
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         if instance.results:
-            base_url = 'http://localhost:8000'  
             results = instance.results
-            if 'static_image' in results and not results['static_image'].startswith('http'):
-
-                results['static_image'] = base_url + results['static_image']
-            if 'gif' in results and not results['gif'].startswith('http'):
-                results['gif'] = base_url + results['gif']
+            if 'static_image' in results:
+                results['static_image'] = self.absolute(results['static_image'])
+            if 'gif' in results:
+                results['gif'] = self.absolute(results['gif'])
+            if 'url' in (results.get('animation') or {}):
+                results['animation'] = dict(results['animation'], url=self.absolute(results['animation']['url']))
             representation['results'] = results
         return representation
 
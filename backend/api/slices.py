@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.utils.http import parse_etags
+from PIL import Image
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.label_maps import (
+    LABEL_MAP_FILE, load_display_volumes, load_label_map,
+)
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.rendering import (
+    colorize, gray_to_rgb, overlay_labels,
+)
+
+# Slice planes by name, as axes of the stored (H, W, D) arrays
+AXES = {'sagittal': 0, 'coronal': 1, 'axial': 2}
+
+OVERLAY_ALPHA = 0.4
+
+
+class LRUCache:
+    """Thread-safe mapping that keeps the ``max_entries`` most recently used items"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+_volumes = LRUCache(getattr(settings, 'BRAINSEG_SLICE_CACHE_STUDIES', 8))
+_pngs = LRUCache(getattr(settings, 'BRAINSEG_SLICE_CACHE_IMAGES', 1024))
+
+
+def study_dir(results):
+    """Directory under MEDIA_ROOT holding the stored label map of a result, or None"""
+    url = (results or {}).get('label_map')
+    if not url or not url.startswith(settings.MEDIA_URL):
+        return None
+    path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):]))
+    root = os.path.normpath(settings.MEDIA_ROOT)
+    if not path.startswith(root + os.sep) or not os.path.exists(path):
+        return None
+    return os.path.dirname(path)
+
+
+def study_signature(directory):
+    """Changes whenever the stored study is replaced, used in cache keys and ETags"""
+    stat = os.stat(os.path.join(directory, LABEL_MAP_FILE))
+    return f"{directory}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def stored_study(directory, signature):
+    """Decoded label map and display volumes of a study, kept for repeated slice requests"""
+    study = _volumes.get(signature)
+    if study is None:
+        mask, _, spacing = load_label_map(directory)
+        volumes, factor = load_display_volumes(directory)
+        study = {'mask': mask, 'spacing': spacing, 'volumes': volumes, 'factor': factor}
+        _volumes.put(signature, study)
+    return study
+
+
+def etag(signature, *params):
+    return '"' + hashlib.sha1('|'.join([signature, *map(str, params)]).encode('utf-8')).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, tag):
+    """Whether an If-None-Match header lists ``tag`` or ``*``, comparing weak ETags as strong ones"""
+    etags = parse_etags(if_none_match or '')
+    return '*' in etags or tag in [e[2:] if e.startswith('W/') else e for e in etags]
+
+
+def slice_etag(directory, axis_name, index, modality=None, overlay=True):
+    """ETag of one slice, known without rendering it. Raises ValueError for an unknown axis."""
+    if axis_name not in AXES:
+        raise ValueError(f"Unknown axis '{axis_name}', expected one of {', '.join(AXES)}")
+    return etag(study_signature(directory), axis_name, index, modality, overlay)
+
+
+def render_slice(study, axis, index, modality=None, overlay=True):
+    """
+    RGB slice ``index`` along ``axis`` of a stored study: the display copy of
+    ``modality`` upsampled to the label map, with the labels blended over it.
+    Without a modality only the labels are drawn.
+    """
+    labels = np.take(study['mask'], index, axis=axis)
+    if modality is None:
+        return colorize(labels)
+
+    factor = study['factor']
+    volume = study['volumes'][modality]
+    gray = np.take(volume, min(index // factor, volume.shape[axis] - 1), axis=axis)
+    if factor > 1:
+        gray = gray.repeat(factor, axis=0).repeat(factor, axis=1)
+    gray = gray[:labels.shape[0], :labels.shape[1]]
+    rgb = gray_to_rgb(gray)
+    if overlay:
+        overlay_labels(rgb, labels, OVERLAY_ALPHA)
+    return rgb
+
+
+def slice_png(directory, axis_name, index, modality=None, overlay=True):
+    """
+    PNG bytes and ETag of one slice, served from the rendered-image cache
+    when the same slice was asked for before. Raises ValueError for an
+    unknown axis or modality and IndexError for a slice out of range.
+    """
+    tag = slice_etag(directory, axis_name, index, modality, overlay)
+    png = _pngs.get(tag)
+    if png is not None:
+        return png, tag
+
+    study = stored_study(directory, study_signature(directory))
+    axis = AXES[axis_name]
+    if not 0 <= index < study['mask'].shape[axis]:
+        raise IndexError(f"Slice {index} is outside 0-{study['mask'].shape[axis] - 1} along {axis_name}")
+    if modality is not None and modality not in study['volumes']:
+        raise ValueError(f"Unknown modality '{modality}', expected one of {', '.join(study['volumes'])}")
+
+    buffer = io.BytesIO()
+    Image.fromarray(render_slice(study, axis, index, modality, overlay)).save(buffer, format='PNG')
+    png = buffer.getvalue()
+    _pngs.put(tag, png)
+    return png, tag
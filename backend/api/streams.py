@@ -0,0 +1,171 @@
+"""
+Status streams of uploads, served as async views under backend.asgi.
+
+/api/status/<id>/events/ and /api/events/user/<user_id>/ are Server-Sent
+Events streams: the current status first, then every change as the status
+hub dispatches it. /api/status/<id>/wait/ is the long-poll fallback, which
+answers as soon as the status differs from the one the client already has,
+or with the unchanged status after a timeout.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .events import TERMINAL_STATUSES, get_hub, status_event
+from .models import SegmentationJob
+from .progress import read_status
+
+# Uploads of a user announced when their stream opens
+USER_SNAPSHOT_LIMIT = 50
+
+
+def sse(data, event='status'):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def snapshot(upload_id, user_id, current):
+    """Event of the status ``current`` as read_status returns it"""
+    result = current.get('result') or {}
+    return status_event(upload_id, user_id, current['status'], result.get('progress'),
+                        result.get('processing_status') or result.get('status'), current.get('error'))
+
+
+def state(current):
+    return current['status'], (current.get('result') or {}).get('progress')
+
+
+def user_uploads(user_id):
+    """(upload id, status) of the user's jobs that have not finished yet"""
+    jobs = SegmentationJob.objects.filter(upload__user_id=user_id).exclude(status__in=TERMINAL_STATUSES)
+    upload_ids = jobs.order_by('-created_at').values_list('upload_id', flat=True)[:USER_SNAPSHOT_LIMIT]
+    return [(upload_id, read_status(upload_id)) for upload_id in upload_ids]
+
+
+def event_stream(subscription, initial, refresh=None, until_terminal=False):
+    """
+    SSE body: the ``initial`` events, then those of ``subscription`` until
+    the stream times out (clients reconnect on their own). Without a hub
+    shared across processes, ``refresh`` is polled for missed events at each
+    keepalive.
+    """
+    hub = get_hub()
+    queue = subscription[0]
+    keepalive = settings.BRAINSEG_STREAM_KEEPALIVE_SECONDS
+
+    async def stream():
+        try:
+            yield f"retry: {settings.BRAINSEG_STREAM_RETRY_MS}\n\n"
+            for event in initial:
+                yield sse(event)
+            if until_terminal and initial and initial[-1]['status'] in TERMINAL_STATUSES:
+                return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.BRAINSEG_STREAM_MAX_SECONDS
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    events = [await asyncio.wait_for(queue.get(), timeout=min(keepalive, remaining))]
+                except asyncio.TimeoutError:
+                    events = await refresh() if refresh and not hub.shared else []
+                    if not events:
+                        yield ": keepalive\n\n"
+                        continue
+                for event in events:
+                    yield sse(event)
+                if until_terminal and events[-1]['status'] in TERMINAL_STATUSES:
+                    return
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx and similar proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def upload_events(request, upload_id):
+    """SSE stream of one upload's status, closed once it is complete or failed"""
+    subscription = get_hub().subscribe(('upload', upload_id))
+    current = await sync_to_async(read_status)(upload_id)
+    if current is None:
+        get_hub().unsubscribe(subscription)
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+
+    last = [state(current)]
+
+    async def refresh():
+        latest = await sync_to_async(read_status)(upload_id)
+        if latest is None or state(latest) == last[0]:
+            return []
+        last[0] = state(latest)
+        return [snapshot(upload_id, None, latest)]
+
+    return event_stream(subscription, [snapshot(upload_id, None, current)], refresh, until_terminal=True)
+
+
+async def user_events(request, user_id):
+    """SSE stream of the status of every job of a user, including ones queued after it opened"""
+    subscription = get_hub().subscribe(('user', user_id))
+    uploads = await sync_to_async(user_uploads)(user_id)
+    initial = [snapshot(upload_id, user_id, current) for upload_id, current in uploads if current]
+    last = {event['upload_id']: (event['status'], event['progress']) for event in initial}
+
+    def statuses():
+        # Uploads seen running are re-read until their final status has been sent
+        running = dict(user_uploads(user_id))
+        for upload_id, known in last.items():
+            if upload_id not in running and known[0] not in TERMINAL_STATUSES:
+                running[upload_id] = read_status(upload_id)
+        return running.items()
+
+    async def refresh():
+        events = []
+        for upload_id, current in await sync_to_async(statuses)():
+            if current and last.get(upload_id) != state(current):
+                last[upload_id] = state(current)
+                events.append(snapshot(upload_id, user_id, current))
+        return events
+
+    return event_stream(subscription, initial, refresh)
+
+
+async def wait_for_status(request, upload_id):
+    """
+    Long poll: the status of an upload once it differs from ``?status=``
+    and ``?progress=``, or after ``?timeout=`` seconds (at most
+    BRAINSEG_LONG_POLL_SECONDS) as it is.
+    """
+    try:
+        timeout = min(max(float(request.GET.get('timeout', settings.BRAINSEG_LONG_POLL_SECONDS)), 0),
+                      settings.BRAINSEG_LONG_POLL_SECONDS)
+    except ValueError:
+        return JsonResponse({'error': 'timeout must be a number of seconds'}, status=400)
+    known = (request.GET.get('status'), request.GET.get('progress'))
+
+    def changed(current):
+        status, progress = state(current)
+        return (status, None if progress is None else str(progress)) != known
+
+    hub = get_hub()
+    subscription = hub.subscribe(('upload', upload_id))
+    try:
+        current = await sync_to_async(read_status)(upload_id)
+        if current is None:
+            return JsonResponse({'error': 'Upload not found'}, status=404)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not changed(current) and (remaining := deadline - loop.time()) > 0:
+            if not hub.shared:
+                remaining = min(remaining, settings.BRAINSEG_STREAM_KEEPALIVE_SECONDS)
+            try:
+                await asyncio.wait_for(subscription[0].get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                if hub.shared:
+                    break
+            current = await sync_to_async(read_status)(upload_id)
+        return JsonResponse(current)
+    finally:
+        hub.unsubscribe(subscription)
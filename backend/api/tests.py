@@ -1,3 +1,378 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import nibabel as nib
+import numpy as np
+import torch
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.label_maps import LABEL_MAP_FILE
+from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.preprocessing import approximate_quantiles, normalize
+
+from . import progress
+from .jobs import claim_job, fail_job, hand_off_render
+from .models import ResumableUpload, SegmentationJob, UserUpload
+from .result_cache import ResultCache
+from .slices import slice_etag
+from .uploads import OffsetMismatch, create_session, media_path, write_chunk
+from .views import decode_cursor, encode_cursor
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def temporary_media_root(test):
+    """Point MEDIA_ROOT at an empty directory for the duration of ``test``"""
+    media = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media)
+    media_root = override_settings(MEDIA_ROOT=media)
+    media_root.enable()
+    test.addCleanup(media_root.disable)
+    return media
+
+
+def updates(queries):
+    return [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+
+
+@override_settings(CACHES=LOCAL_CACHE, BRAINSEG_PROGRESS_DB_SECONDS=60)
+class ProgressWithoutSharedCacheTests(TestCase):
+    def setUp(self):
+        progress._written.clear()
+        self.upload = UserUpload.objects.create(user_id='u1', email='u1@example.com', status='processing')
+
+    def test_back_to_back_steps_reach_the_row(self):
+        for percent, message in [(20, 'Loading model'), (40, 'Loading data'), (60, 'Processing'),
+                                 (80, 'Running inference')]:
+            progress.report_progress(self.upload.id, 'u1', percent, message)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.results['progress'], 80)
+        self.assertEqual(progress.read_status(self.upload.id)['result']['status'], 'Running inference')
+
+    def test_repeated_step_is_throttled(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                progress.report_progress(self.upload.id, 'u1', 80, 'Running inference')
+        self.assertEqual(len(updates(queries)), 1)
+
+    def test_finished_upload_keeps_its_results(self):
+        UserUpload.objects.filter(id=self.upload.id).update(status='complete', results={'progress': 100})
+        progress.report_progress(self.upload.id, 'u1', 90, 'Creating visualizations')
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.results, {'progress': 100})
+
+
+@override_settings(CACHES=LOCAL_CACHE, BRAINSEG_JOB_LEASE_SECONDS=120, BRAINSEG_JOB_RETRY_BACKOFF_SECONDS=30)
+class JobQueueTests(TestCase):
+    def make_job(self, **fields):
+        upload = UserUpload.objects.create(user_id='u1', email='u1@example.com')
+        fields.setdefault('available_at', timezone.now())
+        return SegmentationJob.objects.create(upload=upload, file_paths=['t1.nii.gz'], max_attempts=3, **fields)
+
+    def test_claim_skips_jobs_not_yet_available(self):
+        self.make_job(available_at=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(claim_job('w1'))
+
+    def test_claim_takes_the_earliest_available_job(self):
+        later = self.make_job(available_at=timezone.now() - timedelta(seconds=1))
+        earlier = self.make_job(available_at=timezone.now() - timedelta(seconds=10))
+        job = claim_job('w1')
+        self.assertEqual(job.id, earlier.id)
+        self.assertEqual((job.status, job.attempts, job.claimed_by), ('processing', 1, 'w1'))
+        self.assertEqual(claim_job('w2').id, later.id)
+        self.assertIsNone(claim_job('w3'))
+
+    def test_expired_lease_is_reclaimed(self):
+        stale = self.make_job(status='processing', attempts=1, claimed_by='dead',
+                              lease_expires_at=timezone.now() - timedelta(seconds=1))
+        job = claim_job('w1')
+        self.assertEqual(job.id, stale.id)
+        self.assertEqual((job.claimed_by, job.attempts), ('w1', 2))
+        self.assertGreater(job.lease_expires_at, timezone.now())
+
+    def test_live_lease_is_not_reclaimed(self):
+        self.make_job(status='processing', attempts=1, claimed_by='alive',
+                      lease_expires_at=timezone.now() + timedelta(seconds=60))
+        self.assertIsNone(claim_job('w1'))
+
+    def test_expired_lease_after_last_attempt_gives_up(self):
+        stale = self.make_job(status='processing', attempts=3, claimed_by='dead',
+                              lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(claim_job('w1'))
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertEqual(UserUpload.objects.get(id=stale.upload_id).status, 'failed')
+
+    def test_failure_after_last_attempt_gives_up(self):
+        self.make_job()
+        job = claim_job('w1')
+        job.attempts = job.max_attempts
+        self.assertFalse(fail_job(job, 'boom'))
+        job.refresh_from_db()
+        upload = UserUpload.objects.get(id=job.upload_id)
+        self.assertEqual((job.status, upload.status, upload.error_message), ('failed', 'failed', 'boom'))
+
+    def test_retry_backoff_doubles(self):
+        created = self.make_job()
+        for attempt, delay in [(1, 30), (2, 60)]:
+            SegmentationJob.objects.filter(id=created.id).update(available_at=timezone.now())
+            job = claim_job('w1')
+            self.assertEqual(job.attempts, attempt)
+            before = timezone.now()
+            self.assertTrue(fail_job(job, 'boom'))
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'uploaded')
+            self.assertIsNone(job.claimed_by)
+            self.assertAlmostEqual((job.available_at - before).total_seconds(), delay, delta=5)
+            self.assertIsNone(claim_job('w2'))
+        self.assertEqual(UserUpload.objects.get(id=created.upload_id).status, 'uploaded')
+
+    def test_hand_off_render_resets_attempts(self):
+        self.make_job()
+        job = claim_job('w1')
+        SegmentationJob.objects.filter(id=job.id).update(attempts=2)
+        self.assertTrue(hand_off_render(job, '/tmp/out'))
+        job.refresh_from_db()
+        self.assertEqual((job.stage, job.status, job.attempts, job.claimed_by, job.output_dir),
+                         ('render', 'uploaded', 0, None, '/tmp/out'))
+        self.assertIsNone(claim_job('w2'))
+        self.assertEqual(claim_job('r1', 'render').id, job.id)
+
+    def test_hand_off_after_losing_the_lease_fails(self):
+        self.make_job()
+        job = claim_job('w1')
+        SegmentationJob.objects.filter(id=job.id).update(claimed_by='w2')
+        self.assertFalse(hand_off_render(job, '/tmp/out'))
+
+
+class UserReportsTests(APITestCase):
+    url = '/api/reports/u1/'
+
+    def make_upload(self, batch_id, created_at, status='complete', results=None):
+        upload = UserUpload.objects.create(user_id='u1', email='u1@example.com', batch_id=batch_id, status=status,
+                                           results={'label_map': 'x'} if results is None else results)
+        UserUpload.objects.filter(id=upload.id).update(created_at=created_at)
+        return UserUpload.objects.get(id=upload.id)
+
+    def fetch_all(self, limit):
+        ids, cursor = [], None
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            ids += [report['id'] for report in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_one_report_per_batch_newest_completed(self):
+        now = timezone.now()
+        self.make_upload('a', now - timedelta(minutes=3))
+        newest = self.make_upload('a', now - timedelta(minutes=2))
+        self.make_upload('a', now - timedelta(minutes=1), status='processing')
+        other = self.make_upload('b', now - timedelta(minutes=5))
+        UserUpload.objects.create(user_id='u2', email='u2@example.com', status='complete', results={})
+        response = self.client.get(self.url)
+        self.assertEqual([report['id'] for report in response.data['results']], [newest.id, other.id])
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_pages_neither_overlap_nor_skip_on_tied_timestamps(self):
+        now = timezone.now()
+        tied = [self.make_upload(f'tied-{i}', now) for i in range(5)]
+        older = [self.make_upload(f'old-{i}', now - timedelta(minutes=i + 1)) for i in range(3)]
+        expected = [upload.id for upload in sorted(tied, key=lambda u: -u.id)] + [upload.id for upload in older]
+        for limit in (1, 2, 3, 8):
+            self.assertEqual(self.fetch_all(limit), expected)
+
+    def test_cursor_round_trips(self):
+        upload = self.make_upload('a', timezone.now())
+        self.assertEqual(decode_cursor(encode_cursor(upload)), (upload.created_at, upload.id))
+
+    def test_bad_cursor_or_limit_is_rejected(self):
+        garbled = base64.urlsafe_b64encode(b'yesterday|7').decode('ascii')
+        for params in ({'cursor': 'not-a-cursor'}, {'cursor': garbled}, {'limit': 'ten'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.data)
+
+
+class ApproximateQuantilesTests(SimpleTestCase):
+    def test_foreground_between_grid_points(self):
+        image = torch.zeros(2, 16, 16, 16)
+        mask = torch.zeros(16, 16, 16, dtype=torch.bool)
+        mask[5, 5, 5:7] = True
+        image[:, mask] = torch.tensor([[1.0, 3.0], [10.0, 30.0]])
+        # 4096 voxels over 64 samples puts the grid on every 4th voxel, missing (5, 5, 5:7)
+        low, high = approximate_quantiles(image, mask, [0.0, 1.0], max_samples=64)
+        self.assertEqual(low.tolist(), [1.0, 10.0])
+        self.assertEqual(high.tolist(), [3.0, 30.0])
+        normalize(image, 'percentile', (0.0, 100.0), mask)
+        self.assertEqual(image[:, mask].tolist(), [[0.0, 1.0], [0.0, 1.0]])
+
+
+def nifti_bytes(value):
+    return nib.Nifti1Image(np.full((4, 4, 4), value, dtype=np.float32), np.eye(4)).to_bytes()
+
+
+@override_settings(CACHES=LOCAL_CACHE, BRAINSEG_EMBEDDED_WORKERS=False)
+class ChunkedUploadTests(APITestCase):
+    def setUp(self):
+        temporary_media_root(self)
+        self.data = {file_type: nifti_bytes(i + 1) for i, file_type in enumerate(['T1', 'T1c', 'T2', 'FLAIR'])}
+        names = {'T1': 'case_t1.nii', 'T1c': 'case_t1ce.nii', 'T2': 'case_t2.nii', 'FLAIR': 'case_flair.nii'}
+        self.uploads = {upload.file_type: upload for upload in create_session('u1', 'u1@example.com', {
+            file_type: {'name': names[file_type], 'size': len(data)} for file_type, data in self.data.items()
+        })}
+        self.session_id = self.uploads['T1'].session_id
+
+    def write(self, file_type, start, end, stream=None):
+        data = self.data[file_type]
+        return write_chunk(self.uploads[file_type], start, stream or io.BytesIO(data[start:end]), end - start)
+
+    def stored(self, file_type):
+        with open(media_path(self.uploads[file_type].storage_name), 'rb') as f:
+            return f.read()
+
+    def test_chunk_past_the_received_bytes_is_refused(self):
+        self.write('T1', 0, 100)
+        with self.assertRaises(OffsetMismatch) as raised:
+            self.write('T1', 200, 300)
+        self.assertEqual(raised.exception.received, 100)
+        self.assertEqual(ResumableUpload.objects.get(id=self.uploads['T1'].id).received, 100)
+
+    def test_overlapping_chunk_extends_the_file(self):
+        size = len(self.data['T1'])
+        self.write('T1', 0, 300)
+        self.assertEqual(self.write('T1', 200, size), size - 200)
+        self.assertEqual((self.uploads['T1'].received, self.uploads['T1'].status), (size, 'received'))
+        self.assertEqual(self.stored('T1'), self.data['T1'])
+
+    def test_retried_chunk_changes_nothing(self):
+        self.write('T1', 0, 300)
+        self.write('T1', 300, 500)
+        self.write('T1', 300, 500)
+        self.assertEqual((self.uploads['T1'].received, self.uploads['T1'].status), (500, 'receiving'))
+        self.assertEqual(self.stored('T1')[:500], self.data['T1'][:500])
+
+    def test_resume_after_a_cut_short_chunk(self):
+        data = self.data['T1']
+        # The client went away 250 bytes into the chunk
+        self.assertEqual(self.write('T1', 0, len(data), io.BytesIO(data[:250])), 250)
+        state = self.client.get(f'/api/uploads/{self.session_id}/').data
+        received = next(f['received'] for f in state['files'] if f['file_type'] == 'T1')
+        self.assertEqual(received, 250)
+        self.write('T1', received, len(data))
+        self.assertEqual(self.uploads['T1'].status, 'received')
+        self.assertEqual(self.stored('T1'), data)
+
+    def test_chunk_past_the_declared_size_is_refused(self):
+        with self.assertRaises(ValueError):
+            write_chunk(self.uploads['T1'], 0, io.BytesIO(self.data['T1'] + b'x'), len(self.data['T1']) + 1)
+
+    def test_double_finalize(self):
+        for file_type, data in self.data.items():
+            response = self.client.put(f'/api/uploads/{self.session_id}/{file_type}/?offset=0', data,
+                                       content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 200, response.data)
+        url = f'/api/uploads/{self.session_id}/finalize/'
+        first = self.client.post(url)
+        self.assertEqual(first.status_code, 202, first.data)
+        again = self.client.post(url)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['status_url'], first.data['status_url'])
+        self.assertEqual(SegmentationJob.objects.count(), 1)
+        self.assertEqual(UserUpload.objects.count(), 4)
+        # The study was finalized and later removed
+        UserUpload.objects.all().delete()
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+
+class SliceRevalidationTests(APITestCase):
+    def setUp(self):
+        media = temporary_media_root(self)
+        self.directory = os.path.join(media, 'results', 'study')
+        os.makedirs(self.directory)
+        open(os.path.join(self.directory, LABEL_MAP_FILE), 'wb').close()
+        UserUpload.objects.create(user_id='u1', email='u1@example.com', batch_id='b1', status='complete',
+                                  results={'label_map': f'{settings.MEDIA_URL}results/study/{LABEL_MAP_FILE}'})
+        self.tag = slice_etag(self.directory, 'axial', 3, 'FLAIR', True)
+        render = mock.patch('api.views.slice_png', return_value=(b'png', self.tag))
+        self.slice_png = render.start()
+        self.addCleanup(render.stop)
+
+    def get(self, if_none_match=None, axis='axial'):
+        headers = {'HTTP_IF_NONE_MATCH': if_none_match} if if_none_match else {}
+        return self.client.get(f'/api/slice/b1/{axis}/3.png', **headers)
+
+    def test_rendered_without_a_validator(self):
+        response = self.get()
+        self.assertEqual((response.status_code, response.content, response['ETag']), (200, b'png', self.tag))
+        self.slice_png.assert_called_once()
+
+    def test_matching_etag_is_answered_before_rendering(self):
+        for header in [self.tag, f'"other", {self.tag}', f' "other",W/{self.tag} ', '*']:
+            response = self.get(header)
+            self.assertEqual(response.status_code, 304, header)
+            self.assertEqual(response['ETag'], self.tag)
+        self.slice_png.assert_not_called()
+
+    def test_other_etags_are_rendered(self):
+        for header in ['"other"', f'{self.tag[:-1]}x"', self.tag[1:-1]]:
+            self.assertEqual(self.get(header).status_code, 200, header)
+        self.assertEqual(self.slice_png.call_count, 3)
+
+    def test_unknown_axis_is_rejected(self):
+        self.assertEqual(self.get('*', axis='oblique').status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ResultCacheEvictionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        # Room for two of the 1000-byte entries below
+        self.cache = ResultCache(self.root, max_bytes=2500)
+
+    def store(self, name, last_used):
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'mask.bin'), 'wb') as f:
+            f.write(b'x' * 998)
+        marker = os.path.join(directory, 'results.json')
+        with open(marker, 'w') as f:
+            f.write('{}')
+        os.utime(marker, (last_used, last_used))
+
+    def test_referenced_entry_survives_eviction(self):
+        referenced, unreferenced, newest = 'a' * 64, 'b' * 64, 'c' * 64
+        self.store(referenced, 1)
+        self.store(unreferenced, 2)
+        self.store(newest, 3)
+        # A per-batch result directory, not a cache entry
+        self.store('0b7e4c1a-1111-2222-3333-444455556666', 0)
+        UserUpload.objects.create(user_id='u1', email='u1@example.com', result_key=referenced)
+        self.cache.evict(keep=newest)
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         ['0b7e4c1a-1111-2222-3333-444455556666', referenced, newest])
+
+    def test_lookup_marks_an_entry_as_recently_used(self):
+        older, newer = 'a' * 64, 'b' * 64
+        self.store(older, 1)
+        self.store(newer, 2)
+        self.assertEqual(self.cache.lookup(older), {})
+        self.assertIsNone(self.cache.lookup('d' * 64))
+        self.store('c' * 64, 3)
+        self.cache.evict()
+        self.assertEqual(sorted(os.listdir(self.root)), [older, 'c' * 64])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
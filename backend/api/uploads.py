@@ -0,0 +1,209 @@
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ResumableUpload, UserUpload
+from .validation import (
+    HEADER_PROBE_BYTES, MODALITIES, HeaderIncomplete, check_header, is_nifti_name, parse_header,
+)
+
+# Bytes copied from the request to disk per read
+COPY_BLOCK = 2**20
+
+
+class OffsetMismatch(Exception):
+    """A chunk does not start at or before the end of the received bytes"""
+
+    def __init__(self, received):
+        super().__init__(f"Expected a chunk at offset {received} or earlier")
+        self.received = received
+
+
+def storage_name_for(filename):
+    """Name under MEDIA_ROOT for an uploaded volume, keeping its .nii/.nii.gz suffix"""
+    suffix = '.nii.gz' if filename.lower().endswith('.gz') else '.nii'
+    return os.path.join('uploads', f"{uuid.uuid4()}{suffix}")
+
+
+def media_path(storage_name):
+    return os.path.join(settings.MEDIA_ROOT, storage_name)
+
+
+def create_session(user_id, email, files):
+    """
+    Start a chunked upload of one study. ``files`` maps each modality to a
+    dict with the original ``name`` and ``size`` in bytes.
+    """
+    if sorted(files) != sorted(MODALITIES):
+        raise ValueError(f"Expected files for {', '.join(MODALITIES)}, got {', '.join(sorted(files))}")
+
+    max_bytes = settings.BRAINSEG_UPLOAD_MAX_FILE_MB * 2**20
+    for file_type, info in files.items():
+        if not is_nifti_name(info.get('name', '')):
+            raise ValueError(f"{file_type} must be a NIfTI file (.nii or .nii.gz)")
+        size = info.get('size')
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError(f"{file_type} needs a positive integer size")
+        if size > max_bytes:
+            raise ValueError(f"{file_type} is larger than {settings.BRAINSEG_UPLOAD_MAX_FILE_MB} MB")
+
+    session_id = uuid.uuid4()
+    batch_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, 'uploads'), exist_ok=True)
+    uploads = []
+    with transaction.atomic():
+        for file_type in MODALITIES:
+            info = files[file_type]
+            upload = ResumableUpload.objects.create(
+                session_id=session_id,
+                batch_id=batch_id,
+                user_id=user_id,
+                email=email,
+                file_type=file_type,
+                filename=info['name'],
+                storage_name=storage_name_for(info['name']),
+                size=info['size'],
+            )
+            # Chunks are written in place into this file
+            open(media_path(upload.storage_name), 'wb').close()
+            uploads.append(upload)
+    return uploads
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Copy ``length`` bytes from ``stream`` into the upload's file at
+    ``offset``. Chunks may overlap bytes already received, so a client can
+    safely resend a chunk whose response it never saw. Returns the bytes
+    written, which is less than ``length`` if the client went away.
+    """
+    if upload.status not in ('receiving', 'received'):
+        raise ValueError(f"Upload of {upload.file_type} is {upload.status}")
+    if offset > upload.received:
+        raise OffsetMismatch(upload.received)
+    if offset + length > upload.size:
+        raise ValueError(f"Chunk ends at byte {offset + length}, past the declared size {upload.size}")
+
+    written = 0
+    with open(media_path(upload.storage_name), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(COPY_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+
+    end = offset + written
+    ResumableUpload.objects.filter(id=upload.id).update(
+        received=Greatest(F('received'), end), updated_at=timezone.now()
+    )
+    upload.refresh_from_db()
+    if upload.received == upload.size and upload.status == 'receiving':
+        upload.status = 'received'
+        upload.save(update_fields=['status', 'updated_at'])
+    return written
+
+
+def check_upload_header(upload):
+    """
+    Validate the NIfTI header once enough of the file has arrived. Rejects
+    the upload and removes its file when the header is invalid; returns the
+    error message then, otherwise None.
+    """
+    if upload.header_checked or upload.received == 0:
+        return None
+    with open(media_path(upload.storage_name), 'rb') as f:
+        data = f.read(min(upload.received, HEADER_PROBE_BYTES))
+    try:
+        header = parse_header(data, compressed=upload.storage_name.endswith('.gz'))
+        errors = check_header(header)
+    except HeaderIncomplete:
+        if upload.received < upload.size:
+            return None
+        errors = ['file ends before the end of its header']
+    except ValueError as e:
+        errors = [str(e)]
+
+    if not errors:
+        upload.header_checked = True
+        upload.save(update_fields=['header_checked', 'updated_at'])
+        return None
+    reject(upload, f"{upload.file_type}: {'; '.join(errors)}")
+    return upload.error_message
+
+
+def reject(upload, message):
+    upload.status = 'rejected'
+    upload.error_message = message
+    upload.save(update_fields=['status', 'error_message', 'updated_at'])
+    try:
+        os.unlink(media_path(upload.storage_name))
+    except FileNotFoundError:
+        pass
+
+
+def finalize_session(uploads):
+    """
+    Turn a completely received session into UserUpload rows that point at
+    the files where the chunks were written, without copying them.
+    """
+    by_type = {upload.file_type: upload for upload in uploads}
+    missing = [t for t in MODALITIES if t not in by_type or by_type[t].status != 'received']
+    if missing:
+        details = [f"{t} ({by_type[t].status}, {by_type[t].received}/{by_type[t].size} bytes)"
+                   for t in missing if t in by_type]
+        raise ValueError(f"Not all files are received: {', '.join(details or missing)}")
+    unchecked = [t for t in MODALITIES if not by_type[t].header_checked]
+    if unchecked:
+        raise ValueError(f"Headers not validated for {', '.join(unchecked)}")
+
+    with transaction.atomic():
+        user_uploads = []
+        for file_type in MODALITIES:
+            upload = by_type[file_type]
+            user_uploads.append(UserUpload.objects.create(
+                batch_id=upload.batch_id,
+                user_id=upload.user_id,
+                email=upload.email,
+                nifti_file=upload.storage_name,
+                file_type=file_type,
+            ))
+        ResumableUpload.objects.filter(id__in=[u.id for u in uploads]).update(status='finalized')
+    return user_uploads
+
+
+def expire_sessions():
+    """Remove files of sessions that were never finalized and have been idle too long"""
+    cutoff = timezone.now() - timedelta(hours=settings.BRAINSEG_UPLOAD_SESSION_HOURS)
+    stale = ResumableUpload.objects.filter(updated_at__lt=cutoff).exclude(status='finalized')
+    for upload in stale:
+        try:
+            os.unlink(media_path(upload.storage_name))
+        except FileNotFoundError:
+            pass
+    count = stale.delete()[0]
+    if count:
+        print(f"Expired {count} unfinished chunked uploads")
+
+
+def session_state(uploads):
+    return {
+        'session_id': str(uploads[0].session_id),
+        'batch_id': uploads[0].batch_id,
+        'files': [{
+            'file_type': upload.file_type,
+            'name': upload.filename,
+            'size': upload.size,
+            'received': upload.received,
+            'status': upload.status,
+            'error': upload.error_message,
+            'chunk_url': f"/api/uploads/{upload.session_id}/{upload.file_type}/",
+        } for upload in sorted(uploads, key=lambda u: MODALITIES.index(u.file_type))],
+    }
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import streams, views
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -7,6 +7,14 @@ urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='get_token'),
     path('token/refresh/', TokenRefreshView.as_view(), name='refresh'),
     path('upload/', views.upload_file, name='upload_file'),
+    path('uploads/', views.start_chunked_upload, name='start_chunked_upload'),
+    path('uploads/<uuid:session_id>/', views.chunked_upload_status, name='chunked_upload_status'),
+    path('uploads/<uuid:session_id>/finalize/', views.finalize_chunked_upload, name='finalize_chunked_upload'),
+    path('uploads/<uuid:session_id>/<str:file_type>/', views.upload_chunk, name='upload_chunk'),
     path('status/<int:upload_id>/', views.processing_status, name='processing_status'),
+    path('status/<int:upload_id>/events/', streams.upload_events, name='upload_events'),
+    path('status/<int:upload_id>/wait/', streams.wait_for_status, name='wait_for_status'),
+    path('events/user/<str:user_id>/', streams.user_events, name='user_events'),
+    path('slice/<str:batch_id>/<str:axis>/<int:index>.png', views.get_slice, name='get_slice'),
     path('reports/<str:user_id>/', views.get_user_reports, name='get_user_reports'),
 ] 
\ No newline at end of file
@@ -0,0 +1,161 @@
+import io
+import zlib
+
+import nibabel as nib
+import numpy as np
+
+NIFTI_EXTENSIONS = ('.nii', '.nii.gz')
+
+MODALITIES = ['T1', 'T1c', 'T2', 'FLAIR']
+# Optional label file uploaded with a study to score the segmentation against
+GROUND_TRUTH = 'ground_truth'
+
+# Filename endings (before .nii/.nii.gz) that name a modality, as in BraTS
+MODALITY_SUFFIXES = {
+    'T1': ('_t1', '-t1n', '_t1n'),
+    'T1c': ('_t1ce', '_t1c', '-t1c', '_t1gd'),
+    'T2': ('_t2', '-t2w', '_t2w'),
+    'FLAIR': ('_flair', '-t2f', '_t2f'),
+    GROUND_TRUTH: ('_seg', '-seg'),
+}
+
+# Enough of a file to hold the header, even gzipped
+HEADER_PROBE_BYTES = 64 * 1024
+
+# Co-registered volumes may differ by rounding in their headers only
+SPACING_RTOL = 1e-3
+AFFINE_ATOL_MM = 1e-2
+
+NIFTI1_HEADER_BYTES = 348
+NIFTI2_HEADER_BYTES = 540
+
+# Voxel types the loader converts to float32
+SUPPORTED_DTYPES = (
+    np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32,
+    np.int64, np.uint64, np.float32, np.float64,
+)
+
+
+class HeaderIncomplete(Exception):
+    """Not enough bytes have arrived yet to read the header"""
+
+
+def is_nifti_name(name):
+    return name.lower().endswith(NIFTI_EXTENSIONS)
+
+
+def parse_header(data, compressed):
+    """NIfTI-1 or NIfTI-2 header from the first bytes of a (gzipped) file"""
+    if compressed:
+        try:
+            data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, NIFTI2_HEADER_BYTES)
+        except zlib.error as e:
+            raise ValueError(f"Not a gzip file: {str(e)}")
+    if len(data) < NIFTI1_HEADER_BYTES:
+        raise HeaderIncomplete()
+
+    for byteorder in ('little', 'big'):
+        sizeof_hdr = int.from_bytes(data[:4], byteorder)
+        if sizeof_hdr == NIFTI1_HEADER_BYTES:
+            header_class = nib.Nifti1Header
+            break
+        if sizeof_hdr == NIFTI2_HEADER_BYTES:
+            if len(data) < NIFTI2_HEADER_BYTES:
+                raise HeaderIncomplete()
+            header_class = nib.Nifti2Header
+            break
+    else:
+        raise ValueError('Not a NIfTI file (bad sizeof_hdr)')
+
+    try:
+        return header_class.from_fileobj(io.BytesIO(data), check=True)
+    except Exception as e:
+        raise ValueError(f"Invalid NIfTI header: {str(e)}")
+
+
+def check_header(header):
+    """Problems with a single volume's header, as a list of messages"""
+    errors = []
+    shape = header.get_data_shape()
+    if len(shape) < 3 or any(s != 1 for s in shape[3:]):
+        errors.append(f"expected a 3D volume, got shape {shape}")
+    elif min(shape[:3]) < 1:
+        errors.append(f"empty volume of shape {shape}")
+
+    dtype = header.get_data_dtype()
+    if dtype.type not in SUPPORTED_DTYPES:
+        errors.append(f"unsupported voxel type {dtype}")
+
+    zooms = header.get_zooms()[:3]
+    if len(zooms) == 3 and not all(np.isfinite(z) and z > 0 for z in zooms):
+        errors.append(f"invalid voxel spacing {tuple(float(z) for z in zooms)}")
+    return errors
+
+
+def read_header(fileobj, name):
+    """Header of an open (uploaded) NIfTI file, leaving it at position 0"""
+    fileobj.seek(0)
+    data = fileobj.read(HEADER_PROBE_BYTES)
+    fileobj.seek(0)
+    return parse_header(data, compressed=name.lower().endswith('.gz'))
+
+
+def guess_modality(name):
+    """Modality a filename says it holds, or None"""
+    stem = name.lower()
+    for extension in NIFTI_EXTENSIONS[::-1]:
+        if stem.endswith(extension):
+            stem = stem[:-len(extension)]
+            break
+    for modality, suffixes in MODALITY_SUFFIXES.items():
+        if stem.endswith(suffixes):
+            return modality
+    return None
+
+
+def validate_study(headers, names=None, digests=None):
+    """
+    Problems with a study from its volume headers alone, as a list of
+    messages. ``headers`` maps each modality, and optionally GROUND_TRUTH,
+    to its header; ``names`` and ``digests`` of the files, when given,
+    catch swapped or repeated volumes.
+    """
+    missing = [m for m in MODALITIES if m not in headers]
+    if missing:
+        return [f"missing {', '.join(missing)}"]
+
+    volumes = MODALITIES + [GROUND_TRUTH] if GROUND_TRUTH in headers else MODALITIES
+    errors = []
+    for modality in volumes:
+        errors.extend(f"{modality}: {e}" for e in check_header(headers[modality]))
+    if errors:
+        return errors
+
+    reference = headers['T1']
+    shape = reference.get_data_shape()[:3]
+    zooms = np.array(reference.get_zooms()[:3], dtype=np.float64)
+    affine = reference.get_best_affine()
+    for modality in volumes[1:]:
+        header = headers[modality]
+        if header.get_data_shape()[:3] != shape:
+            errors.append(f"{modality}: shape {header.get_data_shape()[:3]} does not match T1 {shape}")
+            continue
+        other_zooms = np.array(header.get_zooms()[:3], dtype=np.float64)
+        if not np.allclose(other_zooms, zooms, rtol=SPACING_RTOL):
+            errors.append(f"{modality}: voxel spacing {tuple(other_zooms.round(4))} "
+                          f"does not match T1 {tuple(zooms.round(4))}")
+        elif not np.allclose(header.get_best_affine(), affine, atol=AFFINE_ATOL_MM):
+            errors.append(f"{modality}: orientation/position (affine) does not match T1, "
+                          f"the volumes are not co-registered")
+
+    for modality, name in (names or {}).items():
+        named = guess_modality(name)
+        if named and named != modality:
+            errors.append(f"{modality}: file '{name}' looks like {named}")
+
+    seen = {}
+    for modality, digest in (digests or {}).items():
+        if digest in seen:
+            errors.append(f"{modality}: same file as {seen[digest]}")
+        seen.setdefault(digest, modality)
+    return errors
@@ -6,75 +6,114 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
-from .models import UserUpload, ProcessedResult
+from .models import UserUpload, ProcessedResult, ResumableUpload
 from .serializers import UserUploadSerializer, ProcessedResultSerializer
 import os
 from django.conf import settings
-from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import process_brain_scans
+from .workers import ensure_embedded_workers
+from .jobs import enqueue_job
+from .result_cache import HashingUploadHandler, cache_key, get_result_cache, model_version, sha256_file
+from .uploads import (
+    OffsetMismatch, check_upload_header, create_session, expire_sessions, finalize_session, media_path,
+    reject, session_state, write_chunk,
+)
+from .validation import GROUND_TRUTH, HeaderIncomplete, read_header, validate_study
+from .slices import etag_matches, slice_etag, slice_png, study_dir
+from .progress import read_status, status_changed
+from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from firebase_admin import auth
 from django.core.cache import cache
+import base64
 import uuid
-import threading
 import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from django.db import models
 
 
 
+REPORTS_PAGE_SIZE = 20
+REPORTS_MAX_PAGE_SIZE = 100
+
+
 class CreateUserView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
 
 
-model = None
-
-def load_model():
-    global model
-    if model is None:
-        model = load_your_model()  
-    return model
-
-processing_queue = []
-processing_lock = threading.Lock()
-
-def background_processor():
-    while True:
-        with processing_lock:
-            if processing_queue:
-                task = processing_queue.pop(0)
-                try:
-           
-                    output_dir = os.path.join(settings.MEDIA_ROOT, 'results', str(task['upload'].batch_id))
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-             
-                    upload = task['upload']
-                    upload.status = 'processing'
-                    upload.save()
-               
-                    results = process_brain_scans(task['file_paths'], output_dir)
-        
-                    upload.results = results
-                    upload.status = 'complete'
-                    upload.save()
-                except Exception as e:
-                    print(f"Processing error: {str(e)}")
-                    upload.status = 'failed'
-                    upload.error_message = str(e)
-                    upload.save()
-        time.sleep(0.1)  
-
-processor_thread = threading.Thread(target=background_processor, daemon=True)
-processor_thread.start()
+def invalid_study(errors):
+    return Response(
+        {'error': f'Invalid study: {"; ".join(errors)}', 'details': errors},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def uploaded_headers(files, file_types):
+    """Headers of the uploaded volumes by modality, and errors for unreadable ones"""
+    headers, errors = {}, []
+    for file, file_type in zip(files, file_types):
+        try:
+            headers[file_type] = read_header(file, file.name)
+        except HeaderIncomplete:
+            errors.append(f"{file_type}: file ends before the end of its header")
+        except ValueError as e:
+            errors.append(f"{file_type}: {str(e)}")
+    return headers, errors
+
+
+def submit_study(uploads, file_paths, digests):
+    """Answer a stored study from the result cache, or queue it for the workers"""
+    batch_id = uploads[0].batch_id
+    key = None
+    try:
+        key = cache_key(digests, model_version())
+    except Exception as e:
+        print(f"Result cache unavailable for this upload: {str(e)}")
+
+    cached = get_result_cache().lookup(key) if key else None
+    if cached is not None:
+        print(f"Answered batch {batch_id} from the result cache ({get_result_cache().stats()})")
+        uploads[0].results = dict(cached, cached=True, timestamp=time.time())
+        uploads[0].status = 'complete'
+        uploads[0].result_key = key
+        uploads[0].save(update_fields=['status', 'results', 'result_key'])
+        status_changed(uploads[0].id, uploads[0].user_id, uploads[0].status)
+        return Response({
+            'message': 'Result served from cache',
+            'status_url': f'/api/status/{uploads[0].id}/'
+        }, status=status.HTTP_200_OK)
+
+    # Workers on any node pick the job up from the database queue
+    with transaction.atomic():
+        enqueue_job(uploads[0], file_paths, cache_key=key)
+        status_changed(uploads[0].id, uploads[0].user_id, uploads[0].status)
+    ensure_embedded_workers()
+
+    return Response({
+        'message': 'Processing started',
+        'status_url': f'/api/status/{uploads[0].id}/'
+    }, status=status.HTTP_202_ACCEPTED)
+
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def upload_file(request):
     try:
         batch_id = uuid.uuid4()
+
+        # Hash the volumes as they stream in, before anything reads request.FILES
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
         
         files = request.FILES.getlist('nifti_files')
+        # Optional label file, to score the segmentation against
+        ground_truth = request.FILES.get(GROUND_TRUTH)
         user_id = request.data.get('user_id')
         email = request.data.get('email')
 
@@ -100,11 +139,33 @@ def upload_file(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        file_types = ['T1', 'T1c', 'T2', 'FLAIR']
+        digests = [digest for field, digest in hasher.digests if field == 'nifti_files']
+        volumes, volume_types, volume_digests = list(files), list(file_types), list(digests)
+        if ground_truth:
+            volumes.append(ground_truth)
+            volume_types.append(GROUND_TRUTH)
+            # Scores are part of the result, so the label file is part of its cache key
+            volume_digests += [digest for field, digest in hasher.digests if field == GROUND_TRUTH]
+
+        # Reject mismatched studies from their headers, before saving or queueing anything
+        started = time.perf_counter()
+        headers, errors = uploaded_headers(volumes, volume_types)
+        if not errors:
+            errors = validate_study(
+                headers,
+                names={t: f.name for f, t in zip(volumes, volume_types)},
+                digests=dict(zip(volume_types, volume_digests)),
+            )
+        print(f"Validated study headers in {(time.perf_counter() - started) * 1000:.1f} ms")
+        if errors:
+            print(f"Rejected study: {errors}")
+            return invalid_study(errors)
+
         results_dir = os.path.join(settings.MEDIA_ROOT, 'results')
         os.makedirs(results_dir, exist_ok=True)
 
         file_paths = []
-        file_types = ['T1', 'T1c', 'T2', 'FLAIR']
         uploads = []
         
         try:
@@ -120,22 +181,16 @@ def upload_file(request):
                 uploads.append(upload)
                 file_paths.append(upload.nifti_file.path)
                 print(f"Saved {file_type} file to: {upload.nifti_file.path}")
+            if ground_truth:
+                name = default_storage.save(f'ground_truth/{batch_id}/{ground_truth.name}', ground_truth)
+                file_paths.append(default_storage.path(name))
+                print(f"Saved ground truth to: {file_paths[-1]}")
         except Exception as e:
             for upload in uploads:
                 upload.delete()
             raise Exception(f"Error saving files: {str(e)}")
 
-        with processing_lock:
-            processing_queue.append({
-                'file_paths': file_paths,
-                'upload': uploads[0],  
-                'output_dir': results_dir
-            })
-        
-        return Response({
-            'message': 'Processing started',
-            'status_url': f'/api/status/{uploads[0].id}/'
-        }, status=status.HTTP_202_ACCEPTED)
+        return submit_study(uploads, file_paths, volume_digests)
 
     except Exception as e:
         print("\n=== Error in upload_file ===")
@@ -148,18 +203,174 @@ def upload_file(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def start_chunked_upload(request):
+    """
+    Start a resumable upload of a study. Expects ``user_id``, ``email`` and
+    ``files``, which maps T1, T1c, T2 and FLAIR to their ``name`` and ``size``.
+    """
+    user_id = request.data.get('user_id')
+    email = request.data.get('email')
+    files = request.data.get('files')
+    if not all([user_id, email, files]) or not isinstance(files, dict):
+        return Response({'error': 'user_id, email and files are required'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    expire_sessions()
+    try:
+        uploads = create_session(user_id, email, files)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(session_state(uploads), status=status.HTTP_201_CREATED)
+
+
 @api_view(['GET'])
-def processing_status(request, upload_id):
+@permission_classes([AllowAny])
+def chunked_upload_status(request, session_id):
+    """Bytes received per file, a client resumes each file from its ``received`` offset"""
+    uploads = list(ResumableUpload.objects.filter(session_id=session_id))
+    if not uploads:
+        return Response({'error': 'Upload session not found'}, status=404)
+    return Response(session_state(uploads))
+
+
+@api_view(['PUT'])
+@permission_classes([AllowAny])
+def upload_chunk(request, session_id, file_type):
+    """Write the raw request body into ``file_type`` at ``?offset=``"""
     try:
-        upload = UserUpload.objects.get(id=upload_id)
-        return Response({
-            'status': upload.status,
-            'result': upload.results,
-            'error': upload.error_message if hasattr(upload, 'error_message') else None
-        })
-    except UserUpload.DoesNotExist:
+        upload = ResumableUpload.objects.get(session_id=session_id, file_type=file_type)
+    except ResumableUpload.DoesNotExist:
         return Response({'error': 'Upload not found'}, status=404)
 
+    try:
+        offset = int(request.query_params.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return Response({'error': 'An integer ?offset= and a Content-Length are required'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if length <= 0 or offset < 0:
+        return Response({'error': 'An integer ?offset= and a Content-Length are required'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if length > settings.BRAINSEG_UPLOAD_MAX_CHUNK_MB * 2**20:
+        return Response({'error': f'Chunks are limited to {settings.BRAINSEG_UPLOAD_MAX_CHUNK_MB} MB'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    try:
+        written = write_chunk(upload, offset, request.stream, length)
+    except OffsetMismatch as e:
+        return Response({'error': str(e), 'received': e.received}, status=status.HTTP_409_CONFLICT)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    error = check_upload_header(upload)
+    if error:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    if written < length:
+        return Response({'error': 'Chunk was cut short, resume from received', 'received': upload.received},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response({'received': upload.received, 'size': upload.size, 'status': upload.status})
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def finalize_chunked_upload(request, session_id):
+    """Queue a fully received study, answering repeats from the result cache"""
+    with transaction.atomic():
+        uploads = list(ResumableUpload.objects.select_for_update().filter(session_id=session_id))
+        if not uploads:
+            return Response({'error': 'Upload session not found'}, status=404)
+        if all(upload.status == 'finalized' for upload in uploads):
+            # A retried finalize whose response was lost
+            first = UserUpload.objects.filter(batch_id=uploads[0].batch_id, file_type='T1').first()
+            if first is None:
+                # The study was finalized, then its uploads were removed
+                return Response({'error': 'Upload not found'}, status=404)
+            return Response({
+                'message': 'Already finalized',
+                'status_url': f'/api/status/{first.id}/'
+            }, status=status.HTTP_200_OK)
+        errors = validate_session(uploads)
+        if errors:
+            return invalid_study(errors)
+        try:
+            user_uploads = finalize_session(uploads)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_paths = [upload.nifti_file.path for upload in user_uploads]
+    with ThreadPoolExecutor(max_workers=len(file_paths)) as pool:
+        digests = list(pool.map(sha256_file, file_paths))
+    return submit_study(user_uploads, file_paths, digests)
+
+
+def validate_session(uploads):
+    """
+    Cross-check the headers of a fully received session. A study whose
+    volumes do not match cannot be fixed by resuming, so it is rejected.
+    """
+    if any(upload.status != 'received' for upload in uploads):
+        # finalize_session reports what is still missing
+        return []
+    headers, errors = {}, []
+    for upload in uploads:
+        with open(media_path(upload.storage_name), 'rb') as f:
+            try:
+                headers[upload.file_type] = read_header(f, upload.storage_name)
+            except (HeaderIncomplete, ValueError) as e:
+                errors.append(f"{upload.file_type}: {str(e) or 'incomplete header'}")
+    if not errors:
+        errors = validate_study(headers, names={u.file_type: u.filename for u in uploads})
+    if errors:
+        for upload in uploads:
+            reject(upload, '; '.join(errors))
+    return errors
+
+@api_view(['GET'])
+def processing_status(request, upload_id):
+    # Running jobs report progress to the cache, the row only changes with the status
+    current = read_status(upload_id)
+    if current is None:
+        return Response({'error': 'Upload not found'}, status=404)
+    return Response(current)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_slice(request, batch_id, axis, index):
+    """
+    One slice of a segmented study as PNG, drawn from its stored label map.
+    ``?modality=`` picks the background (FLAIR by default, ``none`` for the
+    labels alone) and ``?overlay=0`` leaves the labels out.
+    """
+    # Slices are available as soon as the mask is, before the previews are rendered
+    upload = UserUpload.objects.filter(
+        batch_id=batch_id, status__in=['mask_ready', 'complete'], results__isnull=False
+    ).order_by('id').first()
+    directory = study_dir(upload.results) if upload else None
+    if directory is None:
+        return Response({'error': 'No stored segmentation for this study'}, status=404)
+
+    modality = request.query_params.get('modality', 'FLAIR')
+    modality = None if modality == 'none' else modality
+    overlay = request.query_params.get('overlay', '1') not in ('0', 'false')
+    try:
+        # A revalidation is answered before anything is rendered
+        tag = slice_etag(directory, axis, index, modality, overlay)
+        if etag_matches(request.headers.get('If-None-Match'), tag):
+            response = HttpResponse(status=304)
+        else:
+            png, tag = slice_png(directory, axis, index, modality, overlay)
+            response = HttpResponse(png, content_type='image/png')
+    except IndexError as e:
+        return Response({'error': str(e)}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # A stored study never changes, a reprocessed one gets a new ETag
+    response['ETag'] = tag
+    response['Cache-Control'] = f'private, max-age={settings.BRAINSEG_SLICE_MAX_AGE}'
+    return response
+
 @api_view(['GET'])
 def get_results(request, user_id):
     try:
@@ -172,43 +383,59 @@ def get_results(request, user_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def encode_cursor(upload):
+    """Opaque position just after ``upload`` in the newest-first list of reports"""
+    position = f"{upload.created_at.isoformat()}|{upload.id}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, upload_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(upload_id)
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def latest_reports(user_id):
+    """Ids of the newest completed row of each of a user's batches, as a subquery"""
+    completed = UserUpload.objects.filter(user_id=user_id, status='complete', results__isnull=False)
+    if connection.vendor == 'postgresql':
+        # Walks user_report_idx backwards, one row per batch
+        return completed.order_by('-batch_id', '-created_at').distinct('batch_id').values('id')
+    newest_first = Window(RowNumber(), partition_by=F('batch_id'), order_by=[F('created_at').desc(), F('id').desc()])
+    return completed.annotate(rank=newest_first).filter(rank=1).values('id')
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_user_reports(request, user_id):
+    """
+    A page of the user's reports, newest first, one per batch. ``?limit=``
+    sets the page size and ``?cursor=`` is the ``next_cursor`` of the
+    previous page. Each page is a single query.
+    """
     try:
-        print(f"\n=== Fetching Reports ===")
-        print(f"User ID: {user_id}")
-        
-        unique_batches = UserUpload.objects.filter(
-            user_id=user_id,
-            results__isnull=False,
-            status='complete'
-        ).values('batch_id').annotate(
-            latest_created=models.Max('created_at')
-        ).order_by('-latest_created')
-        
-        reports = []
-        seen_batches = set()  
-        
-        for batch in unique_batches:
-            batch_id = batch['batch_id']
-            if batch_id not in seen_batches:
-                report = UserUpload.objects.filter(
-                    batch_id=batch_id,
-                    user_id=user_id,
-                    results__isnull=False,
-                    status='complete'
-                ).order_by('-created_at').first()
-                
-                if report and report.results:
-                    reports.append(report)
-                    seen_batches.add(batch_id)
-        
-        print(f"Found {len(reports)} unique reports")
-        
-        serializer = UserUploadSerializer(reports, many=True)
-        return Response(serializer.data)
-        
+        limit = min(max(int(request.query_params.get('limit', REPORTS_PAGE_SIZE)), 1), REPORTS_MAX_PAGE_SIZE)
+        reports = UserUpload.objects.filter(id__in=latest_reports(user_id))
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            created_at, upload_id = decode_cursor(cursor)
+            reports = reports.filter(
+                models.Q(created_at__lt=created_at) | models.Q(created_at=created_at, id__lt=upload_id)
+            )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # One row past the page says whether there is another one
+        page = list(reports.order_by('-created_at', '-id')[:limit + 1])
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return Response({
+            'results': UserUploadSerializer(page[:limit], many=True).data,
+            'next_cursor': next_cursor,
+        })
+
     except Exception as e:
         print(f"Error fetching reports: {str(e)}")
         import traceback
@@ -0,0 +1,363 @@
+import atexit
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+from django.conf import settings
+
+RESTART_BACKOFF = (1, 2, 5, 10, 30)
+
+
+def run_job(job):
+    """
+    Run the segment stage of a claimed job. With a render pool the mask is
+    published as 'mask_ready' and the job handed to the render workers,
+    otherwise the previews are rendered here and the job finalized.
+    """
+    from django.db import close_old_connections
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.process_files import (
+        process_brain_scans, segment_study,
+    )
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.render import study_results
+    from .jobs import Heartbeat, fail_job, hand_off_render
+    from .models import UserUpload
+    from .progress import report_progress, status_changed
+    from .result_cache import get_result_cache
+
+    close_old_connections()
+    scratch = None
+    try:
+        with Heartbeat(job) as lease:
+            upload = UserUpload.objects.get(id=job.upload_id)
+            upload.status = 'processing'
+            upload.save(update_fields=['status'])
+            status_changed(upload.id, upload.user_id, upload.status)
+
+            if job.cache_key:
+                # An identical study submitted earlier may have finished while this one
+                # queued, the upload already counted the miss
+                cached = get_result_cache().lookup(job.cache_key, record=False)
+                if cached is not None:
+                    print(f"Job {job.id} answered from the result cache")
+                    finalize_job(job, upload, None, dict(cached, cached=True, timestamp=time.time()))
+                    return
+                output_dir = scratch = get_result_cache().scratch_dir(job.cache_key)
+            else:
+                output_dir = os.path.join(settings.MEDIA_ROOT, 'results', str(upload.batch_id))
+                os.makedirs(output_dir, exist_ok=True)
+
+            if not settings.BRAINSEG_RENDER_WORKERS:
+                results = process_brain_scans(job.file_paths, output_dir, batch_id=upload.batch_id,
+                                              result_url=final_url(job, upload))
+                if lease.lost:
+                    print(f"Job {job.id} finished after its lease expired, result kept")
+                finalize_job(job, upload, output_dir, results)
+                return
+
+            def progress(percent, message):
+                report_progress(upload.id, upload.user_id, percent, message)
+
+            summary, _, _ = segment_study(job.file_paths, output_dir, progress=progress)
+            upload.results = study_results(summary, media_url(output_dir))
+            upload.status = 'mask_ready'
+            upload.save(update_fields=['status', 'results'])
+            status_changed(upload.id, upload.user_id, upload.status)
+            if hand_off_render(job, output_dir):
+                print(f"Job {job.id} mask ready, queued for rendering")
+                # The render stage owns the directory from here
+                scratch = None
+            else:
+                print(f"Lost lease on job {job.id} before handing it to the render workers")
+    except Exception as e:
+        print(f"Processing error: {str(e)}")
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+        if fail_job(job, str(e)):
+            print(f"Job {job.id} will be retried")
+    finally:
+        close_old_connections()
+
+
+def run_render(job):
+    """Run the render stage of a claimed job: previews from the stored label map, then finalize"""
+    from django.db import close_old_connections
+    from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.render import render_study, study_results
+    from .jobs import Heartbeat, fail_job
+    from .models import UserUpload
+
+    close_old_connections()
+    try:
+        with Heartbeat(job):
+            upload = UserUpload.objects.get(id=job.upload_id)
+            summary = {
+                key: value for key, value in (upload.results or {}).items()
+                if key in ('volume_shape', 'spacing', 'metrics', 'crop', 'timings')
+            }
+            rendered, render_seconds = render_study(job.file_paths, job.output_dir)
+            summary.setdefault('timings', {})['render'] = render_seconds
+            finalize_job(job, upload, job.output_dir, study_results(summary, final_url(job, upload), rendered))
+    except Exception as e:
+        print(f"Render error: {str(e)}")
+        if fail_job(job, str(e)):
+            print(f"Render of job {job.id} will be retried")
+    finally:
+        close_old_connections()
+
+
+def finalize_job(job, upload, output_dir, results):
+    """Publish a cached result, record the results on the upload and close the job"""
+    from .jobs import complete_job
+    from .progress import status_changed
+    from .result_cache import get_result_cache
+
+    started = time.perf_counter()
+    if job.cache_key and output_dir:
+        get_result_cache().publish(job.cache_key, output_dir, results)
+    if 'timings' in results:
+        results['timings']['finalize'] = time.perf_counter() - started
+    upload.results = results
+    upload.status = 'complete'
+    upload.result_key = job.cache_key
+    upload.save(update_fields=['status', 'results', 'result_key'])
+    complete_job(job)
+    status_changed(upload.id, upload.user_id, upload.status)
+
+
+def final_url(job, upload):
+    """Where the results of ``job`` are served from once finalized"""
+    from .result_cache import result_url
+    if job.cache_key:
+        return result_url(job.cache_key)
+    return f"{settings.MEDIA_URL}results/{upload.batch_id}"
+
+
+def media_url(path):
+    return settings.MEDIA_URL + os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+
+STAGE_RUNNERS = {'segment': run_job, 'render': run_render}
+
+
+def worker_main(index, stop, torch_threads, cpus, concurrent_jobs, stage='segment'):
+    """Entry point of a worker process: claim jobs of ``stage`` from the database and run them"""
+    # Ctrl-C is handled by the parent, which then shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+    from .jobs import claim_job, listen_for_jobs, worker_identity
+
+    name = f"{stage} worker {index}"
+    if stage == 'segment':
+        import torch
+        torch.set_num_threads(torch_threads)
+
+        from CODE_BRAINSEG.UNET_for_Multimodal_Semantic_Segmentation.registry import get_model
+        try:
+            get_model()
+        except Exception as e:
+            print(f"[{name}] Model preload failed: {str(e)}")
+
+    worker_id = worker_identity()
+    print(f"[{name}] ready as {worker_id} ({torch_threads} threads, cpus {cpus or 'any'})")
+
+    # Woken by NOTIFY on enqueue, by a finished job freeing a slot, or by shutdown
+    wake = threading.Event()
+    threading.Thread(target=listen_for_jobs, args=(wake, stop, stage), daemon=True,
+                     name='brainseg-listener').start()
+    threading.Thread(target=lambda: (stop.wait(), wake.set()), daemon=True,
+                     name='brainseg-stop').start()
+
+    # Jobs running side by side share batched forward passes
+    slots = threading.Semaphore(concurrent_jobs)
+    executor = ThreadPoolExecutor(max_workers=concurrent_jobs,
+                                  thread_name_prefix=f'brainseg-{stage}-{index}')
+    run = STAGE_RUNNERS[stage]
+
+    def finished(_):
+        slots.release()
+        wake.set()
+
+    while not stop.is_set():
+        if not slots.acquire(timeout=settings.BRAINSEG_JOB_POLL_SECONDS):
+            continue
+        try:
+            job = claim_job(worker_id, stage)
+        except Exception as e:
+            print(f"[{name}] Claim failed: {str(e)}")
+            job = None
+        if job is None:
+            slots.release()
+            # Retries whose backoff ran out and expired leases are not
+            # announced, the idle timeout picks those up
+            wake.wait(settings.BRAINSEG_JOB_POLL_SECONDS)
+            wake.clear()
+            continue
+        print(f"[{name}] claimed job {job.id} (attempt {job.attempts})")
+        executor.submit(run, job).add_done_callback(finished)
+
+    executor.shutdown(wait=True)
+    print(f"[{name}] stopped")
+
+
+class WorkerPool:
+    """
+    Supervised pool of segmentation worker processes on this node.
+
+    Workers claim jobs from the shared database queue themselves, so any
+    number of pools on any number of nodes can serve the same queue. Each
+    worker gets its own torch thread count and, optionally, a disjoint set of
+    CPUs. A supervisor thread restarts workers that die; the jobs they were
+    running are recovered by whichever worker claims them once their lease
+    expires, so a crash in native code never takes the web process down.
+
+    A pool serves one ``stage`` of the pipeline: 'segment' workers hold the
+    model, 'render' workers only draw previews from stored label maps.
+    """
+
+    def __init__(self, num_workers=1, torch_threads=None, cpu_affinity=True, concurrent_jobs=1,
+                 stage='segment'):
+        self.stage = stage
+        self.num_workers = max(int(num_workers), 1)
+        self.concurrent_jobs = max(int(concurrent_jobs), 1)
+        self.cpu_sets = self._partition_cpus(cpu_affinity)
+        self.torch_threads = torch_threads
+        self._ctx = multiprocessing.get_context('spawn')
+        self._stop = self._ctx.Event()
+        self._workers = {}
+        self._restarts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._supervisor = None
+
+    def _partition_cpus(self, cpu_affinity):
+        if not cpu_affinity or not hasattr(os, 'sched_getaffinity'):
+            return [None] * self.num_workers
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(len(cpus) // self.num_workers, 1)
+        return [
+            cpus[(i * per_worker) % len(cpus):(i * per_worker) % len(cpus) + per_worker]
+            for i in range(self.num_workers)
+        ]
+
+    def start(self):
+        for index in range(self.num_workers):
+            self._spawn(index)
+        self._supervisor = threading.Thread(target=self._watch_workers, daemon=True,
+                                            name='brainseg-pool-supervisor')
+        self._supervisor.start()
+        atexit.register(self.shutdown)
+        return self
+
+    def join(self):
+        """Block until the pool has been shut down"""
+        self._stopping.wait()
+        self._supervisor.join()
+
+    def shutdown(self, timeout=30):
+        """Let workers finish their current jobs, then stop them"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._stop.set()
+        with self._lock:
+            workers = list(self._workers.values())
+        deadline = time.monotonic() + timeout
+        for process in workers:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"Terminating {process.name}")
+                process.terminate()
+                process.join()
+        if self._supervisor is not None and self._supervisor is not threading.current_thread():
+            self._supervisor.join(timeout=5)
+
+    def _spawn(self, index):
+        cpus = self.cpu_sets[index]
+        torch_threads = self.torch_threads or (
+            len(cpus) if cpus else max(os.cpu_count() // self.num_workers, 1)
+        )
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self._stop, torch_threads, cpus, self.concurrent_jobs, self.stage),
+            name=f'brainseg-{self.stage}-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        with self._lock:
+            self._workers[index] = process
+
+    def _watch_workers(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                sentinels = {process.sentinel: index for index, process in self._workers.items()}
+            # Wakes up when a worker exits, the timeout only bounds shutdown latency
+            for sentinel in wait(list(sentinels), timeout=1.0):
+                if self._stopping.is_set():
+                    return
+                self._handle_exit(sentinels[sentinel])
+
+    def _handle_exit(self, index):
+        with self._lock:
+            process = self._workers[index]
+        process.join()
+        print(f"{process.name} exited unexpectedly with code {process.exitcode}, "
+              f"its jobs will be recovered when their leases expire")
+
+        delay = RESTART_BACKOFF[min(self._restarts[index], len(RESTART_BACKOFF) - 1)]
+        self._restarts[index] += 1
+        time.sleep(delay)
+        if not self._stopping.is_set():
+            self._spawn(index)
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def create_worker_pool(stage='segment', **overrides):
+    if stage == 'render':
+        # Rendering is numpy and zlib work, one thread per process is enough
+        options = {
+            'num_workers': settings.BRAINSEG_RENDER_WORKERS,
+            'torch_threads': 1,
+            'cpu_affinity': False,
+            'concurrent_jobs': 1,
+        }
+    else:
+        options = {
+            'num_workers': settings.BRAINSEG_WORKERS,
+            'torch_threads': settings.BRAINSEG_WORKER_THREADS,
+            'cpu_affinity': settings.BRAINSEG_WORKER_CPU_AFFINITY,
+            'concurrent_jobs': settings.BRAINSEG_CONCURRENT_JOBS,
+        }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return WorkerPool(stage=stage, **options)
+
+
+def ensure_embedded_workers():
+    """
+    Start segment and render worker pools inside this web process if
+    BRAINSEG_EMBEDDED_WORKERS is set. Dedicated nodes run
+    ``manage.py run_workers`` instead.
+    """
+    if not settings.BRAINSEG_EMBEDDED_WORKERS:
+        return None
+    if not _pools:
+        with _pool_lock:
+            if not _pools:
+                stages = ['segment'] + (['render'] if settings.BRAINSEG_RENDER_WORKERS else [])
+                for stage in stages:
+                    _pools[stage] = create_worker_pool(stage).start()
+    return _pools['segment']
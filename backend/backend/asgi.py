@@ -2,6 +2,9 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn backend.asgi:application``) for
+the status streams in api.streams, which hold their connection open without
+tying up a thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
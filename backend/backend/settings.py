@@ -107,6 +107,23 @@ DATABASES = {
     }
 } 
 
+# Job progress is kept in the cache. Redis lets the web and worker processes
+# share it; without REDIS_URL every process has a local-memory cache and job
+# progress is written to the database instead (see api.progress).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -157,6 +174,129 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 os.makedirs(os.path.join(MEDIA_ROOT, 'results'), exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'uploads'), exist_ok=True)
 
+# Segmentation model registry
+# Upper bound on memory held by loaded checkpoints, least recently used are evicted
+BRAINSEG_MODEL_MEMORY_MB = int(os.getenv('BRAINSEG_MODEL_MEMORY_MB', '0')) or None
+BRAINSEG_MODEL_WARMUP = os.getenv('BRAINSEG_MODEL_WARMUP', 'True') == 'True'
+# How often workers check for a replaced checkpoint file between jobs (0 disables)
+BRAINSEG_MODEL_RELOAD_SECONDS = float(os.getenv('BRAINSEG_MODEL_RELOAD_SECONDS', '10'))
+# Checkpoints converted with `manage.py convert_checkpoint` (a .safetensors file
+# next to the .pth) are memory-mapped and preferred when they are newer
+BRAINSEG_CHECKPOINTS = {
+    'best_model': 'best_model.pth',
+    'model_weights': 'model_weights.pth',
+    # Written by `manage.py quantize_model <calibration_dir>`
+    'best_model_int8': 'best_model.int8.ts.pt',
+}
+# Checkpoint used for uploads
+BRAINSEG_MODEL = os.getenv('BRAINSEG_MODEL', 'best_model')
+
+# Inference precision: fp32, bf16 (autocast, needs AVX512-BF16/AMX),
+# channels_last (channels_last_3d memory format) or bf16_channels_last.
+# Check a mode with `manage.py check_precision` before enabling it.
+BRAINSEG_PRECISION = os.getenv('BRAINSEG_PRECISION', 'fp32')
+
+# Execution engine: eager, torchscript, compile (torch.compile) or onnx
+# (ONNX Runtime CPU provider, needs onnxruntime). Non-eager backends are
+# checked against eager PyTorch at startup and fall back to eager on mismatch.
+# Export ahead of time with `manage.py export_model`.
+BRAINSEG_BACKEND = os.getenv('BRAINSEG_BACKEND', 'eager')
+BRAINSEG_BACKEND_SELF_TEST = os.getenv('BRAINSEG_BACKEND_SELF_TEST', 'True') == 'True'
+# Graph backends pad patch edges up to multiples of this so graphs are reused.
+# Patches are multiples of 16 already; a coarser bucket zero-pads them, which
+# changes the logits near their border.
+BRAINSEG_SHAPE_BUCKET = int(os.getenv('BRAINSEG_SHAPE_BUCKET', '16'))
+
+# Sliding-window inference, patch edges are rounded up to multiples of 16
+BRAINSEG_PATCH_SIZE = tuple(
+    int(v) for v in os.getenv('BRAINSEG_PATCH_SIZE', '128,128,128').split(',')
+)
+BRAINSEG_PATCH_OVERLAP = float(os.getenv('BRAINSEG_PATCH_OVERLAP', '0.5'))
+BRAINSEG_PATCH_BATCH_SIZE = int(os.getenv('BRAINSEG_PATCH_BATCH_SIZE', '1'))
+# Inference only runs on the nonzero bounding box plus this margin (voxels)
+BRAINSEG_CROP_MARGIN = int(os.getenv('BRAINSEG_CROP_MARGIN', '8'))
+# Intensity normalization over brain voxels: minmax, zscore or percentile
+# (clip to BRAINSEG_CLIP_PERCENTILES, then scale to [0, 1])
+BRAINSEG_NORMALIZATION = os.getenv('BRAINSEG_NORMALIZATION', 'minmax')
+BRAINSEG_CLIP_PERCENTILES = tuple(
+    float(v) for v in os.getenv('BRAINSEG_CLIP_PERCENTILES', '0.5,99.5').split(',')
+)
+# Peak memory ceiling per inference, the patch is shrunk until it fits
+BRAINSEG_INFERENCE_MEMORY_MB = int(os.getenv('BRAINSEG_INFERENCE_MEMORY_MB', '0')) or None
+
+# Worker processes running segmentation jobs. Each gets its own torch thread
+# count (defaults to its share of the CPUs) and, with affinity enabled, a
+# disjoint set of CPUs. Run them with `manage.py run_workers`. For local
+# development BRAINSEG_EMBEDDED_WORKERS=True makes the web process start its
+# own pools on the first upload instead; never set it under gunicorn, where
+# every web process would start pools of its own.
+BRAINSEG_EMBEDDED_WORKERS = os.getenv('BRAINSEG_EMBEDDED_WORKERS', 'False') == 'True'
+BRAINSEG_WORKERS = int(os.getenv('BRAINSEG_WORKERS', '1'))
+BRAINSEG_WORKER_THREADS = int(os.getenv('BRAINSEG_WORKER_THREADS', '0')) or None
+BRAINSEG_WORKER_CPU_AFFINITY = os.getenv('BRAINSEG_WORKER_CPU_AFFINITY', 'True') == 'True'
+
+# Durable job queue shared by all worker nodes. Claimed jobs hold a lease that
+# running workers renew, jobs of dead workers are reclaimed once it expires.
+BRAINSEG_JOB_LEASE_SECONDS = int(os.getenv('BRAINSEG_JOB_LEASE_SECONDS', '120'))
+BRAINSEG_JOB_HEARTBEAT_SECONDS = int(os.getenv('BRAINSEG_JOB_HEARTBEAT_SECONDS', '30'))
+BRAINSEG_JOB_MAX_ATTEMPTS = int(os.getenv('BRAINSEG_JOB_MAX_ATTEMPTS', '3'))
+BRAINSEG_JOB_RETRY_BACKOFF_SECONDS = int(os.getenv('BRAINSEG_JOB_RETRY_BACKOFF_SECONDS', '30'))
+# Idle workers are woken by NOTIFY, this bounds how late retries are noticed
+BRAINSEG_JOB_POLL_SECONDS = float(os.getenv('BRAINSEG_JOB_POLL_SECONDS', '5'))
+# Render worker processes per node. Inference workers hand each job over as
+# soon as its mask is stored ('mask_ready') and go on to the next one; with
+# 0 the previews are rendered inline by the inference worker.
+BRAINSEG_RENDER_WORKERS = int(os.getenv('BRAINSEG_RENDER_WORKERS', '1'))
+
+# Dynamic batching: jobs processed side by side in a worker share batched
+# forward passes. A batch runs when BRAINSEG_MAX_BATCH_SIZE patches are
+# waiting or after BRAINSEG_MAX_BATCH_WAIT_MS, a batch size of 1 disables it.
+BRAINSEG_CONCURRENT_JOBS = int(os.getenv('BRAINSEG_CONCURRENT_JOBS', '2'))
+BRAINSEG_MAX_BATCH_SIZE = int(os.getenv('BRAINSEG_MAX_BATCH_SIZE', '4'))
+BRAINSEG_MAX_BATCH_WAIT_MS = float(os.getenv('BRAINSEG_MAX_BATCH_WAIT_MS', '20'))
+# A job whose batched forward pass has not answered after this long fails
+# instead of waiting on a batcher that is gone
+BRAINSEG_BATCH_RESULT_TIMEOUT_SECONDS = float(os.getenv('BRAINSEG_BATCH_RESULT_TIMEOUT_SECONDS', '600'))
+
+# Results are stored under MEDIA_ROOT/results/<hash of the inputs and model>,
+# a re-uploaded study is answered from there without inference. Least recently
+# used results are removed above this size (0 disables the limit).
+BRAINSEG_RESULT_CACHE_MB = int(os.getenv('BRAINSEG_RESULT_CACHE_MB', '5120')) or None
+
+# Resumable uploads (/api/uploads/): chunks are written straight into MEDIA_ROOT/uploads
+BRAINSEG_UPLOAD_MAX_FILE_MB = int(os.getenv('BRAINSEG_UPLOAD_MAX_FILE_MB', '2048'))
+BRAINSEG_UPLOAD_MAX_CHUNK_MB = int(os.getenv('BRAINSEG_UPLOAD_MAX_CHUNK_MB', '64'))
+# Unfinished upload sessions idle for longer than this are deleted
+BRAINSEG_UPLOAD_SESSION_HOURS = int(os.getenv('BRAINSEG_UPLOAD_SESSION_HOURS', '48'))
+
+# Stored label maps: modalities are kept as uint8 copies subsampled by this
+# factor for the slice endpoint (/api/slice/<batch_id>/<axis>/<index>.png)
+BRAINSEG_SLICE_DOWNSAMPLE = int(os.getenv('BRAINSEG_SLICE_DOWNSAMPLE', '2'))
+# Decoded studies and rendered PNGs kept in memory per process
+BRAINSEG_SLICE_CACHE_STUDIES = int(os.getenv('BRAINSEG_SLICE_CACHE_STUDIES', '8'))
+BRAINSEG_SLICE_CACHE_IMAGES = int(os.getenv('BRAINSEG_SLICE_CACHE_IMAGES', '1024'))
+BRAINSEG_SLICE_MAX_AGE = int(os.getenv('BRAINSEG_SLICE_MAX_AGE', '86400'))
+
+# Animated slice sweep of each result: gif, webp, or mp4 (H.264, needs the
+# imageio-ffmpeg package), with this long on each slice
+BRAINSEG_ANIMATION_FORMAT = os.getenv('BRAINSEG_ANIMATION_FORMAT', 'gif')
+BRAINSEG_ANIMATION_FRAME_MS = int(os.getenv('BRAINSEG_ANIMATION_FRAME_MS', '150'))
+
+# Job progress lives in the shared cache for this long, only status changes
+# are written to the upload row. Without a shared cache (REDIS_URL) every new
+# step goes to the row instead; the same step repeated is written at most
+# every BRAINSEG_PROGRESS_DB_SECONDS.
+BRAINSEG_PROGRESS_TTL = int(os.getenv('BRAINSEG_PROGRESS_TTL', '3600'))
+BRAINSEG_PROGRESS_DB_SECONDS = float(os.getenv('BRAINSEG_PROGRESS_DB_SECONDS', '1'))
+
+# Status streams (/api/status/<id>/events/, /api/events/user/<user_id>/) need
+# the ASGI app. Streams close after BRAINSEG_STREAM_MAX_SECONDS and clients
+# reconnect; long polls (/api/status/<id>/wait/) wait at most this long.
+BRAINSEG_STREAM_KEEPALIVE_SECONDS = float(os.getenv('BRAINSEG_STREAM_KEEPALIVE_SECONDS', '15'))
+BRAINSEG_STREAM_MAX_SECONDS = float(os.getenv('BRAINSEG_STREAM_MAX_SECONDS', '300'))
+BRAINSEG_STREAM_RETRY_MS = int(os.getenv('BRAINSEG_STREAM_RETRY_MS', '3000'))
+BRAINSEG_LONG_POLL_SECONDS = float(os.getenv('BRAINSEG_LONG_POLL_SECONDS', '30'))
+
 # CORS configuration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
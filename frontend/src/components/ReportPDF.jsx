@@ -76,10 +76,18 @@ const ReportPDF = ({ results }) => {
   }
 
 
+  const formatVolume = (mm3) => {
+    return typeof mm3 === 'number' ? `${(mm3 / 1000).toFixed(2)} cm³` : 'N/A';
+  };
+
   const formatMetric = (value) => {
     return typeof value === 'number' ? `${(value * 100).toFixed(1)}%` : 'N/A';
   };
 
+  const volumes = results.metrics.label_volumes_mm3 || {};
+  const regions = results.metrics.volumes_mm3 || {};
+  const groundTruth = results.metrics.ground_truth;
+
 
   const getFixedImageUrl = (url) => {
     if (!url) return '';
@@ -117,28 +125,31 @@ const ReportPDF = ({ results }) => {
           <View style={styles.metricsContainer}>
             <Text style={styles.metricsTitle}>Analysis Results</Text>
             
-            {results.metrics && (
+            {[
+              ['Necrotic Core', volumes.necrotic_core],
+              ['Peritumoral Edema', volumes.edema],
+              ['GD-enhancing Tumor', volumes.enhancing_tumor],
+              ['Whole Tumor', regions.whole_tumor],
+            ].map(([label, value]) => (
+              <View style={styles.metricRow} key={label}>
+                <Text style={styles.metricLabel}>{label}:</Text>
+                <Text style={styles.metricValue}>{formatVolume(value)}</Text>
+              </View>
+            ))}
+
+            {groundTruth && (
               <>
-                <View style={styles.metricRow}>
-                  <Text style={styles.metricLabel}>Necrotic Core:</Text>
-                  <Text style={styles.metricValue}>
-                    {formatMetric(results.metrics.tumor_core)}
-                  </Text>
-                </View>
-
-                <View style={styles.metricRow}>
-                  <Text style={styles.metricLabel}>Peritumoral Edema:</Text>
-                  <Text style={styles.metricValue}>
-                    {formatMetric(results.metrics.whole_tumor)}
-                  </Text>
-                </View>
-
-                <View style={styles.metricRow}>
-                  <Text style={styles.metricLabel}>GD-enhancing Tumor:</Text>
-                  <Text style={styles.metricValue}>
-                    {formatMetric(results.metrics.enhancing_tumor)}
-                  </Text>
-                </View>
+                <Text style={[styles.metricsTitle, { marginTop: 10 }]}>Dice against ground truth</Text>
+                {[
+                  ['Whole Tumor', 'whole_tumor'],
+                  ['Tumor Core', 'tumor_core'],
+                  ['Enhancing Tumor', 'enhancing_tumor'],
+                ].map(([label, key]) => (
+                  <View style={styles.metricRow} key={key}>
+                    <Text style={styles.metricLabel}>{label}:</Text>
+                    <Text style={styles.metricValue}>{formatMetric(groundTruth.dice[key])}</Text>
+                  </View>
+                ))}
               </>
             )}
           </View>
@@ -9,9 +9,26 @@ const Reports = () => {
   const [reports, setReports] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const { currentUser } = useAuth();
   const navigate = useNavigate();
 
+  // One page of reports, newest first; the cursor comes from the previous page
+  const fetchPage = async (cursor) => {
+    const response = await axios.get(`/api/reports/${currentUser.uid}/`, {
+      params: cursor ? { cursor } : {}
+    });
+    console.log('Reports API Response:', response);
+
+    if (!response.data) {
+      throw new Error('No data received from server');
+    }
+
+    setNextCursor(response.data.next_cursor);
+    return response.data.results.filter(report => report.results);
+  };
+
   useEffect(() => {
     const fetchReports = async () => {
       if (!currentUser?.uid) {
@@ -24,19 +41,9 @@ const Reports = () => {
         setError(null);
         console.log('Fetching reports for user:', currentUser.uid);
 
-        const response = await axios.get(`/api/reports/${currentUser.uid}/`);
-        console.log('Reports API Response:', response);
-
-        if (!response.data) {
-          throw new Error('No data received from server');
-        }
-
-        const sortedReports = response.data
-          .filter(report => report.results)
-          .sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-
-        console.log('Processed reports:', sortedReports);
-        setReports(sortedReports);
+        const firstPage = await fetchPage(null);
+        console.log('Processed reports:', firstPage);
+        setReports(firstPage);
 
       } catch (error) {
         console.error('Error fetching reports:', error);
@@ -53,11 +60,24 @@ const Reports = () => {
 
   console.log('Current state:', { loading, error, reportsCount: reports.length });
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setReports(prev => [...prev, ...page]);
+    } catch (error) {
+      console.error('Error fetching reports:', error);
+      toast.error('Failed to load reports');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleViewResults = (report) => {
     const cleanedResults = {
       ...report.results,
-      static_image: report.results.static_image.replace('http://localhost:8000', ''),
-      gif: report.results.gif.replace('http://localhost:8000', '')
+      static_image: report.results.static_image?.replace('http://localhost:8000', ''),
+      gif: report.results.gif?.replace('http://localhost:8000', '')
     };
 
     navigate('/results', { 
@@ -144,6 +164,18 @@ const Reports = () => {
             </div>
           ))}
         </div>
+
+        {nextCursor && (
+          <div className="flex justify-center mt-6">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-4 py-2 bg-black text-white rounded-lg hover:bg-gray-800 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
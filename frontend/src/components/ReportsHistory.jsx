@@ -19,6 +19,32 @@ const ReportsHistory = () => {
     return `http://localhost:8000${cleanPath}`;
   };
 
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // One page of reports, newest first; the cursor comes from the previous page
+  const fetchPage = async (cursor) => {
+    const response = await axios.get(`/api/reports/${currentUser.uid}/`, {
+      params: cursor ? { cursor } : {}
+    });
+    const page = response.data.results
+      .filter(report => report.results && report.status === 'complete')
+      .map(report => ({
+        ...report,
+        thumbnail: getCleanUrl(report.thumbnail),
+        thumbnailSrcSet: Object.entries(report.thumbnails || {})
+          .map(([size, url]) => `${getCleanUrl(url)} ${size}w`)
+          .join(', '),
+        results: {
+          ...report.results,
+          static_image: getCleanUrl(report.results.static_image),
+          gif: getCleanUrl(report.results.gif)
+        }
+      }));
+    setNextCursor(response.data.next_cursor);
+    return page;
+  };
+
   useEffect(() => {
     const fetchReports = async () => {
       if (!currentUser?.uid) {
@@ -28,21 +54,7 @@ const ReportsHistory = () => {
 
       try {
         setLoading(true);
-        const response = await axios.get(`/api/reports/${currentUser.uid}/`);
-        
-        const sortedReports = response.data
-          .filter(report => report.results && report.status === 'complete')
-          .map(report => ({
-            ...report,
-            results: {
-              ...report.results,
-              static_image: getCleanUrl(report.results.static_image),
-              gif: getCleanUrl(report.results.gif)
-            }
-          }))
-          .sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-
-        setReports(sortedReports);
+        setReports(await fetchPage(null));
       } catch (error) {
         console.error('Error fetching reports:', error);
         toast.error('Failed to load reports');
@@ -54,6 +66,19 @@ const ReportsHistory = () => {
     fetchReports();
   }, [currentUser]);
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setReports(prev => [...prev, ...page]);
+    } catch (error) {
+      console.error('Error fetching reports:', error);
+      toast.error('Failed to load reports');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen bg-white flex items-center justify-center">
@@ -90,11 +115,15 @@ const ReportsHistory = () => {
 
               <div className="bg-[#EFEFEF] p-6 rounded-lg flex-1">
                 <div className="flex items-start gap-6">
-                  <div className="flex-shrink-0 w-2/3">
+                  <div className="flex-shrink-0 w-48">
+                    {/* Thumbnails keep the list light, reports from before they existed show the full preview */}
                     <img
-                      src={report.results.static_image}
+                      src={report.thumbnail || report.results.static_image}
+                      srcSet={report.thumbnailSrcSet || undefined}
+                      sizes="192px"
                       alt="Brain Scan Result"
                       className="w-full rounded-lg"
+                      loading="lazy"
                       onError={(e) => {
                         console.error('Image load error:', e);
                         e.target.src = 'fallback-image-url';
@@ -139,6 +168,18 @@ const ReportsHistory = () => {
             </div>
           ))}
         </div>
+
+        {nextCursor && (
+          <div className="flex justify-center mt-8">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-black hover:bg-background-dark text-white px-10 py-3 rounded-xl transition-all disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -39,6 +39,29 @@ const GifPlayer = ({ src }) => {
   );
 };
 
+const VideoPlayer = ({ src }) => {
+  const [isLoaded, setIsLoaded] = useState(false);
+
+  return (
+    <div className="relative w-full rounded-lg overflow-hidden bg-gray-100">
+      {!isLoaded && (
+        <div className="absolute inset-0 flex items-center justify-center">
+          <Loader2 className="w-8 h-8 animate-spin text-gray-400" />
+        </div>
+      )}
+      <video
+        src={src}
+        className={`w-full h-auto ${isLoaded ? 'opacity-100' : 'opacity-0'}`}
+        onLoadedData={() => setIsLoaded(true)}
+        autoPlay
+        loop
+        muted
+        playsInline
+      />
+    </div>
+  );
+};
+
 const Results = () => {
   const [results, setResults] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -88,7 +111,9 @@ const Results = () => {
   }
 
   const staticImageUrl = getCleanUrl(results.static_image);
-  const gifUrl = getCleanUrl(results.gif);
+  // mp4 animations are only published under 'animation', older results only have 'gif'
+  const animationUrl = getCleanUrl(results.animation?.url || results.gif);
+  const isVideo = results.animation?.format === 'mp4';
 
   return (
     <div className="min-h-screen bg-white p-4 md:p-8">
@@ -137,7 +162,7 @@ const Results = () => {
           <div className="bg-white rounded-xl shadow-[0_0_12px_8px_#5C5C5C] p-4 md:p-6">
             <h2 className="text-xl md:text-2xl font-semibold mb-4 text-gray-700 text-center">Dynamic View</h2>
             <div className="max-w-4xl mx-auto">
-              <GifPlayer src={gifUrl} />
+              {isVideo ? <VideoPlayer src={animationUrl} /> : <GifPlayer src={animationUrl} />}
             </div>
             <div className="mt-4 text-sm text-gray-600 text-center">
               <p>This animation shows the segmentation results across different slices of the brain scan.</p>
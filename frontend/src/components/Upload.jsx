@@ -24,6 +24,7 @@ const Upload = () => {
         visualization: { status: 'pending', progress: 0 }
     });
     const progressInterval = useRef(null);
+    const eventSource = useRef(null);
 
     const fileTypes = [
         {
@@ -74,29 +75,42 @@ const Upload = () => {
     };
 
 
-    const checkStatus = async (statusUrl) => {
-        try {
-            const response = await axios.get(statusUrl);
-            const { status, result } = response.data;
+    const showProgress = (value) => {
+        if (typeof value === 'number') {
+            setProgress(prev => Math.max(prev, value));
+        } else {
+            setProgress(prev => Math.min(prev + 2, 90));
+        }
+    };
 
-            if (status === 'failed') {
-                toast.error('Processing failed. Please try again.');
-                setUploading(false);
-                return;
-            }
+    // Returns true once the job is over
+    const showStatus = (status, result) => {
+        if (status === 'failed') {
+            toast.error('Processing failed. Please try again.');
+            setUploading(false);
+            return true;
+        }
 
-            if (status === 'complete' && result) {
-                setProgress(100);
-                setTimeout(() => {
-                    navigate('/results', { state: { results: result, isNewUpload: true } });
-                }, 1000);
-                return;
-            }
+        if (status === 'complete' && result) {
+            setProgress(100);
+            setTimeout(() => {
+                navigate('/results', { state: { results: result, isNewUpload: true } });
+            }, 1000);
+            return true;
+        }
+
+        showProgress(result?.progress);
+        return false;
+    };
 
-            if (progress < 90) {
-                setProgress(prev => Math.min(prev + 2, 90));
+    // Long poll: the server answers as soon as the status differs from the known one
+    const waitForStatus = async (statusUrl, known = {}) => {
+        try {
+            const response = await axios.get(`${statusUrl}wait/`, { params: { ...known, timeout: 25 } });
+            const { status, result } = response.data;
+            if (!showStatus(status, result)) {
+                waitForStatus(statusUrl, { status, progress: result?.progress });
             }
-            setTimeout(() => checkStatus(statusUrl), 1000);
         } catch (error) {
             console.error('Error checking status:', error);
             toast.error('Error checking processing status');
@@ -104,6 +118,39 @@ const Upload = () => {
         }
     };
 
+    const checkStatus = (statusUrl) => {
+        if (!window.EventSource) {
+            waitForStatus(statusUrl);
+            return;
+        }
+
+        const source = new EventSource(`${axios.defaults.baseURL}${statusUrl}events/`);
+        eventSource.current = source;
+        source.addEventListener('status', async (message) => {
+            const event = JSON.parse(message.data);
+            if (event.status !== 'complete' && event.status !== 'failed') {
+                showProgress(event.progress);
+                return;
+            }
+            // Events carry no results, fetch them once
+            source.close();
+            try {
+                const response = await axios.get(statusUrl);
+                showStatus(response.data.status, response.data.result);
+            } catch (error) {
+                console.error('Error fetching results:', error);
+                toast.error('Error checking processing status');
+                setUploading(false);
+            }
+        });
+        source.onerror = () => {
+            // The browser reconnects dropped streams itself; a refused one falls back to long polling
+            if (source.readyState === EventSource.CLOSED) {
+                waitForStatus(statusUrl);
+            }
+        };
+    };
+
     const handleUpload = async (e) => {
         e.preventDefault();
         setUploading(true);
@@ -136,6 +183,9 @@ const Upload = () => {
             if (progressInterval.current) {
                 clearInterval(progressInterval.current);
             }
+            if (eventSource.current) {
+                eventSource.current.close();
+            }
         };
     }, []);
 